@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import sys
+from revisionist.catalog import Catalog, build_catalog, build_log_index
+
+# The number of arguments of each command.  None: one or more.
+COMMANDS = {"build": 1, "index": 1, "log": 1, "copies": 1, "having": 1,
+            "cat": 2, "search": None}
+
+FILTERS = ["author:", "since:", "until:"]
+
+def parse_options():
+    "Parse command line options. See also print_usage."
+    args = sys.argv[1:]
+    if (len(args) < 2 or args[0] in ["-h", "--help"]
+        or args[1] not in COMMANDS
+        or COMMANDS[args[1]] not in [None, len(args) - 2]
+        or len(args) < 3):
+        print_usage()
+        return None, None, None
+    return args[0], args[1], args[2:]
+
+
+def parse_search(terms):
+    """
+    Split search terms into the arguments of Catalog.searchLog: words,
+    and the filters author:NAME, since:DATE and until:DATE.
+    """
+    words = []
+    filters = {}
+    for term in terms:
+        for prefix in FILTERS:
+            if term.startswith(prefix):
+                filters[prefix[:-1]] = term[len(prefix):]
+                break
+        else:
+            words.append(term)
+    return words, filters
+
+
+def print_node(node):
+    if node["copyfrom_path"] != None:
+        copy = " (from /%s@%d)" % (node["copyfrom_path"],
+                                   node["copyfrom_rev"])
+    else:
+        copy = ""
+    print "r%d %-7s /%s%s" % (node["rev"], node["action"], node["path"], copy)
+
+
+def print_revision(revision):
+    log = (revision["log"] or "").strip().split("\n")[0]
+    print "r%d %s %s  %s" % (revision["rev"], (revision["date"] or "")[:19],
+                             revision["author"] or "", log)
+
+
+def main():
+    dbPath, command, args = parse_options()
+    if dbPath == None:
+        return 1
+    if command == "build":
+        build_catalog(args[0], dbPath).close()
+        return 0
+    if command == "index":
+        build_log_index(args[0], dbPath).close()
+        return 0
+    catalog = Catalog(dbPath)
+    try:
+        if command == "log":
+            for node in catalog.history(args[0]):
+                print_node(node)
+        elif command == "copies":
+            for node in catalog.copySources(args[0]):
+                print_node(node)
+            for node in catalog.copiesOf(args[0]):
+                print_node(node)
+        elif command == "having":
+            for node in catalog.nodesWithProperty(args[0]):
+                print_node(node)
+        elif command == "cat":
+            node = catalog.node(args[0], int(args[1]))
+            if node == None or node["text_length"] == None:
+                print >>sys.stderr, "No text for %s@%s" % tuple(args)
+                return 1
+            sys.stdout.write(catalog.text(node))
+        elif command == "search":
+            words, filters = parse_search(args)
+            for revision in catalog.searchLog(words, **filters):
+                print_revision(revision)
+    finally:
+        catalog.close()
+    return 0
+
+def print_usage():
+    print >>sys.stderr, \
+"""
+ %s CATALOG COMMAND ARGS...
+
+ Commands:
+
+   build DUMPFILE  catalog DUMPFILE in the SQLite database CATALOG
+   index DUMPFILE  catalog only the revisions of DUMPFILE, for search
+   log PATH        list the nodes changing PATH or anything below it
+   copies PATH     list the nodes copying PATH, or something to PATH
+   having PROP     list the nodes setting the property PROP
+   cat PATH REV    print the text of PATH as stored in revision REV
+   search TERM...  list the revisions whose log messages contain all
+                   the words given, matched regardless of case.  A
+                   word ending in * matches words starting with it.
+                   author:NAME, since:DATE and until:DATE limit them
+                   further.  DATE is e.g. 2007, 2007-06 or 2007-06-30.
+
+ All but build and index answer from CATALOG, without parsing the
+ dumpfile.  cat reads the text directly from its offset in the
+ dumpfile.  index is much faster than build, as it skips over the
+ nodes, but the catalog it makes can only answer search.
+""" % (sys.argv[0],)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import sys
+import revisionist
+from revisionist.compare import compare_dumpfiles
+
+def parse_options():
+    "Parse command line options. See also print_usage."
+    args = sys.argv[1:]
+    processes = 1
+    validation = revisionist.STANDARD
+    revisions = None
+    while args and args[0] in ["--jobs", "-j", "--validation", "-V",
+                               "--revisions", "-r"]:
+        if len(args) < 2:
+            break
+        if args[0] in ["--jobs", "-j"]:
+            if not args[1].isdigit() or int(args[1]) < 1:
+                break
+            processes = int(args[1])
+        elif args[0] in ["--revisions", "-r"]:
+            revisions = parse_range(args[1])
+            if revisions == None:
+                break
+        else:
+            validation = args[1]
+            if validation not in revisionist.validation.LEVELS:
+                break
+        del args[:2]
+    if len(args) != 2 or [arg for arg in args if arg.startswith("-")]:
+        print_usage()
+        return None, None, None, None
+    return args, processes, validation, revisions
+
+
+def parse_range(text):
+    """
+    Parse FIRST:LAST, where either may be left out, into a tuple.
+    Returns None if text is not of this form.
+    """
+    bounds = text.split(":")
+    if len(bounds) != 2:
+        return None
+    result = []
+    for bound in bounds:
+        if bound == "":
+            # left out: "and int(bound) or None" would drop 0 as well
+            result.append(None)
+        elif bound.isdigit():
+            result.append(int(bound))
+        else:
+            return None
+    return tuple(result)
+
+
+def main():
+    paths, processes, validation, revisions = parse_options()
+    if paths == None:
+        return 1
+    count = 0
+    for difference in compare_dumpfiles(paths[0], paths[1], validation,
+                                        processes, revisions):
+        print difference
+        count += 1
+    print "%d differences" % (count,)
+    if count:
+        return 1
+    return 0
+
+def print_usage():
+    print >>sys.stderr, \
+"""
+ %s [--jobs N] [--validation LEVEL] [--revisions FIRST:LAST] LEFT RIGHT
+
+ List the differences between the dumpfiles LEFT and RIGHT: a line per
+ revision or node which only one of them has, and per dump header or
+ property whose value differs, followed by the number of differences.
+ The exit status is 1 if there are any.
+
+ Revisions are matched by number, nodes by path and action.  Text is
+ compared by its Text-content-md5, without reading it, where there is
+ one.
+
+ --jobs (-j) N compares ranges of revisions in N processes at a time.
+
+ --revisions (-r) FIRST:LAST compares only these revisions.  Either
+ may be left out.
+
+ --validation (-V) LEVEL is one of paranoid, standard (the default) or
+ trust-input.  Unless it is trust-input, text is read to verify its
+ Text-content-md5.
+""" % (sys.argv[0],)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
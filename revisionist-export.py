@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import sys
+from revisionist.catalog import Catalog
+from revisionist.export import export_tree
+
+def parse_options():
+    "Parse command line options. See also print_usage."
+    args = sys.argv[1:]
+    processes = None
+    dbPath = None
+    while args and args[0] in ["--jobs", "-j", "--catalog", "-c"]:
+        if len(args) < 2:
+            break
+        if args[0] in ["--jobs", "-j"]:
+            if not args[1].isdigit() or int(args[1]) < 1:
+                break
+            processes = int(args[1])
+        else:
+            dbPath = args[1]
+        del args[:2]
+    if (len(args) != 3 or args[0].startswith("-")
+        or not args[1].isdigit()):
+        print_usage()
+        return None, None, None, None, None
+    return args[0], int(args[1]), args[2], processes, dbPath
+
+
+def megabytes(n):
+    return n / (1024.0 * 1024.0)
+
+
+def main():
+    dumpPath, rev, dstDir, processes, dbPath = parse_options()
+    if dumpPath == None:
+        return 1
+    catalog = None
+    if dbPath != None:
+        catalog = Catalog(dbPath)
+    try:
+        result = export_tree(dumpPath, rev, dstDir, processes, catalog)
+    finally:
+        if catalog != None:
+            catalog.close()
+    print "%d files, %d directories, %.1f MB in %.1f s" % (
+        result.files, result.directories, megabytes(result.bytes),
+        result.seconds)
+    return 0
+
+def print_usage():
+    print >>sys.stderr, \
+"""
+ %s [--jobs N] [--catalog CATALOG] DUMPFILE REV DIRECTORY
+
+ Write the files and directories of revision REV of DUMPFILE into
+ DIRECTORY, as svn export would, without loading the dumpfile into a
+ repository.  Only the headers of the nodes up to REV are read, and
+ the texts of the files REV has.  Properties are not applied.
+
+ --jobs (-j) N writes files in N processes.  The default is one per
+ CPU.
+
+ --catalog (-c) CATALOG takes the nodes from CATALOG (see
+ revisionist-catalog.py build) instead of reading their headers.
+""" % (sys.argv[0],)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
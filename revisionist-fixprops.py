@@ -1,20 +1,55 @@
 #!/usr/bin/env python
 #-*- coding: utf-8 -*-
 
+import os
 import sys
+import stat
+import time
+import json
+import Queue
+import socket
+import signal
+import traceback
+import threading
+import multiprocessing
 import revisionist
+from revisionist.util import file_size
+from revisionist.cache import LRUCache
 from fnmatch import fnmatchcase
 
-def parse_options():
-    "Parse command line options. See also print_usage."
-    args = sys.argv[1:]
+def parse_options(args=None, usage=None):
+    """
+    Parse command line options, sys.argv[1:] unless args are given.
+    See also print_usage, which is called on bad options unless
+    another usage function is given.
+    """
+    def fail():
+        (usage or print_usage)()
+        return None, None, None, None, None
+    if args == None:
+        args = sys.argv[1:]
+    args = list(args)
     args.append(None)
     if args[0] in ["-h", "--help", None]:
-        print_usage()
-        return None, None
+        return fail()
     verbose = False
+    deltas = False
+    validation = revisionist.STANDARD
+    path_map = None
+    normalize = [False, False]
+    binary = [False, False]
+    follow = [False, None]
+    server = [None, None]
+    jobs = None
+    suffix = ".fixed"
     propsubs = []
-    while args[0] in ["--property", "-p", "--verbose", "-v"]:
+    while args[0] in ["--property", "-p", "--verbose", "-v",
+                      "--deltas", "-d", "--validation", "-V",
+                      "--map-paths", "-m", "--normalize-text", "-t",
+                      "--unexpand-keywords", "-k", "--jobs", "-j",
+                      "--suffix", "--read-binary", "--write-binary",
+                      "--follow", "-f", "--idle-timeout",
+                      "--serve", "--connect"]:
         if args[0] in ["--property", "-p"]:
             del args[0]
             propname = args[0]; del args[0]
@@ -33,17 +68,91 @@ def parse_options():
         elif args[0] in ["--verbose", "-v"]:
             del args[0]
             verbose = True
-    if len(args) != 1 or args[0] != None:
-        print_usage()
-        return []
-    else:
-        return propsubs, verbose
+        elif args[0] in ["--deltas", "-d"]:
+            del args[0]
+            deltas = True
+        elif args[0] in ["--validation", "-V"]:
+            del args[0]
+            validation = args[0]; del args[0]
+            if validation not in revisionist.validation.LEVELS:
+                return fail()
+        elif args[0] in ["--map-paths", "-m"]:
+            del args[0]
+            if args[0] == None:
+                return fail()
+            path_map = read_path_map(args[0]); del args[0]
+        elif args[0] in ["--normalize-text", "-t"]:
+            del args[0]
+            normalize[0] = True
+        elif args[0] in ["--unexpand-keywords", "-k"]:
+            del args[0]
+            normalize[1] = True
+        elif args[0] == "--read-binary":
+            del args[0]
+            binary[0] = True
+        elif args[0] == "--write-binary":
+            del args[0]
+            binary[1] = True
+        elif args[0] in ["--follow", "-f"]:
+            del args[0]
+            follow[0] = True
+        elif args[0] == "--idle-timeout":
+            del args[0]
+            if args[0] == None or not args[0].isdigit():
+                return fail()
+            follow[1] = int(args[0]); del args[0]
+        elif args[0] in ["--serve", "--connect"]:
+            server[0] = args[0][2:]; del args[0]
+            if not args[0]:
+                return fail()
+            server[1] = args[0]; del args[0]
+        elif args[0] in ["--jobs", "-j"]:
+            del args[0]
+            if args[0] == None or not args[0].isdigit() or int(args[0]) < 1:
+                return fail()
+            jobs = int(args[0]); del args[0]
+        elif args[0] == "--suffix":
+            del args[0]
+            if not args[0]:
+                return fail()
+            suffix = args[0]; del args[0]
+    inputs = args[:-1]
+    if [arg for arg in inputs if arg.startswith("-")]:
+        return fail()
+    if (server[0] == "serve" and inputs
+        or server[0] == "connect" and not inputs):
+        return fail()
+    plan = (propsubs, verbose, deltas, validation, path_map, normalize,
+            binary, follow)
+    return plan, inputs, jobs, suffix, server
 
 
-def main():
-    propsubs, verbose = parse_options()
-    if propsubs == None:
-        return 1
+def read_path_map(path):
+    """
+    Read the lines 'OLD NEW' of the file path, ignoring blank lines and
+    comments starting with '#'.  Returns a list of (OLD, NEW) pairs.
+    """
+    path_map = []
+    for line in file(path):
+        fields = line.split("#")[0].split()
+        if len(fields) == 2:
+            path_map.append(tuple(fields))
+        elif fields:
+            raise ValueError("%s: expected OLD NEW, found: %s"
+                             % (path, line.strip()))
+    return path_map
+
+
+def fix_dumpfile(plan, srcFile, dstFile, memos=None):
+    """
+    Apply plan, as returned by parse_options, to the dumpfile read
+    from srcFile, writing the result to dstFile.
+
+    memos, if not None, is an LRUCache in which the memos of property
+    edits are kept from one call to the next, by what the edits do.
+    """
+    (propsubs, verbose, deltas, validation,
+     path_map, normalize, binary, follow) = plan
 
     def edit(props):
         for propname in props:
@@ -55,23 +164,456 @@ def main():
                     props[propname] = val
 
     propnames = [propname for propname, x in propsubs]
-    events = revisionist.pull(sys.stdin)
+    if binary[0]:
+        events = revisionist.pull_binary(srcFile)
+    elif follow[0]:
+        events = revisionist.pull(srcFile, validation, revisionist.Follow(
+            timeout=follow[1], on_wait=dstFile.flush))
+    else:
+        events = revisionist.pull(srcFile, validation)
     if verbose:
         events = revisionist.echo_properties(events, propnames)
-    events = revisionist.edit_properties(events, edit)
+    # edit and remap_paths change properties by what they are, not
+    # where, so that editing each distinct property block once will do.
+    memo_size = revisionist.editors.MEMO_SIZE
+    edit_memo = remap_memo = None
+    if memos != None:
+        edit_memo = shared_memo(memos, ("edit", tuple(
+            [(propname, tuple(r)) for propname, r in propsubs])))
+        remap_memo = shared_memo(memos, ("remap", tuple(path_map or ())))
+    events = revisionist.edit_properties(events, edit, memo_size, edit_memo)
+    if path_map:
+        events = revisionist.remap_paths(events, path_map, mergeinfo=True,
+                                         memo_size=memo_size, memo=remap_memo)
+    if True in normalize:
+        events = revisionist.normalize_text(events, *normalize)
     if verbose:
         events = revisionist.echo_properties(events, propnames)
-    revisionist.write_events_to_dumpfile(events, sys.stdout)
+    if binary[1]:
+        if deltas:
+            events = revisionist.make_text_deltas(events)
+        revisionist.write_binary(events, dstFile)
+    else:
+        revisionist.write_events_to_dumpfile(events, dstFile, deltas,
+                                             validation, follow[0])
+
+
+def shared_memo(memos, key):
+    """
+    Returns the property memo kept in memos under key, adding an empty
+    one if there is none.
+    """
+    memo = memos.get(key)
+    if memo == None:
+        memo = memos[key] = revisionist.property_memo()
+    return memo
+
+
+def batch_inputs(inputs, suffix):
+    """
+    Returns the dumpfiles named by inputs: files, or directories, all
+    files in which are taken, except earlier outputs and logs.
+    """
+    paths = []
+    for path in inputs:
+        if not os.path.isdir(path):
+            paths.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            if (name.startswith(".") or name.endswith(suffix)
+                or name.endswith(suffix + ".part")
+                or name.endswith(suffix + ".log")):
+                continue
+            if os.path.isfile(os.path.join(path, name)):
+                paths.append(os.path.join(path, name))
+    return paths
+
+
+# The property memos of the process calling fix_worker, kept from one
+# dumpfile to the next: four of them, each of MEMO_SIZE at most.
+worker_memos = LRUCache(4 * revisionist.editors.MEMO_SIZE,
+                        lambda memo: memo.max_size)
+
+def fix_worker(args):
+    """
+    Fix one dumpfile of a batch, writing the output to the path output,
+    and everything that would have gone to stderr to a log next to
+    that.  Returns a tuple (path, size, seconds, error), where error is
+    None if all went well.
+    """
+    plan, path, output = args
+    start = time.time()
+    error = None
+    try:
+        log = file(output + ".log", "w")
+    except IOError, e:
+        return path, file_size(path), 0.0, str(e)
+    stderr, sys.stderr = sys.stderr, log
+    try:
+        try:
+            fix_dumpfile(plan, file(path, "rb"), file(output + ".part", "wb"),
+                         worker_memos)
+            os.rename(output + ".part", output)
+        except Exception, e:
+            error = str(e).strip() or e.__class__.__name__
+            traceback.print_exc(file=log)
+            if os.path.exists(output + ".part"):
+                os.unlink(output + ".part")
+        seconds = time.time() - start
+        if error == None:
+            print >>log, "wrote %s in %.1f s" % (output, seconds)
+        else:
+            print >>log, "FAILED, no output written"
+    finally:
+        sys.stderr = stderr
+        log.close()
+    return path, file_size(path), seconds, error
+
+
+def fix_batch(plan, paths, suffix, jobs=None):
+    """
+    Fix the dumpfiles at paths, largest first, jobs at a time.
+    Returns a dictionary mapping each path to the result of its
+    fix_worker.
+    """
+    if jobs == None:
+        jobs = multiprocessing.cpu_count()
+    work = [(plan, path, path + suffix)
+            for path in sorted(paths, key=file_size, reverse=True)]
+    if min(jobs, len(paths)) <= 1:
+        return dict([(args[1], fix_worker(args)) for args in work])
+    pool = multiprocessing.Pool(min(jobs, len(paths)))
+    try:
+        results = {}
+        for result in pool.imap_unordered(fix_worker, work):
+            results[result[0]] = result
+        pool.close()
+        return results
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def megabytes(n):
+    return n / (1024.0 * 1024.0)
+
+
+def report(paths, results, seconds, suffix):
+    """
+    Print a line per dumpfile of a batch and a summary, returning the
+    exit status.
+    """
+    total = 0
+    failed = 0
+    for path in paths:
+        path, size, took, error = results[path]
+        total += size
+        if error == None:
+            print "ok      %s  %.1f MB  %.1f s" % (path, megabytes(size),
+                                                   took)
+        else:
+            failed += 1
+            print "FAILED  %s  (see %s)" % (path, path + suffix + ".log")
+            print "        " + error.splitlines()[0]
+    print "%d dumpfiles, %d failed, %.1f MB in %.1f s" % (
+        len(paths), failed, megabytes(total), seconds)
+    if failed:
+        return 1
+    return 0
+
+
+def serve(socketPath, jobs=None):
+    """
+    Fix dumpfiles for the clients of the Unix domain socket socketPath,
+    jobs at a time, until interrupted or terminated.  See print_usage
+    for what clients send and get.  Each connection is served by a
+    thread of its own, which hands the jobs to a pool of processes.
+    """
+    if os.path.exists(socketPath):
+        if not stat.S_ISSOCK(os.stat(socketPath).st_mode):
+            print >>sys.stderr, "%s exists, and is no socket." % socketPath
+            return 1
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                probe.connect(socketPath)
+            except socket.error:
+                # left behind by a server which is gone
+                os.unlink(socketPath)
+            else:
+                print >>sys.stderr, "%s is served already." % socketPath
+                return 1
+        finally:
+            probe.close()
+    if jobs == None:
+        jobs = multiprocessing.cpu_count()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Clients have files read and written as the server's user, so
+    # only that user may connect.  The socket is made so from the
+    # start, rather than chmod'ed once others could have connected.
+    umask = os.umask(077)
+    try:
+        listener.bind(socketPath)
+    finally:
+        os.umask(umask)
+    try:
+        listener.listen(64)
+        # the pool first: its processes should die of SIGTERM
+        pool = multiprocessing.Pool(jobs)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        plans = PlanCache()
+        print >>sys.stderr, "serving %s with %d processes" % (socketPath,
+                                                              jobs)
+        try:
+            try:
+                while True:
+                    conn, address = listener.accept()
+                    thread = threading.Thread(target=serve_connection,
+                                              args=(conn, pool, plans))
+                    thread.setDaemon(True)
+                    thread.start()
+            except KeyboardInterrupt:
+                pass
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        listener.close()
+        os.unlink(socketPath)
+    return 0
+
+
+class PlanCache(object):
+    """
+    The plans of the last few distinct options sent by clients, so
+    that each is parsed, and its path map read, once.  A plan is kept
+    by its options and the modification times of its path maps: a path
+    map which changes is read again.
+    """
+
+    def __init__(self, size=64):
+        self.plans = LRUCache(size, lambda plan: 1)
+        self.lock = threading.Lock()
+
+    def get(self, options):
+        """
+        Returns the plan for options, or raises ValueError if they are
+        not fit for a job.
+        """
+        mtimes = []
+        for i, arg in enumerate(options[:-1]):
+            if arg in ["--map-paths", "-m"]:
+                try:
+                    mtimes.append(os.stat(options[i + 1]).st_mtime)
+                except OSError:
+                    mtimes.append(None)
+        key = (tuple(options), tuple(mtimes))
+        self.lock.acquire()
+        try:
+            plan = self.plans.get(key)
+        finally:
+            self.lock.release()
+        if plan != None:
+            return plan
+        try:
+            plan, inputs, jobs, suffix, server = parse_options(
+                options, lambda: None)
+        except (IOError, ValueError, IndexError), e:
+            raise ValueError(str(e))
+        if plan == None or inputs or server[0] != None:
+            raise ValueError("invalid options: %s"
+                             % (" ".join(options) or "none"))
+        follow = plan[7]
+        if follow[0] and follow[1] == None:
+            # would keep a process of the pool to itself for good
+            raise ValueError("--follow needs an --idle-timeout")
+        self.lock.acquire()
+        try:
+            self.plans[key] = plan
+        finally:
+            self.lock.release()
+        return plan
+
+
+def serve_connection(conn, pool, plans):
+    """
+    Start a job in pool for each line sent over the connection conn,
+    answering each with a line of its own once it is done.  Jobs run
+    concurrently, so their answers may come in another order.
+    """
+    replies = Queue.Queue()
+    writer = threading.Thread(target=write_replies, args=(conn, replies))
+    writer.setDaemon(True)
+    writer.start()
+    count = 0
+    reader = conn.makefile("rb")
+    try:
+        for line in reader:
+            if line.strip():
+                count += 1
+                start_job(line, pool, plans, replies.put)
+    finally:
+        reader.close()
+        # the writer closes conn after count replies
+        replies.put(count)
+
+
+def start_job(line, pool, plans, answer):
+    """
+    Start the job described by line in pool, calling answer with the
+    reply once it is done.
+    """
+    received = time.time()
+    request = {}
+    try:
+        request = json.loads(line)
+        if type(request) != dict:
+            request = {}
+            raise ValueError("a job must be a JSON object")
+        path = request["input"].encode("utf-8")
+        output = request.get("output", path + ".fixed").encode("utf-8")
+        if not os.path.isabs(path) or not os.path.isabs(output):
+            raise ValueError("input and output must be absolute paths")
+        options = [arg.encode("utf-8") for arg in request.get("options", [])]
+        plan = plans.get(options)
+    except (ValueError, KeyError, TypeError, AttributeError), e:
+        answer(job_reply(request, received, 0, 0.0,
+                         "bad job: %s" % (str(e) or e.__class__.__name__)))
+        return
+    def done(result):
+        answer(job_reply(request, received, *result[1:]))
+    pool.apply_async(fix_worker, [(plan, path, output)], callback=done)
+
+
+def job_reply(request, received, size, seconds, error):
+    """
+    Returns the reply to request, for the job received at the time
+    received: the result of fix_worker, and the time taken since.
+    """
+    return {"id": request.get("id"),
+            "input": request.get("input"),
+            "output": request.get("output"),
+            "status": error == None and "ok" or "failed",
+            "error": error,
+            "size": size,
+            "seconds": round(seconds, 3),
+            "elapsed": round(time.time() - received, 3)}
+
+
+def write_replies(conn, replies):
+    """
+    Send the replies put into the queue replies to conn, a line of
+    JSON each, until the number of replies put into it after them have
+    all been sent.  Then close conn.
+    """
+    sent = 0
+    expected = None
+    try:
+        while expected == None or sent < expected:
+            reply = replies.get()
+            if type(reply) == int:
+                expected = reply
+                continue
+            sent += 1
+            try:
+                conn.sendall(json.dumps(reply) + "\n")
+            except socket.error:
+                # the client is gone, but its jobs get done
+                pass
+    finally:
+        conn.close()
+
+
+def connect(socketPath, options, inputs, suffix):
+    """
+    Have the server at socketPath fix the dumpfiles named by inputs,
+    with options, as batch mode would here.  Returns the exit status.
+    """
+    options = list(options)
+    for i, arg in enumerate(options[:-1]):
+        if arg in ["--map-paths", "-m"]:
+            options[i + 1] = os.path.abspath(options[i + 1])
+    paths = [os.path.abspath(path) for path in batch_inputs(inputs, suffix)]
+    start = time.time()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socketPath)
+    except socket.error, e:
+        print >>sys.stderr, "%s: %s" % (socketPath, e)
+        return 1
+    results = {}
+    try:
+        for i, path in enumerate(paths):
+            client.sendall(json.dumps({"id": i, "input": path,
+                                       "output": path + suffix,
+                                       "options": options}) + "\n")
+        client.shutdown(socket.SHUT_WR)
+        for line in client.makefile("rb"):
+            reply = json.loads(line)
+            path = paths[reply["id"]]
+            error = reply["error"]
+            if error != None:
+                error = error.encode("utf-8")
+            results[path] = (path, reply["size"], reply["seconds"], error)
+    finally:
+        client.close()
+    for path in paths:
+        if path not in results:
+            results[path] = (path, file_size(path), 0.0,
+                             "the server did not answer")
+    return report(paths, results, time.time() - start, suffix)
+
+
+def main():
+    plan, inputs, jobs, suffix, server = parse_options()
+    if plan == None:
+        return 1
+    if server[0] == "serve":
+        return serve(server[1], jobs)
+    if server[0] == "connect":
+        # the options to send: all but --connect SOCKET and the inputs
+        options = sys.argv[1:len(sys.argv) - len(inputs)]
+        i = options.index("--connect")
+        del options[i:i + 2]
+        return connect(server[1], options, inputs, suffix)
+    if not inputs:
+        fix_dumpfile(plan, sys.stdin, sys.stdout)
+        return 0
+    paths = batch_inputs(inputs, suffix)
+    start = time.time()
+    results = fix_batch(plan, paths, suffix, jobs)
+    return report(paths, results, time.time() - start, suffix)
 
 def print_usage():
     print >>sys.stderr, \
 """
  %s OPTIONS < dumpfile.in > dumpfile.out
+ %s OPTIONS INPUT...
+ %s --serve SOCKET [--jobs N]
+ %s --connect SOCKET OPTIONS INPUT...
 
  Legal option combinations are described by this BNF:
 
- OPTIONS         = HelpOpt | PropertyClause* 
+ OPTIONS         = HelpOpt | ( GlobalOpt* PropertyClause* )
  HelpOpt         = -h | --help
+ GlobalOpt       = DeltasOpt | ValidationClause | MapClause
+                 | NormalizeTextOpt | UnexpandOpt
+                 | JobsClause | SuffixClause | BinaryOpt
+                 | FollowOpt | IdleTimeoutClause | ServerClause
+ DeltasOpt       = -d | --deltas
+ ValidationClause= ( -V | --validation ) Level
+ Level           = paranoid | standard | trust-input
+ MapClause       = ( -m | --map-paths ) MapFile
+ MapFile         = file of lines: OldPrefix NewPrefix
+ NormalizeTextOpt= -t | --normalize-text
+ UnexpandOpt     = -k | --unexpand-keywords
+ JobsClause      = ( -j | --jobs ) number
+ SuffixClause    = --suffix text
+ BinaryOpt       = --read-binary | --write-binary
+ FollowOpt       = -f | --follow
+ IdleTimeoutClause = --idle-timeout seconds
+ ServerClause    = ( --serve | --connect ) socket
+ INPUT           = dumpfile, or directory of dumpfiles
  PropertyClause  = PropertyOpt PropertyName EditClause*
  PropertyOpt     = -p | --property
  PropertyName    = text (unix-style glob syntax accepted)
@@ -91,7 +633,73 @@ def print_usage():
     'svn://new.com/repos' in every svn:externals property in the
     dumpfile.
  2. Normalize the line breaks in every svn:externals property.
-""" % (sys.argv[0], sys.argv[0])
+
+ --deltas writes a version 3 dumpfile in which the text of each node
+ is stored as a delta against its previous version.
+
+ --map-paths moves every path starting with OldPrefix to NewPrefix,
+ using the longest matching OldPrefix.  Node-path, Node-copyfrom-path
+ and the paths in svn:mergeinfo are rewritten.  Use / for the root.
+ The add of a directory moved to the root is dropped; deleting it, or
+ adding it with properties or as a copy, is refused.
+
+ --normalize-text changes the line endings of the text of files with
+ svn:eol-style set to LF.  --unexpand-keywords unexpands the keywords
+ named by svn:keywords in the text of files.
+
+ --validation chooses how thoroughly input and output are checked:
+ paranoid (everything, hashing text twice), standard (lengths and
+ md5, the default) or trust-input (structure only).
+
+ --read-binary and --write-binary read and write parse events in
+ revisionist's binary form instead of as dumpfiles, for passing them
+ from one process to the next without parsing them again:
+
+ %s -m moves.txt --write-binary < in.dump |
+   %s --read-binary -t > out.dump
+
+ --follow reads a dumpfile which is still being written, as by
+ svnadmin dump --incremental > dumpfile, waiting for more when it
+ reaches its end, as tail -f does.  Output is flushed at the end of
+ each revision, and whenever waiting.  It ends with the dumpfile once
+ --idle-timeout seconds pass without it growing, or on interrupt.
+
+ Given INPUTs, each dumpfile (directories: every file in them) is fixed
+ in turn, writing dumpfile + suffix (default .fixed) and a log,
+ dumpfile + suffix + .log, next to it.  --jobs N fixes N dumpfiles at
+ a time, largest first; the default is one per CPU.  A summary is
+ printed at the end; the exit status is 1 if any dumpfile failed.
+
+ --serve listens on the Unix domain socket SOCKET, fixing dumpfiles
+ for clients --jobs N at a time, until interrupted or terminated.
+ Jobs read and write whatever paths they name as the user running the
+ server, so SOCKET is made accessible to that user alone.
+ Let others in by changing its mode or group yourself, only if they
+ may write wherever that user can.
+ This spares running many small jobs the cost of starting Python,
+ parsing options and reading path maps each time, and property edits
+ are remembered from one job to the next.  A client sends a line of
+ JSON per job:
+
+ {"id": 1, "input": "/abs/in.dump", "output": "/abs/out.dump",
+  "options": ["-p", "svn:*", "-n"]}
+
+ options are the OPTIONS of a command line, without INPUTs, output
+ defaults to input + .fixed, and id is optional.  The
+ output is written as in batch mode, log included.  Each job is
+ answered by a line of JSON once done, in the order jobs finish:
+
+ {"id": 1, "input": ..., "output": ..., "status": "ok", "error": null,
+  "size": 1042, "seconds": 0.012, "elapsed": 0.015}
+
+ status is ok or failed, error says why, size is that of the input,
+ seconds how long fixing took and elapsed how long since the server
+ received the job.  The server closes the connection once the client
+ has shut down its side and all jobs are answered.
+
+ --connect sends the INPUTs to the server at SOCKET as jobs with
+ OPTIONS, and reports on them as batch mode does.
+""" % ((sys.argv[0],) * 7)
 
 
 if __name__ == "__main__":
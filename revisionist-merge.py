@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import sys
+import revisionist
+
+def parse_options():
+    "Parse command line options. See also print_usage."
+    args = sys.argv[1:]
+    if not args or args[0] in ["-h", "--help"]:
+        print_usage()
+        return None, None
+    renumber = False
+    if args[0] in ["--renumber", "-r"]:
+        del args[0]
+        renumber = True
+    if not args:
+        print_usage()
+        return None, None
+    return args, renumber
+
+
+def main():
+    paths, renumber = parse_options()
+    if paths == None:
+        return 1
+    srcFiles = (file(path, "rb") for path in paths)
+    revisionist.merge_dumpfiles(srcFiles, sys.stdout, renumber)
+
+def print_usage():
+    print >>sys.stderr, \
+"""
+ %s [--renumber] DUMPFILE... > dumpfile.out
+
+ Concatenate the given dumpfiles, in the order given, into a single
+ dumpfile.  Typically these are a series of --incremental dumps.
+
+ Each dumpfile must start with the revision following the last
+ revision of the dumpfile before it, unless --renumber (-r) is given.
+ Then each dumpfile's revisions are renumbered to follow those of the
+ dumpfile before it, and Node-copyfrom-rev is adjusted to match.
+""" % (sys.argv[0],)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import sys
+import revisionist
+from revisionist.blobs import BlobStore, thin_events, rehydrate_events, \
+     MIN_SIZE
+
+def parse_options():
+    "Parse command line options. See also print_usage."
+    args = sys.argv[1:]
+    rehydrate = False
+    validation = revisionist.STANDARD
+    min_size = MIN_SIZE
+    while args and args[0] in ["--rehydrate", "-r", "--validation", "-V",
+                               "--min-size"]:
+        if args[0] in ["--rehydrate", "-r"]:
+            rehydrate = True
+            del args[0]
+            continue
+        if len(args) < 2:
+            break
+        if args[0] == "--min-size":
+            if not args[1].isdigit():
+                break
+            min_size = int(args[1])
+        else:
+            validation = args[1]
+            if validation not in revisionist.validation.LEVELS:
+                break
+        del args[:2]
+    if len(args) != 1 or args[0].startswith("-"):
+        print_usage()
+        return None, None, None, None
+    return args[0], rehydrate, validation, min_size
+
+
+def megabytes(n):
+    return n / (1024.0 * 1024.0)
+
+
+def main():
+    storePath, rehydrate, validation, min_size = parse_options()
+    if storePath == None:
+        return 1
+    store = BlobStore(storePath)
+    events = revisionist.pull(sys.stdin, validation)
+    if rehydrate:
+        events = rehydrate_events(events, store, validation)
+    else:
+        events = thin_events(events, store, min_size)
+    revisionist.write_events_to_dumpfile(events, sys.stdout,
+                                         validation=validation)
+    if not rehydrate:
+        print >>sys.stderr, \
+            "%d texts stored (%.1f MB), %d already in store (%.1f MB)" % (
+            store.added, megabytes(store.added_bytes),
+            store.found, megabytes(store.found_bytes))
+    return 0
+
+def print_usage():
+    print >>sys.stderr, \
+"""
+ %s [--validation LEVEL] [--min-size BYTES] STORE < dumpfile > thin-dumpfile
+ %s --rehydrate [--validation LEVEL] STORE < thin-dumpfile > dumpfile
+
+ Move the text of each node of a dumpfile into the blob store STORE (a
+ directory, created if need be), writing a thin dumpfile which refers
+ to the texts by their md5.  A text is stored once, however many
+ dumpfiles contain it.  A summary of what was stored goes to standard
+ error.
+
+ --min-size BYTES leaves texts shorter than this in the dumpfile.  The
+ default is %d.
+
+ --rehydrate (-r) puts the texts back, writing the original dumpfile.
+
+ --validation (-V) LEVEL is one of paranoid, standard (the default) or
+ trust-input.  Unless it is trust-input, texts taken from STORE are
+ checked against their md5.
+""" % (sys.argv[0], sys.argv[0], MIN_SIZE)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+import sys
+import time
+import revisionist
+from revisionist.verify import verify_dumpfiles
+
+def parse_options():
+    "Parse command line options. See also print_usage."
+    args = sys.argv[1:]
+    processes = None
+    validation = revisionist.STANDARD
+    tree = False
+    while args and args[0] in ["--jobs", "-j", "--validation", "-V",
+                               "--check-tree", "-t"]:
+        if args[0] in ["--check-tree", "-t"]:
+            tree = True
+            del args[0]
+            continue
+        if len(args) < 2:
+            break
+        if args[0] in ["--jobs", "-j"]:
+            if not args[1].isdigit() or int(args[1]) < 1:
+                break
+            processes = int(args[1])
+        else:
+            validation = args[1]
+            if validation not in revisionist.validation.LEVELS:
+                break
+        del args[:2]
+    if not args or args[0].startswith("-"):
+        print_usage()
+        return None, None, None, None
+    return args, processes, validation, tree
+
+
+def megabytes(n):
+    return n / (1024.0 * 1024.0)
+
+
+def main():
+    paths, processes, validation, tree = parse_options()
+    if paths == None:
+        return 1
+    start = time.time()
+    total = 0
+    failed = 0
+    for result in verify_dumpfiles(paths, validation, processes,
+                                   tree):
+        if result.size != None:
+            total += result.size
+        if result.error == None:
+            print "ok      %s  %.1f MB  %.1f MB/s  %d revisions" % (
+                result.path, megabytes(result.size),
+                megabytes(result.throughput()), result.revisions)
+        else:
+            failed += 1
+            print "FAILED  %s  %s" % (result.path, result.where())
+            for line in result.error.splitlines():
+                print "        " + line
+        sys.stdout.flush()
+    seconds = time.time() - start
+    print "%d dumpfiles, %d failed, %.1f MB in %.1f s (%.1f MB/s)" % (
+        len(paths), failed, megabytes(total), seconds,
+        megabytes(total / max(seconds, 1e-6)))
+    if failed:
+        return 1
+    return 0
+
+def print_usage():
+    print >>sys.stderr, \
+"""
+ %s [--jobs N] [--validation LEVEL] [--check-tree] DUMPFILE...
+
+ Verify the given dumpfiles: their structure, lengths and checksums,
+ including the text deltas of version 3 dumpfiles.  Nothing is written
+ but a report: a line per dumpfile, giving its throughput or the first
+ problem found in it (with revision, path and byte offset), followed
+ by a summary.  The exit status is 1 if any dumpfile failed.
+
+ --jobs (-j) N verifies N dumpfiles at a time, each in its own
+ process.  The default is one per CPU.
+
+ --validation (-V) LEVEL is one of paranoid, standard (the default) or
+ trust-input.
+
+ --check-tree (-t) also checks that copy sources exist, that adds add
+ new paths and that deletes and changes act on existing ones.
+""" % (sys.argv[0],)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
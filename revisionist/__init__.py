@@ -1,12 +1,38 @@
 # -*- coding: utf-8 -*-
 
 from editors import edit_properties, echo_properties, consume_events,  \
-                    show_progress
+                    show_progress, property_memo
 
-from parser import pull,                                               \
+from parser import pull, Follow,                                       \
                    BeginDumpfile, EndDumpfile,                         \
                    BeginRevision, EndRevisionHeader, EndRevisionNodes, \
                    BeginNode, EndNode,                                 \
                    UserProperties, TextContent, BlankLine
 
-from writer import write_events_to_dumpfile
+from writer import write_events_to_dumpfile, write_events
+
+from dispatch import EventHandler, handle_events
+
+from records import pull_records, write_records_to_dumpfile, \
+                    edit_record_properties, records_to_events,  \
+                    events_to_records, edit_revisions, Revision
+
+from validation import PARANOID, STANDARD, TRUST_INPUT, \
+                       DumpfileError, ParseError, WriteError, TreeError, \
+                       BlobError
+
+from merge import merge_dumpfiles
+
+from deltas import verify_text_deltas, make_text_deltas
+
+from paths import remap_paths, PathTrie
+
+from content import normalize_text
+
+from tee import tee_events, readonly
+
+from tree import check_tree, PathTree
+
+from binary import pull_binary, write_binary, encode_events
+
+from blobs import BlobStore, thin_events, rehydrate_events
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.binary: pass parse events between processes in binary form
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+Writing a dumpfile only to have the next process parse it again costs
+the line-oriented parsing, and the checksums, twice.  This is a
+simpler encoding of the events themselves.  After MAGIC, each event is
+a record of a one byte tag, the length of its payload as a four byte
+big-endian number, and the payload:
+
+    tag  event              payload
+    D    BeginDumpfile      version, space, uuid (may be empty)
+    d    EndDumpfile        -
+    R    BeginRevision      the dump properties, as in the dumpfile
+    h    EndRevisionHeader  -
+    r    EndRevisionNodes   -
+    N    BeginNode          the dump properties, as in the dumpfile
+    n    EndNode            -
+    P    UserProperties     the number of offsets, the offsets (see
+                            UserProperties), the property block
+    p    UserProperties     the same, with two byte offsets, for
+                            blocks shorter than 32K
+    T    TextContent        the text
+    M    TextContent        its computed_md5 (32 bytes), the text
+    C    TextContent        the text, whose computed_md5 is the
+                            Text-content-md5 of its node
+    b    BlankLine          -
+
+Numbers in payloads are four byte big-endian too, signed for offsets.
+"""
+
+import struct
+from util import crop_text_block as msg
+from parser import BeginDumpfile, EndDumpfile, \
+                   BeginRevision, EndRevisionHeader, EndRevisionNodes, \
+                   BeginNode, EndNode, UserProperties, TextContent, BlankLine
+from validation import ParseError, WriteError
+
+MAGIC = "revisionist-events 1\n"
+CHUNK_SIZE = 65536
+
+HEADER = struct.Struct(">cI")
+NUMBER = struct.Struct(">I")
+
+# Tags of the events which carry no data, and the other way round.
+EMPTY_TAGS = {
+    EndDumpfile: "d",
+    EndRevisionHeader: "h",
+    EndRevisionNodes: "r",
+    EndNode: "n",
+    BlankLine: "b",
+}
+EMPTY_EVENTS = dict([(tag, cls) for cls, tag in EMPTY_TAGS.items()])
+
+
+def write_binary(events, dstFile):
+    """
+    Consume parse events while writing them to dstFile in binary
+    form, which pull_binary() reads.  dstFile is closed at the end.
+    """
+    try:
+        for data in encode_events(events):
+            dstFile.write(data)
+    finally:
+        dstFile.close()
+
+
+def encode_events(events):
+    """
+    Generate the binary form of parse events: MAGIC, followed by a
+    string per event.
+    """
+    yield MAGIC
+    pack = HEADER.pack
+    node = None
+    for evt in events:
+        cls = type(evt)
+        tag = EMPTY_TAGS.get(cls)
+        if tag != None:
+            yield pack(tag, 0)
+        elif cls == TextContent:
+            md5 = evt.computed_md5
+            if md5 == None:
+                yield pack("T", len(evt))
+            elif node != None and md5 == node.get("Text-content-md5"):
+                yield pack("C", len(evt))
+            else:
+                yield pack("M", 32 + len(evt)) + md5
+            yield evt
+        elif cls == BeginNode:
+            node = evt
+            data = str(evt)
+            yield pack("N", len(data)) + data
+        elif cls == BeginRevision:
+            data = str(evt)
+            yield pack("R", len(data)) + data
+        elif cls == UserProperties:
+            raw, offsets = property_block(evt)
+            n = len(offsets)
+            if len(raw) < 32768:
+                yield pack("p", 4 + 2 * n + len(raw))
+                yield struct.pack(">I%dh" % n, n, *offsets)
+            else:
+                yield pack("P", 4 + 4 * n + len(raw))
+                yield struct.pack(">I%di" % n, n, *offsets)
+            yield raw
+        elif cls == BeginDumpfile:
+            data = "%d %s" % (evt.version, evt.uuid or "")
+            yield pack("D", len(data)) + data
+        else:
+            raise WriteError("Can't encode %r." % (evt,))
+
+
+def property_block(props):
+    """
+    Returns a tuple (raw, offsets) of the property block of props, and
+    the offsets of its keys and values.  Both are those of the parser,
+    unless props have been decoded or changed.
+    """
+    if props.raw != None and props.offsets != None:
+        return props.raw, props.offsets
+    pieces = []
+    offsets = []
+    pos = 0
+    for k in props.keys():
+        v = props[k]
+        if v == None:
+            head = "D %d\n" % (len(k),)
+            start = pos + len(head)
+            offsets.extend((start, start + len(k), -1, -1))
+            piece = "%s%s\n" % (head, k)
+        else:
+            head = "K %d\n" % (len(k),)
+            start = pos + len(head)
+            value = start + len(k) + len("\nV %d\n" % (len(v),))
+            offsets.extend((start, start + len(k), value, value + len(v)))
+            piece = "%s%s\nV %d\n%s\n" % (head, k, len(v), v)
+        pieces.append(piece)
+        pos += len(piece)
+    pieces.append("PROPS-END\n")
+    return "".join(pieces), offsets
+
+
+def pull_binary(fileLike):
+    """
+    Generate the parse events encoded in fileLike by write_binary().
+    Nothing is verified but the encoding itself: the events are
+    exactly those that were encoded, checked by whoever parsed them
+    first.  TextContent keeps its computed_md5.  Raises ParseError if
+    the stream is cut short.
+    """
+    reader = BinaryReader(fileLike)
+    if reader.read(len(MAGIC)) != MAGIC:
+        raise ParseError("Not a stream of binary parse events.")
+    unpack = HEADER.unpack
+    tag = None
+    node = None
+    while True:
+        header = reader.read(HEADER.size)
+        if not header:
+            if tag != "d":
+                raise ParseError(msg("""
+                    Stream of binary parse events ends before
+                    EndDumpfile, at byte %d.""" % (reader.offset,)))
+            return
+        if len(header) < HEADER.size:
+            reader.truncated()
+        tag, length = unpack(header)
+        payload = reader.read(length)
+        if len(payload) < length:
+            reader.truncated()
+        cls = EMPTY_EVENTS.get(tag)
+        if cls != None:
+            yield cls()
+        elif tag == "C":
+            text = TextContent(payload)
+            text.computed_md5 = node["Text-content-md5"]
+            yield text
+        elif tag == "T":
+            yield TextContent(payload)
+        elif tag == "M":
+            text = TextContent(payload[32:])
+            text.computed_md5 = payload[:32]
+            yield text
+        elif tag == "N":
+            node = dump_properties(BeginNode(), payload)
+            yield node
+        elif tag == "R":
+            yield dump_properties(BeginRevision(), payload)
+        elif tag == "p" or tag == "P":
+            n = NUMBER.unpack_from(payload)[0]
+            if tag == "p":
+                stop = 4 + 2 * n
+                fmt = ">%dh"
+            else:
+                stop = 4 + 4 * n
+                fmt = ">%di"
+            offsets = list(struct.unpack(fmt % n, payload[4:stop]))
+            yield UserProperties.fromBlock(payload[stop:], offsets)
+        elif tag == "D":
+            version, uuid = payload.split(" ", 1)
+            yield BeginDumpfile(int(version), uuid or None)
+        else:
+            raise ParseError(msg("""
+                Unknown tag %r in stream of binary parse events, at byte
+                %d.""" % (tag, reader.offset - len(payload) - HEADER.size)))
+
+
+def dump_properties(evt, payload):
+    for line in payload.split("\n")[:-1]:
+        k, v = line.split(": ", 1)
+        evt[k] = v
+    return evt
+
+
+class BinaryReader(object):
+    """
+    Reads from fileLike in chunks of CHUNK_SIZE, so that reading the
+    many small records costs few calls of fileLike.read.
+
+    offset
+        The number of bytes read (by the caller) so far.
+    """
+
+    def __init__(self, fileLike):
+        self.fileLike = fileLike
+        self.buffer = ""
+        self.pos = 0
+        self.offset = 0
+
+    def read(self, n):
+        """
+        Returns the next n bytes, or fewer at the end of input.
+        """
+        pos = self.pos
+        stop = pos + n
+        if stop <= len(self.buffer):
+            self.pos = stop
+            self.offset += n
+            return self.buffer[pos:stop]
+        data = self.buffer[pos:]
+        if n - len(data) >= CHUNK_SIZE:
+            data += self.fileLike.read(n - len(data))
+            self.buffer = ""
+            self.pos = 0
+        else:
+            self.buffer = data + self.fileLike.read(CHUNK_SIZE)
+            self.pos = min(n, len(self.buffer))
+            data = self.buffer[:n]
+        self.offset += len(data)
+        return data
+
+    def truncated(self):
+        raise ParseError(msg("""
+            Stream of binary parse events ends in the middle of a
+            record, at byte %d.""" % (self.offset,)))
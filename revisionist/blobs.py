@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.blobs: keep texts in a store shared by many dumpfiles
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+Full dumps of the same repository, taken at different times, contain
+the same texts over and over.  thin_events moves each text into a
+BlobStore, where it is kept once however many dumpfiles contain it,
+and leaves a thin dumpfile which only refers to it:
+
+    Node-path: trunk/foo.c
+    Node-kind: file
+    Node-action: change
+    Text-content-blob: 1042 0cc175b9c0f1b6a831c399e269772661
+    Text-content-md5: 0cc175b9c0f1b6a831c399e269772661
+    Content-length: 0
+
+Text-content-blob, giving the length and md5 of the text, takes the
+place of Text-content-length, and the length of the text is taken off
+Content-length.  That is all that changes, so a thin dumpfile is still
+a dumpfile which can be parsed, edited and written: only the text is
+missing.  rehydrate_events puts it back, to give the very same bytes
+as before.
+"""
+
+import os
+from md5 import md5
+from util import crop_text_block as msg
+from parser import BeginNode, EndNode, UserProperties, TextContent, \
+                   BlankLine
+from validation import BlobError, check_level, STANDARD, TRUST_INPUT
+
+# The length below which thin_events leaves texts in the dumpfile.
+MIN_SIZE = 1024
+
+
+def thin_events(events, store, min_size=MIN_SIZE):
+    """
+    Put the text of each node into store, generating the events of a
+    thin dumpfile instead: the node refers to the text by
+    Text-content-blob, and has no TextContent.
+
+    Texts shorter than min_size are left in place, as a reference and
+    a file of their own would take more room than they do.  So are
+    the texts of nodes without a Text-content-length header.
+    """
+    held = None
+    for evt in events:
+        cls = type(evt)
+        if held != None:
+            if cls == TextContent and len(evt) >= min_size:
+                node = held[0]
+                key = evt.computed_md5 or md5(evt).hexdigest()
+                store.put(key, evt)
+                replace_header(node, "Text-content-length",
+                               "Text-content-blob", "%d %s" % (len(evt), key))
+                if "Content-length" in node:
+                    node["Content-length"] = (int(node["Content-length"])
+                                              - len(evt))
+                for held_evt in held:
+                    yield held_evt
+                held = None
+                continue
+            held.append(evt)
+            if cls == EndNode:
+                for held_evt in held:
+                    yield held_evt
+                held = None
+        elif cls == BeginNode and "Text-content-length" in evt:
+            # hold the node until its text shows whether it has one
+            held = [evt]
+        else:
+            yield evt
+
+
+def rehydrate_events(events, store, validation=STANDARD):
+    """
+    Put the text of each node of a thin dumpfile back from store,
+    undoing thin_events().  Raises BlobError if a text is missing from
+    store or, unless validation is TRUST_INPUT, doesn't match its md5.
+    """
+    check_level(validation)
+    pending = None
+    for evt in events:
+        cls = type(evt)
+        if cls == BeginNode and "Text-content-blob" in evt:
+            pending = restore_node(evt)
+            props = int(evt.get("Prop-content-length", 0)) > 0
+            delta = evt.get("Text-delta") == "true"
+        elif pending != None:
+            if cls == UserProperties or (cls == BlankLine and not props):
+                yield evt
+                evt = store.get(pending[1], pending[0],
+                                validation != TRUST_INPUT)
+                if delta:
+                    # computed_md5 is that of the text, not the delta
+                    evt.computed_md5 = None
+                pending = None
+            elif cls == EndNode:
+                raise BlobError(msg("""
+                    The node %s ends before its text, which is in the
+                    blob store as %s.""" % (pending[2], pending[1])))
+        yield evt
+
+
+def restore_node(node):
+    """
+    Turn the dump properties of a thin node back into those it had,
+    returning a tuple (length, md5, Node-path) of its text.
+    """
+    length, key = node["Text-content-blob"].split(" ", 1)
+    length = int(length)
+    replace_header(node, "Text-content-blob", "Text-content-length", length)
+    if "Content-length" in node:
+        node["Content-length"] = int(node["Content-length"]) + length
+    return length, key, node["Node-path"]
+
+
+def replace_header(node, old, new, value):
+    """
+    Replace the dump property old of node by new, in the same place.
+    """
+    items = [(k, node[k]) for k in node.keys()]
+    for k, v in items:
+        del node[k]
+    for k, v in items:
+        if k == old:
+            node[new] = value
+        else:
+            node[k] = v
+
+
+class BlobStore(object):
+    """
+    A directory of texts, each in a file named after its md5.  The
+    files are spread over 256 subdirectories, by the first two digits
+    of the md5.  A text is written under a temporary name and then
+    renamed, so that processes may share a store: a text is in it
+    completely, or not at all.
+
+    added, added_bytes
+        The number of texts put into the store by this object, and
+        their total length.
+
+    found, found_bytes
+        The same for texts which were in the store already.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.added = self.added_bytes = 0
+        self.found = self.found_bytes = 0
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, text):
+        """
+        Store text, whose md5 is key, unless it is stored already.
+        """
+        path = self.path(key)
+        if os.path.exists(path):
+            self.found += 1
+            self.found_bytes += len(text)
+            return
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.mkdir(directory)
+            except OSError:
+                # made by someone else meanwhile
+                if not os.path.isdir(directory):
+                    raise
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        f = file(temp, "wb")
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        os.rename(temp, path)
+        self.added += 1
+        self.added_bytes += len(text)
+
+    def get(self, key, length=None, verify=True):
+        """
+        Returns the text whose md5 is key as TextContent.  Raises
+        BlobError if there is no such text, if it is not of length
+        (unless None) or, if verify is True, if its md5 is not key.
+        """
+        try:
+            f = file(self.path(key), "rb")
+        except IOError:
+            raise BlobError("The blob %s is not in the store %s."
+                            % (key, self.root))
+        try:
+            text = TextContent(f.read())
+        finally:
+            f.close()
+        if length != None and len(text) != length:
+            raise BlobError(msg("""
+                The blob %s has %d bytes, where %d were expected.
+                """ % (key, len(text), length)))
+        if verify:
+            computed = md5(text).hexdigest()
+            if computed != key:
+                raise BlobError(msg("""
+                    The blob %s is corrupt: its md5 is %s.
+                    """ % (key, computed)))
+            text.computed_md5 = computed
+        return text
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.cache: a size-bounded LRU cache of strings that spills to disk
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+"""
+
+import os
+import shutil
+import tempfile
+
+
+class LRUCache(object):
+    """
+    A mapping of at most max_size bytes worth of values, discarding
+    the least recently used items to make room for new ones.
+
+    Items are kept in a doubly linked list, most recently used first.
+    Each link is a list [prev, next, key, value, size].
+
+    max_size
+        The total size of all values may not exceed this.
+
+    size
+        The current total size of all values.
+
+    sizeof
+        A function computing the size of a value. len, by default.
+    """
+
+    def __init__(self, max_size, sizeof=len):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.links = {}
+        self.root = root = []
+        root[:] = [root, root, None, None, 0]
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def get(self, key, default=None):
+        link = self.links.get(key)
+        if link == None:
+            return default
+        self.unlink(link)
+        self.link(link)
+        return link[3]
+
+    def __getitem__(self, key):
+        link = self.links[key]
+        self.unlink(link)
+        self.link(link)
+        return link[3]
+
+    def __setitem__(self, key, value):
+        if key in self.links:
+            self.pop(key)
+        size = self.sizeof(value)
+        if size > self.max_size:
+            self.evicted(key, value)
+            return
+        while self.size + size > self.max_size:
+            oldest = self.root[0]
+            self.pop(oldest[2])
+            self.evicted(oldest[2], oldest[3])
+        link = [None, None, key, value, size]
+        self.links[key] = link
+        self.link(link)
+        self.size += size
+
+    def pop(self, key, *default):
+        if key not in self.links and default:
+            return default[0]
+        link = self.links.pop(key)
+        self.unlink(link)
+        self.size -= link[4]
+        return link[3]
+
+    def evicted(self, key, value):
+        """
+        Called when value is dropped from the cache to make room.
+        Subclasses may override this to keep the value elsewhere.
+        """
+        pass
+
+    def link(self, link):
+        root = self.root
+        first = root[1]
+        link[0], link[1] = root, first
+        first[0] = root[1] = link
+
+    def unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1], next[0] = next, prev
+
+
+class ContentCache(LRUCache):
+    """
+    Keeps strings (e.g. file contents) by key (e.g. their md5).
+
+    At most max_size bytes are kept in memory.  Less recently used
+    strings are spilled to files in a temporary directory, from which
+    they are read back when asked for again.  Keys must be usable as
+    file names.
+
+    Call close() to remove the temporary directory.
+    """
+
+    def __init__(self, max_size=64*1024*1024):
+        LRUCache.__init__(self, max_size)
+        self.spill_dir = None
+
+    def __contains__(self, key):
+        return LRUCache.__contains__(self, key) or self.spilled(key)
+
+    def get(self, key, default=None):
+        value = LRUCache.get(self, key)
+        if value != None:
+            return value
+        if not self.spilled(key):
+            return default
+        f = file(self.spillPath(key), "rb")
+        try:
+            value = f.read()
+        finally:
+            f.close()
+        self[key] = value
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value == None:
+            raise KeyError(key)
+        return value
+
+    def evicted(self, key, value):
+        path = self.spillPath(key)
+        if not os.path.exists(path):
+            f = file(path, "wb")
+            try:
+                f.write(value)
+            finally:
+                f.close()
+
+    def spilled(self, key):
+        return (self.spill_dir != None
+                and os.path.exists(os.path.join(self.spill_dir, key)))
+
+    def spillPath(self, key):
+        if self.spill_dir == None:
+            self.spill_dir = tempfile.mkdtemp(prefix="revisionist-")
+        return os.path.join(self.spill_dir, key)
+
+    def close(self):
+        """
+        Forget all contents, removing the temporary directory.
+        """
+        self.links.clear()
+        self.root[:] = [self.root, self.root, None, None, 0]
+        self.size = 0
+        if self.spill_dir != None:
+            shutil.rmtree(self.spill_dir, True)
+            self.spill_dir = None
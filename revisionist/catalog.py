@@ -0,0 +1,516 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.catalog: an SQLite catalog of the nodes of a dumpfile
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+The catalog is built in a single pass over the dumpfile.  It records
+the metadata of every revision and node, together with the byte
+offsets at which their properties and text lie in the dumpfile.
+Questions about the history of a repository can then be answered
+without parsing the dumpfile again, and the bodies of the nodes of
+interest fetched from it directly.
+
+The revision properties svn:author, svn:date and svn:log are
+cataloged too, with an inverted index of the words of each log
+message, so that revisions can be searched for by what their log
+says, who made them and when.  build_log_index catalogs only these,
+skipping over the nodes without reading them.
+"""
+
+import os
+import re
+import sqlite3
+from util import crop_text_block as msg
+from validation import DumpfileError, ParseError, STANDARD
+from parser import Parser, Reader, pat_dump_property
+from records import RecordParser, NodeRecord
+
+SCHEMA = """
+CREATE TABLE dumpfile (
+    path TEXT,
+    version INTEGER,
+    uuid TEXT
+);
+CREATE TABLE revisions (
+    rev INTEGER PRIMARY KEY,
+    offset INTEGER,
+    prop_offset INTEGER,
+    prop_length INTEGER,
+    author TEXT,
+    date TEXT,
+    log TEXT
+);
+CREATE TABLE log_words (
+    word TEXT,
+    rev INTEGER
+);
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY,
+    rev INTEGER,
+    path TEXT,
+    action TEXT,
+    kind TEXT,
+    copyfrom_path TEXT,
+    copyfrom_rev INTEGER,
+    text_length INTEGER,
+    md5 TEXT,
+    text_delta INTEGER,
+    offset INTEGER,
+    prop_offset INTEGER,
+    prop_length INTEGER,
+    text_offset INTEGER
+);
+CREATE TABLE node_props (
+    node_id INTEGER,
+    name TEXT
+);
+CREATE INDEX nodes_path ON nodes (path, rev);
+CREATE INDEX nodes_rev ON nodes (rev);
+CREATE INDEX nodes_copyfrom ON nodes (copyfrom_path, copyfrom_rev);
+CREATE INDEX node_props_name ON node_props (name, node_id);
+CREATE INDEX revisions_author ON revisions (author, rev);
+CREATE INDEX revisions_date ON revisions (date);
+CREATE INDEX log_words_word ON log_words (word, rev);
+"""
+
+TABLES = ["dumpfile", "revisions", "nodes", "node_props", "log_words"]
+
+# A word of a log message: letters and digits, possibly joined by
+# punctuation as in PROJ-123, r1234:1240 or foo.c, which is a word in
+# its own right as well as its parts.
+pat_word = re.compile(r"\w+(?:[-.:/#]\w+)*", re.UNICODE)
+pat_part = re.compile(r"\w+", re.UNICODE)
+
+
+def build_catalog(dumpPath, dbPath, validation=STANDARD):
+    """
+    Catalog the dumpfile at dumpPath in the SQLite database at dbPath,
+    replacing any catalog already there.  Returns the Catalog.
+
+    Text content is read and verified as validation demands, except
+    with TRUST_INPUT, which skips over it without reading it.
+    """
+    catalog = Catalog(dbPath)
+    try:
+        catalog.create()
+        builder = CatalogBuilder(catalog.db, validation)
+        builder.build(os.path.abspath(dumpPath))
+    except:
+        catalog.close()
+        raise
+    return catalog
+
+
+def build_log_index(dumpPath, dbPath):
+    """
+    Catalog only the revisions of the dumpfile at dumpPath, with their
+    authors, dates and log messages, in the SQLite database at dbPath,
+    replacing any catalog already there.  Returns the Catalog, which
+    has no nodes.
+
+    This reads only the headers of the nodes and seeks past their
+    content, so it takes little longer for a dumpfile of gigabytes of
+    text than for one without.  Nothing is verified.
+    """
+    catalog = Catalog(dbPath)
+    try:
+        catalog.create()
+        builder = CatalogBuilder(catalog.db)
+        dumpPath = os.path.abspath(dumpPath)
+        f = file(dumpPath, "rb")
+        try:
+            revisions = scan_revisions(f)
+            version, uuid = revisions.next()
+            builder.addDumpfile(dumpPath, version, uuid)
+            for rev, offset, prop_offset, plen, props in revisions:
+                builder.addRevision(rev, offset, prop_offset, plen, props)
+        finally:
+            f.close()
+        catalog.db.commit()
+    except:
+        catalog.close()
+        raise
+    return catalog
+
+
+def scan_revisions(dumpFile):
+    """
+    Generate the revisions of the dumpfile open in dumpFile, skipping
+    over the content of its nodes.  The first item is a tuple (version,
+    uuid) of the dumpfile, each following one a tuple (rev, offset,
+    prop_offset, prop_length, props) of a revision.  props is None for
+    a revision without properties.
+
+    The lengths the headers give are trusted, which is what makes it
+    possible to skip by them.
+    """
+    reader = Reader(dumpFile)
+    reader.next()
+    version = uuid = None
+    started = False
+    while True:
+        while reader.cur == "\n":
+            reader.next()
+        if reader.eof:
+            break
+        offset = reader.start
+        headers = {}
+        m = pat_dump_property.match(reader.cur)
+        while m:
+            headers[m.group(1)] = m.group(2)
+            m = pat_dump_property.match(reader.next())
+        if not headers:
+            raise ParseError(msg("""
+                Expected a header at byte %d, found %r.
+                """ % (reader.start, reader.cur[:40])))
+        plen = int(headers.get("Prop-content-length", 0))
+        clen = headers.get("Content-length")
+        if clen == None:
+            clen = plen + int(headers.get("Text-content-length", 0))
+        else:
+            clen = int(clen)
+        if clen > 0:
+            if reader.cur != "\n":
+                raise ParseError(msg("""
+                    Expected a blank line before the content at byte
+                    %d.""" % (reader.start,)))
+            reader.next()
+        if "Revision-number" in headers:
+            if not started:
+                yield version, uuid
+                started = True
+            prop_offset = reader.start
+            props = None
+            if plen > 0:
+                block = reader.readBytes(plen)
+                props, stop = Parser().scanUserProperties(block)
+                if props == None:
+                    raise ParseError(msg("""
+                        The properties of r%s at byte %d end before
+                        PROPS-END.""" % (headers["Revision-number"],
+                                         prop_offset)))
+            if clen > plen:
+                reader.skipBytes(clen - plen)
+            yield (int(headers["Revision-number"]), offset, prop_offset,
+                   plen, props)
+        elif "Node-path" in headers:
+            reader.skipBytes(clen)
+        elif "SVN-fs-dump-format-version" in headers:
+            version = int(headers["SVN-fs-dump-format-version"])
+        elif "UUID" in headers:
+            uuid = headers["UUID"]
+    if not started:
+        yield version, uuid
+
+
+def log_words(text):
+    """
+    Returns the set of words of the log message text (UTF-8), in lower
+    case.  See pat_word.
+    """
+    words = set()
+    for word in pat_word.findall(text.decode("utf-8", "replace").lower()):
+        words.add(word)
+        parts = pat_part.findall(word)
+        if len(parts) > 1:
+            words.update(parts)
+    return set([word.encode("utf-8") for word in words])
+
+
+# The columns of nodes, but for id, in the order of the table.
+NODE_COLUMNS = ["rev", "path", "action", "kind", "copyfrom_path",
+                "copyfrom_rev", "text_length", "md5", "text_delta",
+                "offset", "prop_offset", "prop_length", "text_offset"]
+
+
+def node_row(rev, record):
+    """
+    Returns a dictionary of the columns of nodes (but for id) for the
+    NodeRecord record of revision rev.
+    """
+    node = record.dump_props
+    plen = int(node.get("Prop-content-length", 0))
+    tlen = node.get("Text-content-length")
+    prop_offset = record.propsOffset()
+    copyfrom_rev = node.get("Node-copyfrom-rev")
+    if copyfrom_rev != None:
+        copyfrom_rev = int(copyfrom_rev)
+    if tlen != None:
+        tlen = int(tlen)
+    return {"rev": rev, "path": node["Node-path"],
+            "action": node["Node-action"], "kind": node.get("Node-kind"),
+            "copyfrom_path": node.get("Node-copyfrom-path"),
+            "copyfrom_rev": copyfrom_rev, "text_length": tlen,
+            "md5": node.get("Text-content-md5"),
+            "text_delta": node.get("Text-delta") == "true",
+            "offset": record.offset, "prop_offset": prop_offset,
+            "prop_length": plen, "text_offset": prop_offset + plen}
+
+
+class CatalogParser(RecordParser):
+    """
+    A RecordParser which skips over text content, rather than reading
+    it, unless it is to be verified.
+    """
+
+    def parseTextContent(self, dump_props, tlen):
+        if self.check_md5:
+            return RecordParser.parseTextContent(self, dump_props, tlen)
+        if self.reader.skipBytes(tlen) != tlen or self.reader.cur != "\n":
+            raise ParseError("Didn't find expected newline terminator.")
+        self.reader.next()
+        return None
+
+
+class CatalogBuilder(object):
+    """
+    Fills the tables of a catalog from the records of a dumpfile.
+    """
+
+    def __init__(self, db, validation=STANDARD):
+        self.db = db
+        self.validation = validation
+
+    def build(self, dumpPath):
+        parser = CatalogParser(self.validation)
+        records = parser.parse(file(dumpPath, "rb"))
+        header = records.next().header
+        self.addDumpfile(dumpPath, header.version, header.uuid)
+        rev = None
+        for record in records:
+            if type(record) == NodeRecord:
+                self.addNode(rev, record)
+            else:
+                rev = int(record.dump_props["Revision-number"])
+                plen = int(record.dump_props.get("Prop-content-length", 0))
+                self.addRevision(rev, record.offset, record.propsOffset(),
+                                 plen, record.props)
+        self.db.commit()
+
+    def addDumpfile(self, dumpPath, version, uuid):
+        self.db.execute("INSERT INTO dumpfile VALUES (?, ?, ?)",
+                        (dumpPath, version, uuid))
+
+    def addRevision(self, rev, offset, prop_offset, plen, props):
+        if props == None:
+            author = date = log = None
+        else:
+            author = props.get("svn:author")
+            date = props.get("svn:date")
+            log = props.get("svn:log")
+        self.db.execute(
+            "INSERT INTO revisions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (rev, offset, prop_offset, plen, author, date, log))
+        if log:
+            self.db.executemany("INSERT INTO log_words VALUES (?, ?)",
+                                [(word, rev) for word in log_words(log)])
+
+    def addNode(self, rev, record):
+        row = node_row(rev, record)
+        cursor = self.db.execute(
+            """INSERT INTO nodes (%s) VALUES (%s)"""
+            % (", ".join(NODE_COLUMNS), ", ".join("?" * len(NODE_COLUMNS))),
+            [row[column] for column in NODE_COLUMNS])
+        if record.props != None:
+            node_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO node_props VALUES (?, ?)",
+                [(node_id, name) for name in record.props.keys()
+                 if record.props[name] != None])
+
+
+class Catalog(object):
+    """
+    The catalog of a dumpfile, kept in the SQLite database at dbPath.
+
+    Queries return sqlite3.Row objects, whose columns can be accessed
+    by name, e.g. row["path"].  Nodes have the columns rev, path,
+    action, kind, copyfrom_path, copyfrom_rev, text_length, md5,
+    text_delta, offset, prop_offset, prop_length and text_offset.
+    text_length is None for nodes without Text-content-length.
+
+    Paths are given as in Node-path.  A leading slash is ignored.
+    """
+
+    def __init__(self, dbPath):
+        self.db = sqlite3.connect(dbPath)
+        self.db.row_factory = sqlite3.Row
+        self.db.text_factory = str
+
+    def close(self):
+        self.db.close()
+
+    def create(self):
+        """
+        Create the (empty) tables, dropping existing ones.
+        """
+        for table in TABLES:
+            self.db.execute("DROP TABLE IF EXISTS %s" % (table,))
+        self.db.executescript(SCHEMA)
+
+    def dumpPath(self):
+        """
+        The path of the dumpfile this is the catalog of.
+        """
+        return self.db.execute("SELECT path FROM dumpfile").fetchone()[0]
+
+    def nodes(self, where="1", args=()):
+        """
+        Returns the nodes matching the SQL condition where, in the
+        order in which they appear in the dumpfile.
+        """
+        return self.db.execute(
+            "SELECT * FROM nodes WHERE %s ORDER BY id" % (where,),
+            args).fetchall()
+
+    def history(self, path):
+        """
+        Returns the nodes changing path, or anything below it.
+        """
+        path = path.strip("/")
+        if not path:
+            return self.nodes()
+        # '0' is the character following '/'.  This range selects
+        # everything below path while still using the index.
+        return self.nodes("path = ? OR (path > ? AND path < ?)",
+                          (path, path + "/", path + "0"))
+
+    def revisionsTouching(self, path):
+        """
+        Returns the ascending list of revisions changing path or
+        anything below it.
+        """
+        revs = set([row["rev"] for row in self.history(path)])
+        return sorted(revs)
+
+    def copySources(self, path):
+        """
+        Returns the nodes copying something to path.
+        """
+        return self.nodes("path = ? AND copyfrom_path IS NOT NULL",
+                          (path.strip("/"),))
+
+    def copiesOf(self, path):
+        """
+        Returns the nodes copying path somewhere.
+        """
+        return self.nodes("copyfrom_path = ?", (path.strip("/"),))
+
+    def nodesWithProperty(self, name):
+        """
+        Returns the nodes whose property blocks set the property name.
+        """
+        return self.nodes(
+            "id IN (SELECT node_id FROM node_props WHERE name = ?)",
+            (name,))
+
+    def node(self, path, rev):
+        """
+        Returns the node changing path in revision rev, or None.  If
+        there is more than one (e.g. delete followed by add), the last.
+        """
+        rows = self.nodes("path = ? AND rev = ?", (path.strip("/"), rev))
+        if rows:
+            return rows[-1]
+        return None
+
+    def readBytes(self, offset, length, dumpFile=None):
+        """
+        Returns the length bytes at offset in the dumpfile.  See text().
+        """
+        if dumpFile == None:
+            f = file(self.dumpPath(), "rb")
+        else:
+            f = dumpFile
+        try:
+            f.seek(offset)
+            data = f.read(length)
+        finally:
+            if dumpFile == None:
+                f.close()
+        if len(data) != length:
+            raise DumpfileError(
+                "The dumpfile ended %d bytes early." % (length - len(data),))
+        return data
+
+    def text(self, node, dumpFile=None):
+        """
+        Returns the text content of node, as stored in the dumpfile,
+        which is reopened unless dumpFile, open for reading, is given.
+        For text delta nodes, this is the delta.  Returns None if node
+        has no text content.
+        """
+        if node["text_length"] == None:
+            return None
+        return self.readBytes(node["text_offset"], node["text_length"],
+                              dumpFile)
+
+    def properties(self, row, dumpFile=None):
+        """
+        Returns the UserProperties of row, a node or a revision, or
+        None if it has none.  See text().
+        """
+        if not row["prop_length"]:
+            return None
+        block = self.readBytes(row["prop_offset"], row["prop_length"],
+                               dumpFile)
+        props, stop = Parser().scanUserProperties(block, True)
+        if stop != len(block):
+            raise DumpfileError(
+                "The catalog does not match the dumpfile.")
+        return props
+
+    def revision(self, rev):
+        """
+        Returns the revision rev, or None.  Revisions have the columns
+        rev, offset, prop_offset, prop_length, author, date and log.
+        """
+        return self.db.execute("SELECT * FROM revisions WHERE rev = ?",
+                               (rev,)).fetchone()
+
+    def searchLog(self, words=(), author=None, since=None, until=None):
+        """
+        Returns the revisions whose log messages contain all of words,
+        made by author between the dates since and until, in ascending
+        order.  Conditions which are None or empty are left out.
+
+        Words are matched whole and regardless of case.  A word ending
+        in * matches all words starting with what comes before it.
+        Dates are compared as the ISO 8601 strings svn:date has, so
+        that e.g. since="2007-01" until="2007-03-31" covers the first
+        quarter of 2007, until's last day included.
+        """
+        conditions = ["1"]
+        args = []
+        for word in words:
+            if word.endswith("*"):
+                prefix = word[:-1].decode("utf-8", "replace").lower()
+                prefix = prefix.encode("utf-8")
+                conditions.append("rev IN (SELECT rev FROM log_words "
+                                  "WHERE word >= ? AND word < ?)")
+                args.extend((prefix, prefix + "\xff"))
+                continue
+            for token in pat_word.findall(
+                    word.decode("utf-8", "replace").lower()):
+                conditions.append(
+                    "rev IN (SELECT rev FROM log_words WHERE word = ?)")
+                args.append(token.encode("utf-8"))
+        if author != None:
+            conditions.append("author = ?")
+            args.append(author)
+        if since != None:
+            conditions.append("date >= ?")
+            args.append(since)
+        if until != None:
+            # "~" sorts after every character of a date, so this takes
+            # in all of until's dates which are longer than it.
+            conditions.append("date < ?")
+            args.append(until + "~")
+        return self.db.execute(
+            "SELECT * FROM revisions WHERE %s ORDER BY rev"
+            % (" AND ".join(conditions),), args).fetchall()
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.compare: list the differences between two dumpfiles
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+Meant for showing that a run of revisionist-fixprops changed what it
+was meant to, and nothing else.  Both dumpfiles are parsed in
+lockstep, a revision at a time.  Text is compared by digest: the
+Text-content-md5 of the node if it has one (in which case the text is
+skipped, unless it is to be verified), else the md5 of the text.
+"""
+
+import itertools
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from md5 import md5
+from util import file_size
+from validation import STANDARD, TRUST_INPUT, check_level
+from records import RevisionRecord, RecordParser
+from catalog import CatalogParser
+
+# Stands for a header or property which one side doesn't have.
+ABSENT = "(absent)"
+
+
+def compare_dumpfiles(leftPath, rightPath, validation=STANDARD,
+                      processes=1, revisions=None):
+    """
+    Generate a Difference for each way in which the dumpfile at
+    rightPath differs from that at leftPath, in the order of the
+    revisions and nodes of the left dumpfile.
+
+    Revisions are matched by Revision-number, nodes within a revision
+    by Node-path and Node-action.  A node that one side has and the
+    other doesn't is a single difference; so is a revision.
+
+    processes
+        With more than one, both dumpfiles are first indexed (headers
+        only, skipping text), and then compared in ranges of revisions
+        by that many processes.
+
+    revisions
+        A pair (first, last) of the revisions to compare, or None for
+        all.  Either may be None.
+    """
+    check_level(validation)
+    if processes <= 1 and revisions == None:
+        return compare_slices((leftPath, None, rightPath, None, validation))
+    return compare_ranges(leftPath, rightPath, validation, processes,
+                          revisions)
+
+
+class Difference(object):
+    """
+    One difference between two dumpfiles.
+
+    rev, path
+        The Revision-number and Node-path concerned, None for the
+        dumpfile header or for a revision.
+
+    kind
+        What differs: "dumpfile", "header", "property", "text", or
+        "revision" or "node" for one which only one side has.
+
+    name
+        The name of the header or property.
+
+    left, right
+        The values of both sides, ABSENT if a side doesn't have it.
+    """
+
+    def __init__(self, rev, path, kind, name=None, left=None, right=None):
+        self.rev = rev
+        self.path = path
+        self.kind = kind
+        self.name = name
+        self.left = left
+        self.right = right
+
+    def where(self):
+        if self.rev == None:
+            return "dumpfile"
+        if self.path == None:
+            return "r%d" % (self.rev,)
+        return "r%d %s" % (self.rev, self.path)
+
+    def __str__(self):
+        where = self.where()
+        if self.kind in ("revision", "node"):
+            return "%s: %s only in %s" % (where, self.name, self.left)
+        if self.kind == "text":
+            return "%s: text md5 %s != %s" % (where, self.left, self.right)
+        what = self.name
+        if self.kind != "dumpfile":
+            what = "%s %s" % (self.kind, self.name)
+        return "%s: %s: %s != %s" % (where, what, show(self.left),
+                                     show(self.right))
+
+    def __repr__(self):
+        return "Difference(%r, %r, %r, %r, %r, %r)" % (
+            self.rev, self.path, self.kind, self.name, self.left, self.right)
+
+
+def show(value, width=60):
+    if value is ABSENT:
+        return value
+    if value == None:
+        return "(deleted)"
+    text = repr(value)
+    if len(text) > width:
+        text = text[:width-3] + "..."
+    return text
+
+
+class DigestParser(CatalogParser):
+    """
+    A CatalogParser which skips text that has a Text-content-md5 (and
+    is not to be verified), and reads the rest in order to hash it.
+    """
+
+    def parseTextContent(self, dump_props, tlen):
+        if "Text-content-md5" in dump_props:
+            return CatalogParser.parseTextContent(self, dump_props, tlen)
+        text = RecordParser.parseTextContent(self, dump_props, tlen)
+        text.computed_md5 = md5(text).hexdigest()
+        return text
+
+
+def text_digest(record):
+    """
+    The digest by which the text of record is compared, or None if it
+    has none.
+    """
+    if int(record.dump_props.get("Text-content-length", 0)) == 0:
+        return None
+    if "Text-content-md5" in record.dump_props:
+        return record.dump_props["Text-content-md5"]
+    return record.text.computed_md5
+
+
+def summarize(records):
+    """
+    Generate a tuple (revision, nodes) per revision of records: its
+    RevisionRecord and a list of (record, text digest) for its nodes.
+    The text itself is dropped, so that at most one text is held at a
+    time.
+    """
+    revision = None
+    nodes = []
+    for record in records:
+        if type(record) == RevisionRecord:
+            if revision != None:
+                yield revision, nodes
+            revision, nodes = record, []
+        else:
+            nodes.append((record, text_digest(record)))
+            record.text = None
+    if revision != None:
+        yield revision, nodes
+
+
+def compare_slices(args):
+    """
+    Generate the differences between two dumpfiles, or slices of them
+    (see FileSlice).  args is a tuple (leftPath, leftSlice,
+    rightPath, rightSlice, validation), where a slice is a tuple
+    (head, start, stop) or None for the whole dumpfile.
+    """
+    leftPath, leftSlice, rightPath, rightSlice, validation = args
+    left = DigestParser(validation).parse(open_slice(leftPath, leftSlice))
+    right = DigestParser(validation).parse(open_slice(rightPath,
+                                                      rightSlice))
+    leftHeader, rightHeader = left.next().header, right.next().header
+    for name in ("version", "uuid"):
+        a, b = getattr(leftHeader, name), getattr(rightHeader, name)
+        if a != b:
+            yield Difference(None, None, "dumpfile", name, a, b)
+    left, right = summarize(left), summarize(right)
+    a, b = next_or_none(left), next_or_none(right)
+    while a != None or b != None:
+        aRev = a and int(a[0].dump_props["Revision-number"])
+        bRev = b and int(b[0].dump_props["Revision-number"])
+        if b == None or (a != None and aRev < bRev):
+            yield Difference(aRev, None, "revision", "revision", "left")
+            a = next_or_none(left)
+        elif a == None or bRev < aRev:
+            yield Difference(bRev, None, "revision", "revision", "right")
+            b = next_or_none(right)
+        else:
+            for difference in compare_revisions(aRev, a, b):
+                yield difference
+            a, b = next_or_none(left), next_or_none(right)
+
+
+def next_or_none(iterator):
+    for item in iterator:
+        return item
+    return None
+
+
+def compare_revisions(rev, left, right):
+    (leftRevision, leftNodes), (rightRevision, rightNodes) = left, right
+    for difference in compare_records(rev, None, leftRevision,
+                                      rightRevision):
+        yield difference
+    unmatched = {}
+    for node in rightNodes:
+        unmatched.setdefault(node_key(node[0]), []).append(node)
+    for record, digest in leftNodes:
+        key = node_key(record)
+        path = record.dump_props["Node-path"]
+        matches = unmatched.get(key)
+        if not matches:
+            yield Difference(rev, path, "node", "node (%s)" % key[1], "left")
+            continue
+        other, otherDigest = matches.pop(0)
+        for difference in compare_records(rev, path, record, other):
+            yield difference
+        if digest != otherDigest:
+            yield Difference(rev, path, "text", None, digest or ABSENT,
+                             otherDigest or ABSENT)
+    leftover = set()
+    for matches in unmatched.values():
+        leftover.update([id(record) for record, digest in matches])
+    for record, digest in rightNodes:
+        if id(record) in leftover:
+            yield Difference(rev, record.dump_props["Node-path"], "node",
+                             "node (%s)" % node_key(record)[1], "right")
+
+
+def node_key(record):
+    return (record.dump_props["Node-path"],
+            record.dump_props.get("Node-action"))
+
+
+def compare_records(rev, path, left, right):
+    """
+    Generate the differences between the headers and properties of
+    two records.
+    """
+    for name, a, b in compare_dicts(left.dump_props, right.dump_props):
+        yield Difference(rev, path, "header", name, a, b)
+    leftProps, rightProps = left.props, right.props
+    if leftProps == None and rightProps == None:
+        return
+    if (leftProps != None and rightProps != None
+        and leftProps.raw != None and leftProps.raw == rightProps.raw):
+        return
+    for name, a, b in compare_dicts(leftProps or {}, rightProps or {}):
+        yield Difference(rev, path, "property", name, a, b)
+
+
+def compare_dicts(left, right):
+    """
+    Generate (key, left value, right value) for each key whose values
+    differ, in the order of the keys of left, then of right.
+    """
+    for k in left.keys():
+        b = right.get(k, ABSENT)
+        if left[k] != b:
+            yield k, left[k], b
+    for k in right.keys():
+        if k not in left:
+            yield k, ABSENT, right[k]
+
+
+def compare_ranges(leftPath, rightPath, validation, processes,
+                   revisions):
+    """
+    compare_dumpfiles() by ranges of revisions, in parallel if
+    processes > 1.
+    """
+    pool = None
+    imap = itertools.imap
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        imap = pool.imap
+    try:
+        leftIndex, rightIndex = imap(index_dumpfile, [leftPath, rightPath])
+        first, last = revisions or (None, None)
+        revs = sorted(set(leftIndex[0]) | set(rightIndex[0]))
+        revs = [rev for rev in revs
+                if (first == None or rev >= first)
+                and (last == None or rev <= last)]
+        work = []
+        chunk = max(1, len(revs) // (4 * max(processes, 1)) + 1)
+        for i in range(0, len(revs), chunk):
+            lo, hi = revs[i], revs[min(i + chunk, len(revs)) - 1]
+            work.append(((leftPath, slice_of(leftIndex, lo, hi),
+                          rightPath, slice_of(rightIndex, lo, hi),
+                          validation), i == 0))
+        for differences in imap(compare_slice_list, work):
+            for difference in differences:
+                yield difference
+        if pool != None:
+            pool.close()
+    finally:
+        if pool != None:
+            pool.terminate()
+            pool.join()
+
+
+def compare_slice_list((args, first)):
+    """
+    Returns the list of differences of compare_slices(args), reporting
+    those of the dumpfile headers only for the first slice.
+    """
+    return [difference for difference in compare_slices(args)
+            if first or difference.kind != "dumpfile"]
+
+
+def index_dumpfile(path):
+    """
+    Returns a tuple (revs, offsets, end, head) of the ascending
+    revision numbers of the dumpfile at path, the offsets of their
+    revision records, the size of the dumpfile, and its header: the
+    bytes preceding the first revision.
+    """
+    revs = []
+    offsets = []
+    records = CatalogParser(TRUST_INPUT).parse(file(path, "rb"))
+    records.next()
+    for record in records:
+        if type(record) == RevisionRecord:
+            revs.append(int(record.dump_props["Revision-number"]))
+            offsets.append(record.offset)
+    end = file_size(path)
+    headFile = file(path, "rb")
+    head = headFile.read(offsets and offsets[0] or end)
+    headFile.close()
+    return revs, offsets, end, head
+
+
+def slice_of(index, lo, hi):
+    """
+    Returns the slice (head, start, stop) of an indexed dumpfile which
+    holds its revisions lo to hi.
+    """
+    revs, offsets, end, head = index
+    i = bisect_left(revs, lo)
+    j = bisect_right(revs, hi)
+    start = i < len(offsets) and offsets[i] or end
+    stop = j < len(offsets) and offsets[j] or end
+    return head, start, stop
+
+
+def open_slice(path, fileSlice):
+    if fileSlice == None:
+        return file(path, "rb")
+    head, start, stop = fileSlice
+    return FileSlice(head, file(path, "rb"), start, stop)
+
+
+class FileSlice(object):
+    """
+    A read-only file which holds head followed by the bytes start to
+    stop of fileLike: a dumpfile of some of the revisions of another,
+    when head is its header.  It supports what the parser's Reader
+    needs.
+
+    pos
+        The current offset in the slice.
+    """
+
+    def __init__(self, head, fileLike, start, stop):
+        self.head = head
+        self.fileLike = fileLike
+        self.start = start
+        self.stop = stop
+        self.size = len(head) + stop - start
+        self.pos = 0
+        fileLike.seek(start)
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(0, min(offset, self.size))
+        self.fileLike.seek(self.start + max(0, self.pos - len(self.head)))
+
+    def read(self, n=-1):
+        if n < 0:
+            n = self.size - self.pos
+        pieces = []
+        if self.pos < len(self.head):
+            piece = self.head[self.pos:self.pos + n]
+            pieces.append(piece)
+            self.pos += len(piece)
+            n -= len(piece)
+        n = min(n, self.size - self.pos)
+        if n > 0:
+            piece = self.fileLike.read(n)
+            pieces.append(piece)
+            self.pos += len(piece)
+        return "".join(pieces)
+
+    def readline(self):
+        if self.pos < len(self.head):
+            stop = self.head.find("\n", self.pos) + 1 or len(self.head)
+            line = self.head[self.pos:stop]
+        elif self.pos < self.size:
+            # Not readline(limit), which allocates limit bytes.  Slices
+            # end at the start of a revision, so lines rarely cross it.
+            line = self.fileLike.readline()
+            if self.pos + len(line) > self.size:
+                line = line[:self.size - self.pos]
+                self.fileLike.seek(self.start + self.pos + len(line)
+                                   - len(self.head))
+        else:
+            line = ""
+        self.pos += len(line)
+        return line
+
+    def close(self):
+        self.fileLike.close()
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.content: normalize line endings and keywords of file text
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+Subversion keeps the text of files with svn:eol-style set with LF line
+endings, and that of files with svn:keywords set with their keywords
+unexpanded.  Clients which didn't honor this (Subclipse on Windows,
+for one) left dumpfiles in which such files have CRLF line endings or
+expanded keywords.
+"""
+
+import re
+from md5 import md5
+from sha import sha
+from util import odict
+from parser import TextContent
+from dispatch import EventHandler, handle_events
+from history import PathHistory
+from deltas import ContentTracker
+
+# The dump properties of a node which only make sense for a text delta.
+DELTA_HEADERS = ("Text-delta", "Text-delta-base-md5", "Text-delta-base-sha1")
+
+# The names under which each keyword of svn:keywords can appear in a
+# file.
+KEYWORD_ALIASES = {
+    "LastChangedDate": ["LastChangedDate", "Date"],
+    "Date": ["LastChangedDate", "Date"],
+    "LastChangedRevision": ["LastChangedRevision", "Revision", "Rev"],
+    "Revision": ["LastChangedRevision", "Revision", "Rev"],
+    "Rev": ["LastChangedRevision", "Revision", "Rev"],
+    "LastChangedBy": ["LastChangedBy", "Author"],
+    "Author": ["LastChangedBy", "Author"],
+    "HeadURL": ["HeadURL", "URL"],
+    "URL": ["HeadURL", "URL"],
+    "Id": ["Id"],
+    "Header": ["Header"],
+}
+
+
+def normalize_text(events, eol=True, keywords=False, cache=None):
+    """
+    Normalize the text of files as parse events pass through.
+
+    eol
+        If True, the line endings (CRLF or CR) of files with
+        svn:eol-style set are changed to LF.
+
+    keywords
+        If True, the keywords named by svn:keywords are unexpanded:
+        $Id: foo.c 42 ... $ becomes $Id$.  Fixed-width keywords,
+        $Id:: ... $, keep their width.
+
+    Properties are looked up as they were in the node's revision,
+    following copies.  Text-content-length, Content-length and
+    Text-content-md5 (and -sha1, if present) of changed nodes are
+    recomputed.  Text-copy-source-md5 (and -sha1) of later copies of
+    a changed text are rewritten to match.
+
+    Text deltas (of version 3 dumpfiles) are applied to their bases to
+    get the full text.  A node whose text changes, or whose base did,
+    is written with its full text, which version 3 allows as well.
+    The others keep their delta.  See make_text_deltas() to turn the
+    full texts back into deltas.
+
+    cache
+        A ContentCache for the full texts serving as bases of text
+        deltas.  See verify_text_deltas().
+    """
+    normalizer = TextNormalizer(eol, keywords, cache)
+    try:
+        for evt in handle_events(events, normalizer):
+            yield evt
+    finally:
+        if cache == None:
+            normalizer.close()
+
+
+class TextNormalizer(EventHandler):
+    """
+    The EventHandler behind normalize_text().  Events from a BeginNode
+    with text up to its EndNode are held back, as its lengths and
+    checksums can only be recomputed once the text has been seen.
+
+    history
+        A PathHistory mapping each file to a tuple (svn:eol-style,
+        svn:keywords) of its properties, or to None if neither is set.
+
+    changed
+        A PathHistory mapping each file whose text has been changed to
+        a tuple (md5, sha1) of the text as changed.  Files whose text
+        is as it was map to None.
+
+    tracker
+        The ContentTracker which sees the events as they were, to
+        provide the full text of text deltas.
+
+    rev
+        The number of the current revision.
+
+    node
+        The BeginNode of the current node.
+
+    held
+        The events held back, or None.
+    """
+
+    def __init__(self, eol=True, keywords=False, cache=None):
+        EventHandler.__init__(self)
+        self.eol = eol
+        self.keywords = keywords
+        self.history = PathHistory()
+        self.changed = PathHistory()
+        self.tracker = ContentTracker(cache)
+        self.rev = None
+        self.node = None
+        self.held = None
+
+    def close(self):
+        self.tracker.close()
+
+    def onBeginRevision(self, evt):
+        self.tracker.track(evt)
+        self.rev = int(evt["Revision-number"])
+
+    def onBeginNode(self, node):
+        self.tracker.track(node)
+        self.node = node
+        path = node["Node-path"]
+        action = node["Node-action"]
+        if action in ("delete", "replace"):
+            self.history.delete(path, self.rev)
+            self.changed.delete(path, self.rev)
+        if action in ("add", "replace") and "Node-copyfrom-path" in node:
+            src_path = node["Node-copyfrom-path"]
+            src_rev = int(node["Node-copyfrom-rev"])
+            self.history.copy(src_path, src_rev, path, self.rev)
+            self.changed.copy(src_path, src_rev, path, self.rev)
+            checksums = self.changed.get(src_path, src_rev)
+            if checksums != None:
+                for name, value in zip(("Text-copy-source-md5",
+                                        "Text-copy-source-sha1"), checksums):
+                    if name in node:
+                        node[name] = value
+        if int(node.get("Text-content-length", 0)) > 0:
+            self.held = [node]
+            return ()
+        if "Text-content-length" in node:
+            self.setChanged(None)
+
+    def onUserProperties(self, props):
+        self.tracker.track(props)
+        if self.node == None:
+            return None         # revision properties
+        path = self.node["Node-path"]
+        eol_style = keywords = None
+        if self.node.get("Prop-delta") == "true":
+            eol_style, keywords = self.history.get(path) or (None, None)
+        if "svn:eol-style" in props:
+            eol_style = props["svn:eol-style"]
+        if "svn:keywords" in props:
+            keywords = props["svn:keywords"]
+        if eol_style == None and keywords == None:
+            if self.history.get(path) != None:
+                self.history.set(path, self.rev, None)
+        else:
+            self.history.set(path, self.rev, (eol_style, keywords))
+        return self.hold(props)
+
+    def onTextContent(self, text):
+        # the tracker checks text against the node as it was
+        self.tracker.track(text)
+        if self.held == None:
+            return None
+        node = self.node
+        full_text = text
+        delta = node.get("Text-delta") == "true"
+        if delta:
+            full_text = self.tracker.cache.get(self.tracker.text_md5)
+        eol_style, keywords = (self.history.get(node["Node-path"])
+                               or (None, None))
+        if not self.eol:
+            eol_style = None
+        if not self.keywords:
+            keywords = None
+        result = full_text
+        if eol_style != None or keywords != None:
+            result = normalize(full_text, eol_style != None,
+                               keyword_pattern(keywords))
+        if result is full_text:
+            if delta and self.baseChanged(node):
+                text = self.setText(full_text)
+            self.setChanged(None)
+        else:
+            text = self.setText(result)
+            self.setChanged((text.computed_md5, sha(text).hexdigest()))
+        self.held.append(text)
+        return ()
+
+    def onEndNode(self, evt):
+        self.tracker.track(evt)
+        self.node = None
+        if self.held == None:
+            return None
+        held, self.held = self.held, None
+        held.append(evt)
+        return held
+
+    def default(self, evt):
+        self.tracker.track(evt)
+        return self.hold(evt)
+
+    onBeginDumpfile = onEndDumpfile = default
+    onEndRevisionHeader = onEndRevisionNodes = onBlankLine = default
+
+    def hold(self, evt):
+        if self.held != None:
+            self.held.append(evt)
+            return ()
+
+    def setChanged(self, checksums):
+        """
+        Record the checksums (md5, sha1) of the text of the current
+        node as changed, or None if it is as it was.
+        """
+        path = self.node["Node-path"]
+        if checksums != None or self.changed.get(path) != None:
+            self.changed.set(path, self.rev, checksums)
+
+    def baseChanged(self, node):
+        """
+        Returns True if the base of the text delta of node is no longer
+        the text it was.
+        """
+        if "Node-copyfrom-path" in node:
+            return self.changed.get(node["Node-copyfrom-path"],
+                                    int(node["Node-copyfrom-rev"])) != None
+        if node["Node-action"] == "change":
+            return self.changed.get(node["Node-path"]) != None
+        return False
+
+    def setText(self, text):
+        """
+        Make text the full text of the current node, updating its dump
+        properties to match.  Returns text as a TextContent.
+        """
+        node = self.node
+        result = TextContent(text)
+        result.computed_md5 = md5(result).hexdigest()
+        tlen = len(result)
+        dump_props = odict()
+        for k in node.keys():
+            if k not in DELTA_HEADERS:
+                dump_props[k] = node[k]
+        dump_props["Text-content-length"] = tlen
+        dump_props["Content-length"] = (int(node.get("Prop-content-length", 0))
+                                        + tlen)
+        if "Text-content-md5" in node:
+            dump_props["Text-content-md5"] = result.computed_md5
+        if "Text-content-sha1" in node:
+            dump_props["Text-content-sha1"] = sha(result).hexdigest()
+        for k in node.keys():
+            del node[k]
+        for k in dump_props.keys():
+            node[k] = dump_props[k]
+        return result
+
+
+def normalize(text, eol, pattern):
+    """
+    Returns text with its line endings changed to LF if eol is True,
+    and the keywords matched by pattern (if not None) unexpanded.
+    Returns text itself if nothing needed changing.
+    """
+    result = text
+    if eol:
+        result = result.replace("\r\n", "\n").replace("\r", "\n")
+    if pattern != None:
+        result = pattern.sub(unexpand, result)
+    if result == text:
+        return text
+    return result
+
+
+def keyword_pattern(keywords):
+    """
+    Returns a regular expression matching the expanded form of the
+    keywords named in the value of svn:keywords, or None.
+    """
+    if not keywords:
+        return None
+    names = set()
+    for keyword in keywords.split():
+        names.update(KEYWORD_ALIASES.get(keyword, [keyword]))
+    if not names:
+        return None
+    return re.compile(r"\$(%s)(::?)( [^$\n\r]* )\$"
+                      % "|".join([re.escape(n) for n in sorted(names)]))
+
+
+def unexpand(m):
+    if m.group(2) == "::":
+        # fixed-width: keep the width, drop the value
+        return "$%s:: %s$" % (m.group(1), " " * (len(m.group(3)) - 1))
+    return "$%s$" % (m.group(1),)
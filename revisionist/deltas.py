@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.deltas: verify and produce the text of Text-delta nodes
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+"""
+
+from md5 import md5
+from sha import sha
+from util import crop_text_block as msg
+from util import odict
+from validation import DumpfileError
+from parser import BeginDumpfile, TextContent
+from svndiff import apply_svndiff, make_svndiff
+from history import PathHistory
+from cache import ContentCache
+from dispatch import EventHandler, handle_events
+
+EMPTY_MD5 = md5("").hexdigest()
+
+
+def verify_text_deltas(events, cache=None):
+    """
+    Verify Text-content-md5 of nodes with Text-delta: true as the
+    parse events pass through unchanged.
+
+    The parser can only verify the checksum of full texts.  This
+    rebuilds the full text of each delta node by applying it to its
+    base: the previous version of the same path or, for copies, the
+    copy source.
+
+    cache
+        A ContentCache holding the full texts which may serve as
+        bases, keyed by md5.  It bounds the memory used; texts beyond
+        that are spilled to disk.  If None, a ContentCache of default
+        size is used and closed when the events run out.
+    """
+    tracker = ContentTracker(cache)
+    try:
+        for evt in events:
+            tracker.track(evt)
+            yield evt
+    finally:
+        if cache == None:
+            tracker.close()
+
+
+def make_text_deltas(events, cache=None, svndiff_version=0):
+    """
+    Turn the full text of every node into a text delta against its
+    base (the previous version of the same path, or the copy source)
+    as the parse events pass through.  The dumpfile version is raised
+    to 3.  Nodes which already carry a text delta are passed through
+    unchanged.
+
+    Text-delta, Text-delta-base-md5 and Text-delta-base-sha1 are added
+    to the node and Text-content-length and Content-length adjusted.
+    Text-content-md5 continues to describe the full text.
+
+    cache
+        See verify_text_deltas().
+
+    svndiff_version
+        0 (the default, which svnadmin itself writes) or 1 (zlib
+        compressed).
+    """
+    deltifier = TextDeltifier(cache, svndiff_version)
+    try:
+        for evt in handle_events(events, deltifier):
+            yield evt
+    finally:
+        if cache == None:
+            deltifier.close()
+
+
+class TextDeltifier(EventHandler):
+    """
+    The EventHandler behind make_text_deltas().  Each node is held
+    back until we know what becomes of its text.
+
+    tracker
+        The ContentTracker providing the bases.
+
+    held
+        The events of the current node, or None between nodes.
+    """
+
+    def __init__(self, cache=None, svndiff_version=0):
+        EventHandler.__init__(self)
+        self.tracker = ContentTracker(cache)
+        self.svndiff_version = svndiff_version
+        self.held = None
+
+    def close(self):
+        self.tracker.close()
+
+    def onBeginDumpfile(self, evt):
+        self.tracker.track(evt)
+        self.tracker.active = True
+        return [BeginDumpfile(max(evt.version, 3), evt.uuid)]
+
+    def onBeginNode(self, evt):
+        self.tracker.track(evt)
+        self.held = [evt]
+        return ()
+
+    def onTextContent(self, evt):
+        node = self.held[0]
+        if node.get("Text-delta") != "true":
+            evt = self.tracker.deltify(node, evt, self.svndiff_version)
+        else:
+            self.tracker.track(evt)
+        self.held.append(evt)
+        return ()
+
+    def onEndNode(self, evt):
+        self.tracker.track(evt)
+        held, self.held = self.held, None
+        held.append(evt)
+        return held
+
+    def default(self, evt):
+        self.tracker.track(evt)
+        if self.held != None:
+            self.held.append(evt)
+            return ()
+
+    onBeginRevision = onEndRevisionHeader = onEndRevisionNodes = default
+    onEndDumpfile = onUserProperties = onBlankLine = default
+
+
+class ContentTracker(EventHandler):
+    """
+    Follows a stream of parse events, keeping track of the full text
+    of every version of every file.
+
+    history
+        A PathHistory mapping path@rev to the md5 of its full text.
+
+    cache
+        A ContentCache mapping md5 to full text.
+
+    active
+        Full texts are only remembered for dumpfiles of version 3 and
+        higher.  (Only they can contain text deltas.)
+
+    rev
+        The number of the current revision.
+
+    node
+        The BeginNode of the current node, or None.
+
+    text_md5
+        The md5 of the current node's full text, if it has text
+        content.
+    """
+
+    def __init__(self, cache=None):
+        EventHandler.__init__(self)
+        if cache == None:
+            cache = ContentCache()
+        self.cache = cache
+        self.history = PathHistory()
+        self.active = True
+        self.rev = None
+        self.node = None
+        self.text_md5 = None
+
+    def close(self):
+        self.cache.close()
+
+    def track(self, evt):
+        """
+        Update the state of the tracker with the parse event evt.
+        """
+        self.handle(evt)
+
+    def onBeginDumpfile(self, evt):
+        self.active = evt.version >= 3
+
+    def onBeginRevision(self, evt):
+        self.rev = int(evt["Revision-number"])
+
+    def onBeginNode(self, evt):
+        self.node = evt
+        self.text_md5 = None
+
+    def onTextContent(self, evt):
+        if self.active:
+            self.trackText(evt)
+
+    def onEndNode(self, evt):
+        if self.active:
+            self.trackNode(self.node)
+        self.node = None
+
+    def baseText(self, node):
+        """
+        Returns a tuple (md5, text) of the base against which the text
+        delta of node is to be applied.
+        """
+        action = node["Node-action"]
+        if "Node-copyfrom-path" in node:
+            base_md5 = self.history.get(node["Node-copyfrom-path"],
+                                        int(node["Node-copyfrom-rev"]))
+            if base_md5 == None:
+                raise DumpfileError(msg("""
+                    Copy source %s@%s of %s is not a file known to have
+                    existed.""" % (node["Node-copyfrom-path"],
+                                   node["Node-copyfrom-rev"],
+                                   node["Node-path"])))
+        elif action == "change":
+            base_md5 = self.history.get(node["Node-path"])
+            if base_md5 == None:
+                raise DumpfileError(msg("""
+                    %s is changed in revision %d, but is not a file known
+                    to exist.""" % (node["Node-path"], self.rev)))
+        else:
+            base_md5 = EMPTY_MD5
+        if base_md5 == EMPTY_MD5:
+            return base_md5, ""
+        base = self.cache.get(base_md5)
+        if base == None:
+            raise DumpfileError(msg("""
+                The full text of %s (md5 %s) has been lost.
+                """ % (node["Node-path"], base_md5)))
+        return base_md5, base
+
+    def fullText(self, node, text):
+        """
+        Returns the full text of node, given its TextContent text.
+        """
+        if node.get("Text-delta") != "true":
+            return text
+        base_md5, base = self.baseText(node)
+        expected = node.get("Text-delta-base-md5")
+        if expected != None and expected != base_md5:
+            raise DumpfileError(msg("""
+                Text-delta-base-md5 mismatch for %s in revision %d.
+                expected: %s
+                computed: %s
+                """ % (node["Node-path"], self.rev, expected, base_md5)))
+        return apply_svndiff(text, base)
+
+    def trackText(self, text):
+        node = self.node
+        full_text = self.fullText(node, text)
+        computed = md5(full_text).hexdigest()
+        expected = node.get("Text-content-md5")
+        if expected != None and expected != computed:
+            raise DumpfileError(msg("""
+                MD5 mismatch for %s in revision %d after applying the text
+                delta.
+                expected: %s
+                computed: %s
+                """ % (node["Node-path"], self.rev, expected, computed)))
+        if computed not in self.cache:
+            self.cache[computed] = full_text
+        self.text_md5 = computed
+
+    def deltify(self, node, text, svndiff_version=0):
+        """
+        Track the full text text of node, returning it as a TextContent
+        holding a text delta.  The dump properties of node are changed
+        to match.
+        """
+        base_md5, base = self.baseText(node)
+        self.track(text)
+        delta = TextContent(make_svndiff(base, text, svndiff_version))
+
+        headers = [("Text-delta", "true")]
+        if base_md5 != EMPTY_MD5:
+            headers.append(("Text-delta-base-md5", base_md5))
+            headers.append(("Text-delta-base-sha1", sha(base).hexdigest()))
+        headers.append(("Text-content-length", len(delta)))
+        if "Text-content-md5" not in node:
+            headers.append(("Text-content-md5", self.text_md5))
+
+        dump_props = odict()
+        for k in node.keys():
+            if k in ("Text-content-length", "Content-length"):
+                for name, value in headers:
+                    dump_props[name] = value
+                headers = []
+            if k != "Text-content-length":
+                dump_props[k] = node[k]
+        for name, value in headers:
+            dump_props[name] = value
+        plen = int(node.get("Prop-content-length", 0))
+        dump_props["Content-length"] = plen + len(delta)
+
+        for k in node.keys():
+            del node[k]
+        for k in dump_props.keys():
+            node[k] = dump_props[k]
+        return delta
+
+    def trackNode(self, node):
+        path = node["Node-path"]
+        action = node["Node-action"]
+        if action in ("delete", "replace"):
+            self.history.delete(path, self.rev)
+        if action in ("add", "replace"):
+            if "Node-copyfrom-path" in node:
+                self.history.copy(node["Node-copyfrom-path"],
+                                  int(node["Node-copyfrom-rev"]),
+                                  path, self.rev)
+            elif node.get("Node-kind") == "file":
+                self.history.set(path, self.rev, EMPTY_MD5)
+        if self.text_md5 != None:
+            self.history.set(path, self.rev, self.text_md5)
+        elif node.get("Text-content-length") == "0":
+            self.history.set(path, self.rev, EMPTY_MD5)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.dispatch: handle parse events according to their type
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+"""
+
+from parser import BeginDumpfile, EndDumpfile, \
+     BeginRevision, EndRevisionHeader, EndRevisionNodes, \
+     BeginNode, EndNode, UserProperties, TextContent, BlankLine
+
+EVENT_CLASSES = (BeginDumpfile, EndDumpfile,
+                 BeginRevision, EndRevisionHeader, EndRevisionNodes,
+                 BeginNode, EndNode, UserProperties, TextContent, BlankLine)
+
+
+class EventHandler(object):
+    """
+    Dispatches parse events to handlers according to the class of the
+    event.
+
+    A subclass defines a method for each class of event it cares
+    about, named after the class with 'on' in front: onBeginNode,
+    onTextContent, and so on.  Further handlers, which need not be
+    methods, can be added with register().  Events for which there is
+    no handler are ignored.
+
+    handlers
+        Maps each event class to its handler, or to None if it has
+        none.  Classes without a handler method of their own are added
+        as events of them are seen.  Looking up the handler of an event
+        then costs one dictionary lookup, no matter how many handlers
+        there are.
+
+    resolved
+        The classes in handlers which got their handler from a base
+        class, rather than having one of their own.
+
+    Handlers registered for a class also handle its subclasses, unless
+    these have handlers of their own.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.resolved = set()
+        for cls in EVENT_CLASSES:
+            handler = getattr(self, "on" + cls.__name__, None)
+            if handler != None:
+                self.handlers[cls] = handler
+
+    def register(self, eventClass, handler):
+        """
+        Have handler, a function of one argument, handle events of
+        eventClass (and of its subclasses).
+        """
+        for cls in self.resolved:
+            del self.handlers[cls]
+        self.resolved = set()
+        self.handlers[eventClass] = handler
+
+    def resolve(self, eventClass):
+        """
+        Find, and remember, the handler of eventClass, which has none
+        of its own.
+        """
+        handler = None
+        for cls in eventClass.__mro__[1:]:
+            if cls in self.handlers:
+                handler = self.handlers[cls]
+                break
+        self.handlers[eventClass] = handler
+        self.resolved.add(eventClass)
+        return handler
+
+    def handle(self, evt):
+        """
+        Pass evt to its handler, returning what the handler returns.
+        Returns None if there is no handler.
+        """
+        try:
+            handler = self.handlers[evt.__class__]
+        except KeyError:
+            handler = self.resolve(evt.__class__)
+        if handler != None:
+            return handler(evt)
+
+
+def handle_events(events, handler):
+    """
+    Pass a stream of parse events through the EventHandler handler.
+
+    When the handler of an event returns None (as does the lack of a
+    handler) the event is passed on unchanged.  Otherwise the handler
+    must return a sequence of events, which are passed on instead.
+    An empty sequence swallows the event; a handler which holds back
+    events can pass them on later by returning them, followed by the
+    event it was given.
+    """
+    handlers = handler.handlers
+    for evt in events:
+        try:
+            h = handlers[evt.__class__]
+        except KeyError:
+            h = handler.resolve(evt.__class__)
+        if h == None:
+            yield evt
+            continue
+        out = h(evt)
+        if out == None:
+            yield evt
+        else:
+            for evt in out:
+                yield evt
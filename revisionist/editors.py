@@ -10,13 +10,19 @@ License
 """
 
 import sys
+from md5 import md5
 from util import crop_text_block as msg
-from parser import BeginDumpfile, EndDumpfile, \
-     BeginRevision, EndRevisionHeader, EndRevisionNodes, \
-     BeginNode, EndNode, UserProperties, TextContent, BlankLine
+from validation import DumpfileError
+from dispatch import EventHandler, handle_events
+from parser import BeginRevision, BeginNode, UserProperties
+from binary import property_block
+from cache import LRUCache
 
+# A memo_size for edit_properties which suits most repositories.
+MEMO_SIZE = 16*1024*1024
 
-def edit_properties(events, edit):
+
+def edit_properties(events, edit, memo_size=0, memo=None):
     """
     Modifies parse events.  Consumes a stream of parse events,
     invoking the function 'edit' on BeginRevsion, BeginNode and
@@ -28,49 +34,130 @@ def edit_properties(events, edit):
     Changes to UserProperties will automatically cause recomputation
     of Content-length of Prop-content-length of the owning Node or
     Revision.
+
+    If memo_size is greater than 0, up to memo_size bytes of edited
+    property blocks are remembered, by the md5 of the property block
+    before the edit.  Edit is then invoked only once on UserProperties
+    with the same property block, however many nodes or revisions
+    have them.  The others get the remembered result.  This is only
+    correct if edit gives the same result for the same user properties
+    wherever they are, as e.g. a substitution in their values does.
+
+    memo, if not None, is a property_memo() to use instead of a new
+    one, so that several calls with the same edit can share it.
+    """
+    return handle_events(events, PropertyEditor(edit, memo_size, memo))
+
+
+def property_memo(max_size=MEMO_SIZE):
     """
-    evt = events.next()
-    while type(evt) != EndDumpfile:
-        if type(evt) in (BeginRevision, BeginNode) :
-            edit(evt) # Edit dump properties of Node or Revision
-
-            # we'll need to postpone emitting this event and any that
-            # follow until the end of the node or end of the revision
-            # header so that we can recompute Prop and Content lengths
-            # if UserProperties have been changed.
-
-            evt_hold = [evt]
-            prop_evt = None
-            evt = events.next()
-            while type(evt) not in (EndRevisionHeader, EndNode):
-                if type(evt) == UserProperties:
-                    assert prop_evt == None, \
-                        "UserProperties occur at most once in a Revision or Node."
-                    prop_evt = evt
-                evt_hold.append(evt)
-                evt = events.next()
-
-            assert type(evt) in (EndRevisionHeader, EndNode), \
-                "The quarks have come unglued."
-            if prop_evt:
-                assert type(evt_hold[0]) in (BeginRevision, BeginNode), \
-                    "UserProperties can only occur in a Revision or a Node."
-                # edit user properties of node or Revision
-                edit(prop_evt)
-                # recompute Prop-content-length and Content-length
-                dump_props = evt_hold[0]
-                prop_len = len(str(prop_evt))
-                dump_props["Prop-content-length"] = prop_len
-                text_len = int(dump_props.get("Text-content-length", 0))
-                dump_props["Content-length"] = prop_len + text_len
-            for held_evt in evt_hold:
-                yield held_evt
-            yield evt
-        else:
-            yield evt
-        evt = events.next()
-    assert type(evt) == EndDumpfile, "The quarks have come unglued."
-    yield evt
+    Returns an empty memo of edited property blocks for edit_properties,
+    holding up to max_size bytes of them.
+    """
+    return LRUCache(max_size, memo_sizeof)
+
+
+class PropertyEditor(EventHandler):
+    """
+    The EventHandler behind edit_properties().
+
+    Events following a BeginRevision or BeginNode are held back until
+    the end of the revision header or node, so that Prop-content-length
+    and Content-length can be recomputed if UserProperties have been
+    changed.
+
+    held
+        The events held back, starting with the BeginRevision or
+        BeginNode, or None if we're not in a revision header or node.
+
+    prop_evt
+        The UserProperties among held, if any.
+
+    memo
+        None, or an LRUCache mapping the md5 digests of property
+        blocks to the (raw, offsets) of the blocks as edited.
+    """
+
+    def __init__(self, edit, memo_size=0, memo=None):
+        EventHandler.__init__(self)
+        self.edit = edit
+        self.held = None
+        self.prop_evt = None
+        self.memo = memo
+        if memo == None and memo_size > 0:
+            self.memo = property_memo(memo_size)
+
+    def onBeginRevision(self, evt):
+        self.edit(evt) # Edit dump properties of Node or Revision
+        self.held = [evt]
+        self.prop_evt = None
+        return ()
+
+    onBeginNode = onBeginRevision
+
+    def onUserProperties(self, evt):
+        if self.held == None:
+            raise DumpfileError(
+                "UserProperties can only occur in a Revision or a Node.")
+        if self.prop_evt != None:
+            raise DumpfileError(
+                "UserProperties occur at most once in a Revision or Node.")
+        self.prop_evt = evt
+        self.held.append(evt)
+        return ()
+
+    def onTextContent(self, evt):
+        if self.held != None:
+            self.held.append(evt)
+            return ()
+
+    onBlankLine = onTextContent
+
+    def onEndRevisionHeader(self, evt):
+        held, prop_evt = self.held, self.prop_evt
+        if held == None:
+            raise DumpfileError("The quarks have come unglued.")
+        if prop_evt != None:
+            # edit user properties of node or Revision
+            if self.memo != None:
+                edited = self.editMemoized(prop_evt)
+                if edited is not prop_evt:
+                    held[held.index(prop_evt)] = prop_evt = edited
+            else:
+                self.edit(prop_evt)
+            # recompute Prop-content-length and Content-length
+            dump_props = held[0]
+            prop_len = len(str(prop_evt))
+            dump_props["Prop-content-length"] = prop_len
+            text_len = int(dump_props.get("Text-content-length", 0))
+            dump_props["Content-length"] = prop_len + text_len
+        self.held = self.prop_evt = None
+        held.append(evt)
+        return held
+
+    onEndNode = onEndRevisionHeader
+
+    def editMemoized(self, props):
+        """
+        Returns props, edited, or the UserProperties which the same
+        property block turned into the last time.
+        """
+        key = md5(str(props)).digest()
+        block = self.memo.get(key)
+        if block != None:
+            return UserProperties.fromBlock(*block)
+        self.edit(props)
+        self.memo[key] = property_block(props)
+        return props
+
+
+def memo_sizeof(block):
+    """
+    The memory taken by a memo entry (raw, offsets), roughly.
+    """
+    raw, offsets = block
+    return 100 + len(raw) + 8 * len(offsets)
+
 
 def echo_properties(events, property_names):
     """
@@ -80,12 +167,14 @@ def echo_properties(events, property_names):
     property or a dump property with a name in the list events will be
     printed.
     """
-    for evt in events:
-        if type(evt) in [ UserProperties, BeginNode, BeginRevision ]:
-            for name in property_names:
-                if name in evt.keys():
-                    print >>sys.stderr, name, evt[name]
-        yield evt
+    def echo(evt):
+        for name in property_names:
+            if name in evt.keys():
+                print >>sys.stderr, name, evt[name]
+    handler = EventHandler()
+    for cls in (UserProperties, BeginNode, BeginRevision):
+        handler.register(cls, echo)
+    return handle_events(events, handler)
 
 def consume_events(events):
     """
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.export: write the files of a revision, straight from a dumpfile
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+export_tree replays the node actions of a dumpfile up to a revision
+in a PathTree, reading nothing but their headers.  The entry of each
+file is where its text lies in the dumpfile: only the texts which
+survive to the revision are read in the end, by seeking to them.
+"""
+
+import os
+import time
+import itertools
+import multiprocessing
+from util import crop_text_block as msg
+from validation import DumpfileError, TRUST_INPUT
+from records import NodeRecord
+from catalog import CatalogParser, node_row
+from tree import TreeValidator, Directory
+from svndiff import apply_svndiff
+
+# The number of files each task of the workers writes.
+CHUNK_SIZE = 256
+
+
+def export_tree(dumpPath, rev, dstDir, processes=None, catalog=None):
+    """
+    Write the files and directories of revision rev of the dumpfile at
+    dumpPath into the directory dstDir, which is created if need be.
+    Returns an ExportResult.
+
+    Text deltas (of version 3 dumpfiles) are applied to the texts they
+    are deltas against, which are read for this.  Nothing else is
+    read but the headers of the nodes up to rev, and the texts of the
+    files of rev.  Properties, such as svn:executable, are not
+    applied.
+
+    processes
+        The number of processes writing files, by default one per CPU.
+        With 1, all are written by this process.
+
+    catalog
+        The revisionist.catalog.Catalog of the dumpfile, or None.  The
+        nodes are then taken from it, rather than from the dumpfile.
+
+    Raises DumpfileError if the dumpfile has no revision rev, and
+    TreeError if a node acts on a path which is not as it says.
+    """
+    start = time.time()
+    if catalog != None:
+        nodes = catalog.nodes("rev <= ?", (rev,))
+        revisions = [row[0] for row in catalog.db.execute(
+            "SELECT rev FROM revisions WHERE rev <= ? ORDER BY rev", (rev,))]
+        youngest = catalog.db.execute(
+            "SELECT max(rev) FROM revisions").fetchone()[0]
+    else:
+        scanner = NodeScanner(dumpPath, rev)
+        nodes = list(scanner)
+        revisions = scanner.revisions
+        youngest = scanner.youngest
+    if youngest == None or youngest < rev:
+        raise DumpfileError(msg("""
+            The dumpfile %s has no revision %d.""" % (dumpPath, rev)))
+    # Only the trees of the revisions copied from need to be kept.
+    replay = Replay(set([node["copyfrom_rev"] for node in nodes]))
+    root = replay.replay(revisions, nodes)
+    result = ExportResult()
+    files = []
+    make_directories(root, dstDir, files, result)
+    # In the order of the texts in the dumpfile, so that reading it
+    # seeks forward.
+    files.sort(key=lambda (path, text): text and text[0])
+    work = [(dumpPath, files[i:i+CHUNK_SIZE])
+            for i in xrange(0, len(files), CHUNK_SIZE)]
+    if processes == None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(work))
+    if processes <= 1:
+        results = itertools.imap(export_worker, work)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(export_worker, work)
+    try:
+        for count, size in results:
+            result.files += count
+            result.bytes += size
+        if pool != None:
+            pool.close()
+    finally:
+        if pool != None:
+            pool.terminate()
+            pool.join()
+    result.seconds = time.time() - start
+    return result
+
+
+class ExportResult(object):
+    """
+    What export_tree() wrote: the number of files, their total size in
+    bytes, the number of directories (but for the one exported to),
+    and how long it took.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.directories = 0
+        self.seconds = None
+
+
+class NodeScanner(object):
+    """
+    Generates the nodes of the dumpfile at dumpPath up to revision
+    last, as dictionaries of the columns of a catalog's nodes (see
+    revisionist.catalog.node_row).  Only the headers are read.  Text
+    is skipped, and the rest of the dumpfile after last too.
+
+    youngest
+        The youngest revision seen.
+
+    revisions
+        The ascending list of the revisions up to last, those without
+        nodes included.
+    """
+
+    def __init__(self, dumpPath, last):
+        self.dumpPath = dumpPath
+        self.last = last
+        self.youngest = None
+        self.revisions = []
+
+    def __iter__(self):
+        parser = CatalogParser(TRUST_INPUT)
+        dumpFile = file(self.dumpPath, "rb")
+        try:
+            records = parser.parse(dumpFile)
+            records.next()
+            rev = None
+            for record in records:
+                if type(record) == NodeRecord:
+                    yield node_row(rev, record)
+                    continue
+                rev = int(record.dump_props["Revision-number"])
+                self.youngest = rev
+                if rev > self.last:
+                    break
+                self.revisions.append(rev)
+        finally:
+            dumpFile.close()
+
+
+class Replay(TreeValidator):
+    """
+    Replays nodes, as given by NodeScanner or a catalog, in a PathTree
+    whose files are the tuples (offset, length, delta, base) telling
+    where their text is.  If delta is True, the text is a delta
+    against the text base, or against the empty text if base is None.
+    Files without text are FILE, and empty.
+    """
+
+    def replay(self, revisions, nodes):
+        """
+        Replay nodes in revisions, the ascending list of all revisions
+        up to the last of nodes.  Revisions without nodes count too: a
+        copy from one of them is a copy of the tree it has.  Returns
+        the root directory of the tree of the last revision.
+        """
+        byRev = {}
+        for row in nodes:
+            byRev.setdefault(row["rev"], []).append(row)
+        for rev in revisions:
+            self.onBeginRevision({"Revision-number": rev})
+            for row in byRev.get(rev, ()):
+                self.replayNode(row)
+            self.onEndRevisionNodes(None)
+        return self.tree.root
+
+    def replayNode(self, row):
+        node = {"Node-path": row["path"], "Node-action": row["action"]}
+        if row["kind"] != None:
+            node["Node-kind"] = row["kind"]
+        if row["copyfrom_path"] != None:
+            node["Node-copyfrom-path"] = row["copyfrom_path"]
+            node["Node-copyfrom-rev"] = row["copyfrom_rev"]
+        self.onBeginNode(node)
+        if (row["text_length"] == None or row["action"] == "delete"
+            or row["kind"] == "dir"):
+            return
+        base = None
+        if row["text_delta"]:
+            base = self.tree.lookup(row["path"])
+            if type(base) is not tuple:
+                base = None
+        self.tree.add(row["path"], (row["text_offset"], row["text_length"],
+                                    bool(row["text_delta"]), base))
+
+
+def make_directories(directory, dstPath, files, result):
+    """
+    Create the directory (of a PathTree) at dstPath, and the
+    directories below it, while adding a tuple (path, text) for each
+    of its files to the list files.
+    """
+    if not os.path.isdir(dstPath):
+        os.makedirs(dstPath)
+    for name, entry in directory.iteritems():
+        if name in (".", "..") or os.sep in name:
+            raise DumpfileError("Refusing to export the path %r." % (name,))
+        path = os.path.join(dstPath, name)
+        if type(entry) is Directory:
+            result.directories += 1
+            make_directories(entry, path, files, result)
+        elif type(entry) is tuple:
+            files.append((path, entry))
+        else:
+            files.append((path, None))
+
+
+def export_worker(args):
+    """
+    Write the files (see make_directories) from the dumpfile at
+    dumpPath.  Returns a tuple of their number and total size.
+    """
+    dumpPath, files = args
+    size = 0
+    dumpFile = file(dumpPath, "rb")
+    try:
+        for path, text in files:
+            if text == None:
+                data = ""
+            else:
+                data = read_text(dumpFile, text)
+            f = file(path, "wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            size += len(data)
+    finally:
+        dumpFile.close()
+    return len(files), size
+
+
+def read_text(dumpFile, text):
+    """
+    Returns the full text of the file entry text, read from dumpFile,
+    with all the deltas it is made of applied.
+    """
+    chain = []
+    while text != None:
+        chain.append(text)
+        offset, length, delta, base = text
+        if not delta:
+            break
+        text = base
+    data = ""
+    for offset, length, delta, base in reversed(chain):
+        dumpFile.seek(offset)
+        piece = dumpFile.read(length)
+        if len(piece) != length:
+            raise DumpfileError(
+                "The dumpfile ended %d bytes early." % (length - len(piece),))
+        if delta:
+            data = apply_svndiff(piece, data)
+        else:
+            data = piece
+    return data
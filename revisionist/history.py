@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.history: remember what was at path@rev as a dumpfile passes
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+"""
+
+from bisect import bisect_right
+
+
+class PathHistory(object):
+    """
+    Records a value for each version of each file in a repository,
+    e.g. the md5 of its content, so that it can be looked up again as
+    path@rev.  Copies and deletions of whole directories are taken
+    into account.
+
+    Paths are given as they appear in Node-path, without leading
+    slash.  Revisions must be recorded in ascending order.
+
+    revs
+        Maps each path to the ascending list of revisions in which it
+        was set or deleted.
+
+    values
+        Maps each path to the list of its values, parallel to revs.
+        None marks a deletion.
+
+    children
+        Maps each directory path to the set of names which ever
+        appeared in it.  The root directory is "".
+    """
+
+    def __init__(self):
+        self.revs = {}
+        self.values = {}
+        self.children = {}
+
+    def get(self, path, rev=None):
+        """
+        Returns the value of path@rev, or of the latest version of path
+        when rev is None.  Returns None if path did not exist.
+        """
+        revs = self.revs.get(path)
+        if not revs:
+            return None
+        if rev == None:
+            return self.values[path][-1]
+        i = bisect_right(revs, rev)
+        if i == 0:
+            return None
+        return self.values[path][i-1]
+
+    def set(self, path, rev, value):
+        """
+        Record value as path@rev.  (value None deletes path.)
+        """
+        revs = self.revs.get(path)
+        if revs == None:
+            self.revs[path] = [rev]
+            self.values[path] = [value]
+            self.addChild(path)
+        elif revs[-1] == rev:
+            self.values[path][-1] = value
+        else:
+            revs.append(rev)
+            self.values[path].append(value)
+
+    def delete(self, path, rev):
+        """
+        Delete path, and everything below it, in revision rev.
+        """
+        for p in self.walk(path):
+            if self.get(p) != None:
+                self.set(p, rev, None)
+
+    def copy(self, srcPath, srcRev, dstPath, rev):
+        """
+        Copy srcPath@srcRev, and everything below it, to dstPath in
+        revision rev.
+        """
+        prefix = len(srcPath)
+        for p in self.walk(srcPath):
+            value = self.get(p, srcRev)
+            if value != None:
+                self.set(dstPath + p[prefix:], rev, value)
+
+    def walk(self, path):
+        """
+        Generate path and every path below it which ever had a value.
+        """
+        if path in self.revs:
+            yield path
+        names = self.children.get(path)
+        if names:
+            for name in list(names):
+                for p in self.walk(path + "/" + name if path else name):
+                    yield p
+
+    def addChild(self, path):
+        while path:
+            i = path.rfind("/")
+            parent, name = (path[:i], path[i+1:]) if i >= 0 else ("", path)
+            names = self.children.get(parent)
+            if names == None:
+                self.children[parent] = set([name])
+            elif name in names:
+                return
+            else:
+                names.add(name)
+            path = parent
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.merge: stitch several Subversion dumpfiles into one
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+"""
+
+from util import crop_text_block as msg
+from parser import Parser, Reader, BeginDumpfile, BeginRevision, BeginNode
+from validation import DumpfileError, ParseError
+
+
+def merge_dumpfiles(srcFiles, dstFile, renumber=False):
+    """
+    Concatenate the dumpfiles srcFiles (a sequence of file-like
+    objects open for reading) into a single dumpfile written to
+    dstFile.  This is typically used to stitch a series of
+    --incremental dumps back together.
+
+    Only the dumpfile header of the first source is written.  The
+    revisions of each source must continue where the previous source
+    left off, unless renumber is True, in which case each source is
+    shifted so that it does.  Node-copyfrom-rev is shifted to match.
+
+    Dump properties are parsed, but property blocks and text content
+    are copied from source to destination as raw byte ranges.
+    """
+    merger = DumpfileMerger(dstFile, renumber)
+    try:
+        for srcFile in srcFiles:
+            merger.append(srcFile)
+    finally:
+        dstFile.close()
+
+
+class DumpfileMerger(Parser):
+    """
+    Appends dumpfiles, one after the other, to dstFile.
+
+    This is a Parser that only ever parses dump properties.  Everything
+    else is copied to dstFile verbatim.
+
+    dstFile
+        Where the merged dumpfile is written.
+
+    renumber
+        If True, renumber the revisions of each appended dumpfile so
+        that they follow the revisions already written.  If False,
+        they must already do so.
+
+    header
+        The BeginDumpfile written to dstFile, None until the first
+        dumpfile has been appended.
+
+    next_rev
+        The number the next revision written to dstFile must have.
+
+    sources
+        A list of [first, last, offset], one per appended dumpfile.
+        first and last are the original numbers of its first and
+        last revisions.  offset is what must be added to these to
+        get their number in dstFile.
+    """
+
+    def __init__(self, dstFile, renumber=False):
+        Parser.__init__(self)
+        self.dstFile = dstFile
+        self.renumber = renumber
+        self.header = None
+        self.next_rev = None
+        self.sources = []
+
+    def append(self, fileLike):
+        """
+        Append the dumpfile fileLike to dstFile.
+        """
+        self.reader = Reader(fileLike)
+        self.reader.next()
+
+        self.skipBlankLines()
+        version = int(self.parseDumpProperty("SVN-fs-dump-format-version"))
+        if not 2 <= version <= 3:
+            raise ParseError("Only dump format versions 2 and 3 are supported")
+        self.version = version
+        self.skipBlankLines()
+        if self.matchDumpProperty("UUID"):
+            uuid = self.parseDumpProperty("UUID")
+        else:
+            uuid = None
+
+        if self.header == None:
+            self.header = BeginDumpfile(version, uuid)
+            self.dstFile.write(str(self.header))
+            self.copyBlankLines()
+        else:
+            if version > self.header.version:
+                raise DumpfileError(msg("""
+                    Can't append a version %d dumpfile to a version %d
+                    dumpfile.""" % (version, self.header.version)))
+            if (not self.renumber and uuid != None
+                and self.header.uuid != None and uuid != self.header.uuid):
+                raise DumpfileError(msg("""
+                    Can't append a dump of repository %s to a dump of
+                    repository %s without renumbering.
+                    """ % (uuid, self.header.uuid)))
+            self.skipBlankLines()
+
+        source = None
+        while self.matchRevision():
+            dump_props = BeginRevision()
+            self.parseDumpProperties(dump_props)
+            rev = int(dump_props["Revision-number"])
+            if source == None:
+                source = [rev, rev, self.firstRevisionOffset(rev)]
+                self.sources.append(source)
+            source[1] = rev
+            new_rev = rev + source[2]
+            if new_rev != self.next_rev:
+                raise DumpfileError(msg("""
+                    Revisions are not contiguous. Expected revision %d,
+                    but found revision %d.""" % (self.next_rev, new_rev)))
+            dump_props["Revision-number"] = new_rev
+            self.next_rev = new_rev + 1
+            self.dstFile.write(str(dump_props))
+            self.copyContent(dump_props)
+
+            while self.matchNode():
+                dump_props = BeginNode()
+                self.parseDumpProperties(dump_props)
+                if "Node-copyfrom-rev" in dump_props:
+                    dump_props["Node-copyfrom-rev"] = self.mapRevision(
+                        int(dump_props["Node-copyfrom-rev"]))
+                self.dstFile.write(str(dump_props))
+                self.copyContent(dump_props)
+
+        if not self.reader.eof:
+            raise ParseError(msg("Stopped merging before end of input\n"
+                                 + str(self.reader)))
+
+    def firstRevisionOffset(self, rev):
+        """
+        Returns the offset to apply to the revisions of a dumpfile
+        starting with revision rev.
+        """
+        if self.next_rev == None:
+            self.next_rev = rev
+            return 0
+        elif self.renumber:
+            return self.next_rev - rev
+        else:
+            return 0
+
+    def mapRevision(self, rev):
+        """
+        Translate rev, as referred to by Node-copyfrom-rev, to the
+        number it has in dstFile.  The most recently appended
+        dumpfile containing rev wins.
+        """
+        for first, last, offset in reversed(self.sources):
+            if first <= rev <= last:
+                return rev + offset
+        if self.renumber:
+            raise DumpfileError(msg("""
+                Node-copyfrom-rev %d refers to a revision which is not
+                part of any of the merged dumpfiles. It can't be
+                renumbered.""" % (rev,)))
+        return rev
+
+    def parseDumpProperties(self, store):
+        while self.matchDumpProperty():
+            self.parseDumpProperty(store=store)
+
+    def copyBlankLines(self):
+        while self.reader.cur == "\n":
+            self.dstFile.write("\n")
+            self.reader.next()
+
+    def copyContent(self, dump_props):
+        """
+        Copy the blank line, properties and text following the dump
+        properties of a revision or node, as well as any blank lines
+        after them.
+        """
+        if "Content-length" in dump_props:
+            clen = int(dump_props["Content-length"])
+        else:
+            clen = (int(dump_props.get("Prop-content-length", 0))
+                    + int(dump_props.get("Text-content-length", 0)))
+        if clen > 0:
+            self.dstFile.write(str(self.parseBlankLine()))
+            copied = self.reader.copyBytes(clen, self.dstFile)
+            if copied != clen:
+                raise ParseError(msg("""
+                    Expected %d bytes of content, but the input ended
+                    after %d bytes.""" % (clen, copied)))
+        self.copyBlankLines()
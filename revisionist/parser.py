@@ -11,18 +11,31 @@ License
 
 import re
 import sys
+import time
 from md5 import md5
+from sha import sha
 from util import crop_text_block as msg
 from util import curry, odict
+from validation import ParseError, DumpfileError, check_level, \
+     PARANOID, STANDARD, TRUST_INPUT
 
 # ------------------------------------------------------------------------
 # This module's primary entry point(s)
 # ------------------------------------------------------------------------
 
-def pull(fileLike):
+def pull(fileLike, validation=STANDARD, follow=None):
     """
     Parse the SVN Dumpfile in the open file fileLike.
 
+    validation
+        PARANOID, STANDARD or TRUST_INPUT.  How much of the input to
+        check.  See revisionist.validation.
+
+    follow
+        None, or a function which is called when the input ends (or
+        ends in the middle of a line or text) to wait for more, as for
+        a dumpfile which is still being written.  See Follow.
+
     This is a generator. It yields a series of parse events described
     by the following BNF-like notation::
 
@@ -49,7 +62,7 @@ def pull(fileLike):
         )*
       EndDumpFile
     """
-    return Parser().parse(fileLike)
+    return Parser(validation, follow).parse(fileLike)
 
 # ------------------------------------------------------------------------
 # Parse Events
@@ -158,20 +171,233 @@ class EndNode( object ):
         return "EndNode()"
 
 
-class UserProperties( odict ):
+class UserProperties(object):
     """
     Parse Event. Signals user properties, i.e. Node or Revision
     properties in the SVN sense.
 
-    This is a dictionary.  It's items are the user parsed user
-    properties, e.g. 'svn:externals', 'svn:log', etc.
+    This is a mapping with the interface of odict.  It's items are the
+    user parsed user properties, e.g. 'svn:externals', 'svn:log', etc.
 
     keys() preserves declaration order.
 
     This may occur between BeginNode and EndNode or between
     BeginRevision and EndRevisionHeader.
+
+    The parser creates UserProperties lazily (see fromBlock): they
+    hold the raw bytes of the property block and the offsets of its
+    entries.  Keys are only sliced out of raw when first asked for,
+    values only when looked up.  Everything is decoded into data once
+    that becomes unavoidable, e.g. by modification.  As long as no
+    value has actually changed, str() returns raw as is.
+
+    UserProperties are not a dict, as code reading a dict's storage
+    directly (dict(props), {}.update(props), json) would see nothing
+    of what has not been decoded yet.  dict() and update() take them
+    as any mapping, through keys() and __getitem__.
+
+    raw
+        The property block exactly as parsed, or None once modified.
+
+    offsets
+        The entries of raw as a flat list of [key_start, key_stop,
+        value_start, value_stop, ...].  value_start is -1 for
+        deletions.  None once everything has been decoded.
+
+    names
+        Cache of the keys sliced from raw, or None.
+
+    data
+        The odict of the decoded properties.  Empty until offsets is
+        None.
     """
+
+    # mutable, so unhashable, as a dict is
+    __hash__ = None
+
+    def __init__(self, *args, **kwargs):
+        self.raw = None
+        self.offsets = None
+        self.names = None
+        if len(args) == 1 and isinstance(args[0], UserProperties):
+            args = (args[0].items(),)
+        self.data = odict(*args, **kwargs)
+
+    def fromBlock(cls, raw, offsets):
+        """
+        Returns UserProperties which decode themselves from the
+        property block raw on demand.  See scanUserProperties.
+        """
+        props = cls()
+        props.raw = raw
+        props.offsets = offsets
+        return props
+    fromBlock = classmethod(fromBlock)
+
+    def load(self):
+        """
+        Decode all keys and values of raw into data.
+        """
+        raw, offsets = self.raw, self.offsets
+        if offsets == None:
+            return
+        self.offsets = self.names = None
+        data = self.data
+        for i in xrange(0, len(offsets), 4):
+            if offsets[i+2] < 0:
+                data[raw[offsets[i]:offsets[i+1]]] = None
+            else:
+                data[raw[offsets[i]:offsets[i+1]]] = \
+                    raw[offsets[i+2]:offsets[i+3]]
+
+    def keys(self):
+        if self.offsets != None:
+            if self.names == None:
+                raw, offsets = self.raw, self.offsets
+                self.names = [raw[offsets[i]:offsets[i+1]]
+                              for i in xrange(0, len(offsets), 4)]
+            return list(self.names)
+        return self.data.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        if self.offsets != None:
+            return len(self.offsets) // 4
+        return len(self.data)
+
+    def __contains__(self, key):
+        if self.offsets != None:
+            return key in self.keys()
+        return key in self.data
+
+    def has_key(self, key):
+        return key in self
+
+    def __getitem__(self, key):
+        if self.offsets != None:
+            raw, offsets = self.raw, self.offsets
+            for i in xrange(0, len(offsets), 4):
+                if raw[offsets[i]:offsets[i+1]] == key:
+                    if offsets[i+2] < 0:
+                        return None
+                    return raw[offsets[i+2]:offsets[i+3]]
+            raise KeyError(key)
+        return self.data[key]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        self.load()
+        if self.raw != None:
+            if key in self.data and self.data[key] == value:
+                return # nothing changes, so keep raw
+            self.raw = None
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        self.load()
+        self.raw = None
+        del self.data[key]
+
+    def values(self):
+        self.load()
+        return [self.data[k] for k in self.data.keys()]
+
+    def items(self):
+        self.load()
+        return [(k, self.data[k]) for k in self.data.keys()]
+
+    def itervalues(self):
+        self.load()
+        return self.data.itervalues()
+
+    def iteritems(self):
+        self.load()
+        return self.data.iteritems()
+
+    def hasDeletions(self):
+        """
+        True if any property is to be deleted, i.e. has value None.
+        """
+        if self.offsets != None:
+            return -1 in self.offsets[2::4]
+        return None in self.values()
+
+    def copy(self):
+        if self.offsets != None:
+            return self.__class__.fromBlock(self.raw, self.offsets)
+        cp = self.__class__(self.items())
+        cp.raw = self.raw
+        return cp
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        # keys and values are strings, so a shallow copy is deep
+        return self.copy()
+
+    def __reduce__(self):
+        if self.offsets != None:
+            return (_user_properties_from_block,
+                    (self.__class__, self.raw, self.offsets))
+        return (_user_properties_from_items,
+                (self.__class__, self.items(), self.raw))
+
+    def update(self, *args, **kwargs):
+        for k, v in odict(*args, **kwargs).iteritems():
+            self[k] = v
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self and default:
+            return default[0]
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        keys = self.keys()
+        if not keys:
+            raise KeyError("popitem(): dictionary is empty")
+        key = keys[-1]
+        return key, self.pop(key)
+
+    def clear(self):
+        for k in self.keys():
+            del self[k]
+
+    def __eq__(self, other):
+        if isinstance(other, UserProperties):
+            if self.raw != None and self.raw == other.raw:
+                return True
+            other.load()
+            other = other.data
+        elif not isinstance(other, dict):
+            return NotImplemented
+        self.load()
+        return dict.__eq__(self.data, other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
     def __str__(self):
+        if self.raw != None:
+            return self.raw
         out = []
         for k in self.keys():
             v = self[k]
@@ -183,7 +409,20 @@ class UserProperties( odict ):
             out.append("PROPS-END\n")
         return "".join(out)
     def __repr__(self):
-        return "UserProperties(%s)" % odict.__repr__(self)
+        self.load()
+        return "UserProperties(%s)" % odict.__repr__(self.data)
+
+
+def _user_properties_from_block(cls, raw, offsets):
+    # for pickling (see UserProperties.__reduce__)
+    return cls.fromBlock(raw, offsets)
+
+
+def _user_properties_from_items(cls, items, raw):
+    # for pickling (see UserProperties.__reduce__)
+    props = cls(items)
+    props.raw = raw
+    return props
 
 
 class TextContent( str ):
@@ -193,7 +432,12 @@ class TextContent( str ):
 
     It behaves like a string.  It not only signals the content, it
     *is* the content.
+
+    computed_md5
+        The md5 of the content, if the parser has already computed it
+        (and found it to match Text-content-md5), else None.
     """
+    computed_md5 = None
     def __repr__(self):
         return "TextContent(%s)" % str.__repr__(self)
 
@@ -216,6 +460,19 @@ class BlankLine(object):
 
 pat_dump_property = re.compile(r"^([-A-Za-z0-9_]+):[ ](.*)$")
 
+# The states of Parser.parseDumpfile, named after what may come next.
+IN_DUMPFILE = 0         # BlankLine, BeginRevision or EndDumpfile
+REVISION_BLANK = 1      # BlankLine, UserProperties or EndRevisionHeader
+REVISION_PROPS = 2      # UserProperties, BlankLine or EndRevisionHeader
+REVISION_TAIL = 3       # BlankLine or EndRevisionHeader
+IN_REVISION = 4         # BeginNode or EndRevisionNodes
+NODE_BLANK = 5          # the BlankLine preceding the node's content
+NODE_PROPS = 6          # UserProperties
+NODE_TEXT = 7           # TextContent
+NODE_TEXT_END = 8       # the BlankLine terminating TextContent
+NODE_TAIL = 9           # BlankLine or EndNode
+DONE = 10               # nothing: EndDumpfile has been yielded
+
 class Parser(object):
     """
     A parser for Subversion dump file format versions 2 and 3.
@@ -228,8 +485,9 @@ class Parser(object):
     this module.
 
     This parser is intentionally *very* unforgiving.  It will stop
-    noisily with an AssertionError if anything about its input doesn't
-    meet with its expectations.
+    noisily with a ParseError if anything about its input doesn't
+    meet with its expectations.  How much of its input it checks is
+    up to validation.  See revisionist.validation.
 
     It's better to fail obviously than to silently corrupt your data,
     after all.  (Incidentally, being so explicit about my assumptions
@@ -237,54 +495,160 @@ class Parser(object):
     easier to develop a *correct* parser.)
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, validation=STANDARD, follow=None):
+        self.validation = check_level(validation)
+        self.follow = follow
+        self.check_lengths = validation != TRUST_INPUT
+        self.check_md5 = validation != TRUST_INPUT
+        self.check_sha1 = validation == PARANOID
 
     def parse(self, fileLike):
         """
         Generate parse events from the bytes provided by fileLike.
         """
-        try:
-            self.reader = None
-            self.reader = Reader(fileLike)
-            self.reader.next()
-            for evt in self.parseDumpfile():
-                yield evt
-        except AssertionError, e :
-            sys.stderr.write(str(self.reader)+"\n")
-            raise
-        else:
-            assert self.reader.eof, msg("Stopped parsing before end of input\n"
-                                        + str(self.reader))
+        return self.parseDumpfile(fileLike)
 
-    def parseDumpfile(self):
+    def startParsing(self, fileLike):
+        self.reader = None
+        self.reader = Reader(fileLike, self.follow)
+        self.reader.next()
+
+    def reportError(self):
+        sys.stderr.write(str(self.reader)+"\n")
+
+    def finishParsing(self):
+        if not self.reader.eof:
+            raise ParseError(msg("Stopped parsing before end of input\n"
+                                 + str(self.reader)))
+
+    def parseDumpfile(self, fileLike):
         """
         A Dumpfile consists of a Version, an (optional?) UUID, and
         zero or more Revisions.  Extra blank lines may occur.  Blank
         lines before and after the version declaration are not
-        reported.
+        reported.  A Revision may contain UserProperties, but never
+        TextContent::
+
+          Revision =
+            BeginRevision
+            BlankLine?
+            UserProperties?
+            BlankLine*
+            EndRevisionHeader
+              (
+              BeginNode
+              BlankLine?
+              UserProperties?
+                (
+                TextContent
+                BlankLine
+                )?
+              BlankLine*
+              EndNode
+              )*
+            EndRevisionNodes
+
+        This is a single loop with a single yield.  state says where
+        in the grammar we are, i.e. what may follow the event just
+        yielded.  (Nested generators would pass each event up through
+        as many as four levels.)
+        """
+        try:
+            self.startParsing(fileLike)
+            reader = self.reader
+            evt = self.parseDumpfileHeader()
+            state = IN_DUMPFILE
+            while True:
+                yield evt
+                cur = reader.cur
+                if state == NODE_TAIL:
+                    if cur == "\n":
+                        reader.next()
+                        evt = BlankLine()
+                    else:
+                        evt = EndNode()
+                        state = IN_REVISION
+                elif state == IN_REVISION:
+                    if cur.startswith("Node-path: "):
+                        evt, plen, tlen = self.parseNodeHeader()
+                        node = evt
+                        if plen > 0 or tlen > 0:
+                            state = NODE_BLANK
+                        else:
+                            state = NODE_TAIL
+                    else:
+                        evt = EndRevisionNodes()
+                        state = IN_DUMPFILE
+                elif state == NODE_BLANK:
+                    evt = self.parseBlankLine()
+                    if plen > 0:
+                        state = NODE_PROPS
+                    else:
+                        state = NODE_TEXT
+                elif state == NODE_PROPS:
+                    evt = self.parseUserProperties(
+                        plen, node.get("Prop-delta") == "true")
+                    if tlen > 0:
+                        state = NODE_TEXT
+                    else:
+                        state = NODE_TAIL
+                elif state == NODE_TEXT:
+                    evt = self.parseTextContent(node, tlen)
+                    state = NODE_TEXT_END
+                elif state == NODE_TEXT_END:
+                    # TextContent is always terminated by an 'extra'
+                    # newline, which getBytes consumes for us, but
+                    # does not return.
+                    evt = BlankLine()
+                    state = NODE_TAIL
+                elif state == IN_DUMPFILE:
+                    if cur == "\n":
+                        reader.next()
+                        evt = BlankLine()
+                    elif cur.startswith("Revision-number: "):
+                        evt, plen = self.parseRevisionHeader()
+                        state = REVISION_BLANK
+                    else:
+                        evt = EndDumpfile()
+                        state = DONE
+                elif state == DONE:
+                    break
+                elif cur == "\n":
+                    # REVISION_BLANK, REVISION_PROPS or REVISION_TAIL
+                    reader.next()
+                    evt = BlankLine()
+                    if state == REVISION_BLANK:
+                        state = REVISION_PROPS
+                    else:
+                        state = REVISION_TAIL
+                elif state != REVISION_TAIL and self.matchUserProperties():
+                    evt = self.parseUserProperties(plen)
+                    state = REVISION_TAIL
+                else:
+                    evt = EndRevisionHeader()
+                    state = IN_REVISION
+        except DumpfileError, e :
+            self.reportError()
+            raise
+        self.finishParsing()
+
+    def parseDumpfileHeader(self):
+        """
+        Parse the version declaration and UUID, returning them as a
+        BeginDumpfile.
         """
         self.version = None
         self.skipBlankLines()
         version = int(self.parseDumpProperty("SVN-fs-dump-format-version"))
-        assert 2 <= version <= 3, \
-               "Only dump format versions 2 and 3 are supported"
+        if not 2 <= version <= 3:
+            raise ParseError("Only dump format versions 2 and 3 are supported")
         self.version = version
         self.skipBlankLines()
         if self.matchDumpProperty("UUID"):
             uuid = self.parseDumpProperty("UUID")
         else:
             uuid = None
-
-        yield BeginDumpfile(version, uuid)
-
-        for evt in self.parseBlankLines(): yield evt
-
-        while self.matchRevision():
-            for evt in self.parseRevision(): yield evt
-            for evt in self.parseBlankLines(): yield evt
-
-        yield EndDumpfile()
+        return BeginDumpfile(version, uuid)
 
     def matchDumpProperty(self, name=None):
         if name:
@@ -315,10 +679,13 @@ class Parser(object):
         """
         m = pat_dump_property.match(self.reader.cur)
 
-        assert m, "Expecting a dump property, but found \n%s" % (self.reader,)
-        assert name == None or name == m.group(1), msg("""
-            Expected property %s, but found %s
-            """ % (name, m.group(1)))
+        if not m:
+            raise ParseError("Expecting a dump property, but found \n%s"
+                             % (self.reader,))
+        if name != None and name != m.group(1):
+            raise ParseError(msg("""
+                Expected property %s, but found %s
+                """ % (name, m.group(1))))
 
         value = m.group(2)
         if store != None:
@@ -344,14 +711,20 @@ class Parser(object):
         Parse blank line in input, reporting it as a BlankLine()
         event.
         """
-        assert self.reader.cur == "\n", "Expected blank line"
+        if self.reader.cur != "\n":
+            raise ParseError("Expected blank line")
         self.reader.next()
         return BlankLine()
 
-    def parseBlankLines(self):
+    def countBlankLines(self):
+        """
+        Skip blank lines in input, returning how many there were.
+        """
+        n = 0
         while self.reader.cur == "\n":
             self.reader.next()
-            yield BlankLine()
+            n += 1
+        return n
 
 
     def getBytes(self, n):
@@ -362,168 +735,144 @@ class Parser(object):
         We consume one extra byte of input without reporting it. It is
         always a line feed character which terminates the value.
         """
-        buf, buflen = [], 0
-        while n >= buflen and not self.reader.eof:
-            buflen += len(self.reader.cur)
-            buf.append(self.reader.cur)
-            self.reader.next()
-        assert buflen == n+1 and buf[-1][-1] == '\n', \
-            "Didn't find expected newline terminator."
-        buf[-1] = buf[-1][:-1] # strip newline terminator
-        result = "".join(buf)
-        assert len(result) == n
+        result = self.reader.readBytes(n)
+        if len(result) != n or self.reader.cur != "\n":
+            raise ParseError("Didn't find expected newline terminator.")
+        self.reader.next()
         return result
 
     def matchRevision(self):
         return self.matchDumpProperty("Revision-number")
 
-    def parseRevision(self):
+    def parseRevisionHeader(self):
         """
-        Parse a revision, which may contain UserProperties and will
-        not include TextContent::
-
-          Revision =
-            BeginRevision
-            BlankLine?
-            UserProperties?
-            BlankLine*
-            EndRevisionHeader
-              (
-              BeginNode
-              BlankLine?
-              UserProperties?
-                (
-                TextContent
-                BlankLine
-                )?
-              BlankLine*
-              )*
-            EndRevisionNodes
+        Parse the dump properties of a revision.  Returns a tuple
+        (BeginRevision, Prop-content-length).
         """
         dump_props = odict()
         rev = int(self.parseDumpProperty("Revision-number", dump_props))
         plen = int(self.parseDumpProperty("Prop-content-length", dump_props))
         clen = int(self.parseDumpProperty("Content-length", dump_props))
-        assert clen - plen == 0, "A revision never has text content."
-
-        yield BeginRevision(dump_props)
-
-        if self.matchBlankLine():
-            yield self.parseBlankLine()
-        if self.matchUserProperties():
-            yield self.parseUserProperties(plen)
-        for evt in self.parseBlankLines():
-            yield evt
-
-        yield EndRevisionHeader()
-
-        while self.matchNode():
-            for evt in self.parseNode():
-                yield evt
-
-        yield EndRevisionNodes()
+        if self.check_lengths and clen - plen != 0:
+            raise ParseError("A revision never has text content.")
+        return BeginRevision(dump_props), plen
 
     def matchUserProperties(self):
         return (self.matchUserPropertyKey()
                 or self.matchUserPropertyDelete())
 
     def parseUserProperties(self, plen, prop_delta=False):
-        start = self.reader.start
-        properties = UserProperties()
-        while not self.matchUserPropertyEnd():
-            assert not self.reader.eof, msg("""
+        """
+        Parse a block of user properties, which Prop-content-length
+        tells us is plen bytes long::
+
+          ( K n newline bytes[n] newline V n newline bytes[n] newline
+          | D n newline bytes[n] newline )*
+          PROPS-END newline
+
+        The whole block is read at once and handed to
+        scanUserProperties.  Should the block turn out not to end with
+        PROPS-END, plen was wrong.  We then keep reading until we find
+        PROPS-END so that we can report the actual length.
+        """
+        block = self.reader.readBytes(plen)
+        while True:
+            properties, stop = self.scanUserProperties(block, prop_delta)
+            if stop != None or self.reader.eof:
+                break
+            block += self.reader.cur
+            self.reader.next()
+        if stop == None:
+            raise ParseError(msg("""
                 Expected to find a user property, instead found end of file.
-                """)
-            if self.matchUserPropertyKey():
-                key = self.parseUserPropertyKey()
-                value = self.parseUserPropertyValue()
-                properties[key] = value
-            elif self.matchUserPropertyDelete():
-                assert prop_delta, msg("""
-                    Property deletion (operation 'D') is only allowed
-                    when the Prop-delta dump property is true for the
-                    containing node or revision.
-                    """)
-                key = self.parseUserPropertyDelete()
-                properties[key] = None
-        else:
-            self.parseUserPropertyEnd()
-        stop = self.reader.start
-        assert plen == stop - start, msg(
-            """Property-Legnth is incorrect.
-            Expected %d bytes, but found %d bytes.""" % (
-                plen, stop - start))
+                """))
+        # Not just a length check: a property block we haven't read
+        # exactly would leave the parser stranded in the middle of the
+        # input.
+        if plen != stop:
+            raise ParseError(msg(
+                """Property-Legnth is incorrect.
+                Expected %d bytes, but found %d bytes.""" % (
+                    plen, stop)))
         return properties
 
-    def matchUserPropertyEnd(self):
-        return self.reader.cur == "PROPS-END\n"
+    def scanUserProperties(self, block, prop_delta=False):
+        """
+        Scan the user properties at the start of block.  Returns a
+        tuple (UserProperties, stop), where stop is the offset
+        following PROPS-END newline.  Returns (None, None) if block
+        ends before PROPS-END was found.
 
-    def parseUserPropertyEnd(self):
-        assert self.matchUserPropertyEnd(), msg("""
-            Expected PROPS-END, but found\n%s
-            """ % (self.reader,))
-        self.reader.next()
+        Nothing is decoded here.  We only note where each key and
+        value lies in block.  See UserProperties.fromBlock.
+        """
+        offsets = []
+        end = len(block)
+        pos = 0
+        while not block.startswith("PROPS-END\n", pos):
+            kind = block[pos:pos+2]
+            nl = block.find("\n", pos)
+            if nl < 0:
+                return None, None
+            if kind != "K " and kind != "D ":
+                raise ParseError(msg("""
+                    Expected a pair of property entry lines, where the
+                    first has the form (K|V|D) <number>. Found this:
+                    %s""" % (block[pos:nl+1],)))
+            start = nl + 1
+            pos = start + int(block[pos+2:nl])
+            if pos >= end:
+                return None, None
+            if block[pos] != "\n":
+                raise ParseError("Didn't find expected newline terminator.")
+            offsets.append(start)
+            offsets.append(pos)
+            pos += 1
+            if kind == "D ":
+                if not prop_delta:
+                    raise ParseError(msg("""
+                        Property deletion (operation 'D') is only allowed
+                        when the Prop-delta dump property is true for the
+                        containing node or revision.
+                        """))
+                offsets.append(-1)
+                offsets.append(-1)
+                continue
+            nl = block.find("\n", pos)
+            if nl < 0:
+                return None, None
+            if not block.startswith("V ", pos):
+                raise ParseError(msg("""
+                    Expected a pair of property entry lines, where the
+                    first has the form (K|V|D) <number>. Found this:
+                    %s""" % (block[pos:nl+1],)))
+            start = nl + 1
+            pos = start + int(block[pos+2:nl])
+            if pos >= end:
+                return None, None
+            if block[pos] != "\n":
+                raise ParseError("Didn't find expected newline terminator.")
+            offsets.append(start)
+            offsets.append(pos)
+            pos += 1
+        stop = pos + len("PROPS-END\n")
+        return UserProperties.fromBlock(block[:stop], offsets), stop
 
     def matchUserPropertyKey(self):
         return self.reader.cur.startswith("K ")
 
-    def parseUserPropertyKey(self):
-        assert self.matchUserPropertyKey()
-        key = self.getPropertyEntryContent()
-        return key
-
-    def matchUserPropertyValue(self):
-        return self.reader.cur.startswith("V ")
-
-    def parseUserPropertyValue(self):
-        assert self.matchUserPropertyValue()
-        value = self.getPropertyEntryContent()
-        return value
-
     def matchUserPropertyDelete(self):
         return self.reader.cur.startswith("D ")
 
-    def parseUserPropertyDelete(self):
-        assert self.matchUserPropertyDelete()
-        key = self.getPropertyEntryContent()
-        return key
-
-    def getPropertyEntryContent(self):
-        """
-        Parses property entry of the form:
-
-           chararcter space n:integer newline bytes[n] newline
-
-        and returns the bytes[n].
-        """
-        assert (len(self.reader.cur) and
-                self.reader.cur[0:2] in ['K ', 'V ', 'D ']), msg("""
-                Expected a pair of property entry lines, where the
-                first has the form (K|V|D) <number>. Found this:
-                %s""" % (self.reader,))
-        n = int(self.reader.cur[2:])
-        self.reader.next()
-        result = self.getBytes(n)
-        return result
-
     def matchNode(self):
         return self.matchDumpProperty("Node-path")
 
-    def parseNode(self):
+    def parseNodeHeader(self):
         """
-        Parse a single node, which may contain both UserProperties and
-        TextContent.
-
-          Node =
-              BeginNode
-              BlankLine?
-              UserProperties?
-                (
-                TextContent
-                BlankLine
-                )?
+        Parse the dump properties of a node.  Returns a tuple
+        (BeginNode, Prop-content-length, Text-content-length), where
+        missing lengths are 0.
         """
-        chunk_pos = self.reader.start
         dump_props = BeginNode()
         node_path = self.parseDumpProperty("Node-path", dump_props)
         if self.matchDumpProperty("Node-kind"):
@@ -542,9 +891,16 @@ class Parser(object):
         # e.g. a dir node with action add and no properties has no
         # lengths at all.
 
+        reader = self.reader
+        match = pat_dump_property.match
         tlen, plen, clen = None, None, None
-        while self.matchDumpProperty():
-            name, value = self.parseDumpProperty(store=dump_props)
+        m = match(reader.cur)
+        while m:
+            # parseDumpProperty(store=dump_props), without matching
+            # each line twice.
+            name, value = m.group(1, 2)
+            dump_props[name] = value
+            m = match(reader.next())
             if name == "Text-content-length":
                 tlen = int(value)
             elif name == "Prop-content-length":
@@ -554,70 +910,81 @@ class Parser(object):
 
         prop_delta = dump_props.get("Prop-delta") == "true"
         if prop_delta:
-            assert self.version > 2, msg("""
-                Property deltas should not occur in this dumpfile.
-                Its format is too old to support them.
-                """)
+            if self.version < 3:
+                raise ParseError(msg("""
+                    Property deltas should not occur in this dumpfile.
+                    Its format is too old to support them.
+                    """))
 
         text_delta = dump_props.get("Text-delta") == "true"
         if text_delta:
-            assert self.version > 2, msg("""
-                Text deltas should not occur in this dumpfile.
-                Its format is too old to support them.
-                """)
+            if self.version < 3:
+                raise ParseError(msg("""
+                    Text deltas should not occur in this dumpfile.
+                    Its format is too old to support them.
+                    """))
 
         if clen == None:
             clen = 0
         if plen == None:
             plen = 0
         if tlen != None:
-            assert tlen == clen - plen, msg("""
-                Content-Length must be the sum of Text-Content-Length and 
-                Prop-Content-Length.  This is not what was found:
-                Content-Length:      %(clen)d
-                Text-Content-Length: %(tlen)d
-                Prop-Content-Length: %(plen)d
-                """ % locals())
+            if self.check_lengths and tlen != clen - plen:
+                raise ParseError(msg("""
+                    Content-Length must be the sum of Text-Content-Length and 
+                    Prop-Content-Length.  This is not what was found:
+                    Content-Length:      %(clen)d
+                    Text-Content-Length: %(tlen)d
+                    Prop-Content-Length: %(plen)d
+                    """ % locals()))
         else:
             tlen = clen - plen
+        return dump_props, plen, tlen
 
-        yield dump_props
-
-        if plen > 0 or tlen > 0:
-            yield self.parseBlankLine()
-
-        if plen > 0:
-            yield self.parseUserProperties(plen, prop_delta)
-
-        if tlen > 0:
-            text = self.getBytes(tlen)
-            assert len(text) == tlen, msg("""
-                Expected text to have length %d, instead it had length %d.
-                """ % (tlen, len(text)))
-
-            # We can only verify the checksum when text_deltas are not
-            # in use.  When text_deltas are being used, the checksum
-            # refers to the *result* of applying the deltas and we
-            # have no idea how nor desire to do that here.
-            if not text_delta:
-                expected_chksum = dump_props.get("Text-content-md5")
-                if expected_chksum:
-                    computed_chksum = md5(text).hexdigest()
-                    assert expected_chksum == computed_chksum, msg("""
-                           MD5 mismatch.
-                           expected: %s,
-                           computed: %s.
-                           """ % (expected_chksum, computed_chksum))
+    def parseTextContent(self, dump_props, tlen):
+        """
+        Parse the tlen bytes of text content of the node dump_props,
+        and the newline terminating them.
+        """
+        text = TextContent(self.getBytes(tlen))
 
-            yield TextContent(text)
-            # TextContent is always terminated by an 'extra' newline,
-            # which getBytes consumes for us, but does not return.
-            yield BlankLine()
+        # We can only verify the checksum when text_deltas are not in
+        # use.  When text_deltas are being used, the checksum refers
+        # to the *result* of applying the deltas and we have no idea
+        # how nor desire to do that here.  (See revisionist.deltas for
+        # that.)
+        if dump_props.get("Text-delta") != "true":
+            self.verifyChecksums(dump_props, text)
+        return text
 
-        for evt in self.parseBlankLines():
-            yield evt
 
-        yield EndNode()
+    def verifyChecksums(self, dump_props, text):
+        """
+        Verify the TextContent text against Text-content-md5 and, when
+        paranoid, Text-content-sha1 of dump_props.  Remember the md5
+        in text so that the writer need not compute it again.
+        """
+        if self.check_md5:
+            expected_chksum = dump_props.get("Text-content-md5")
+            if expected_chksum:
+                computed_chksum = md5(text).hexdigest()
+                if expected_chksum != computed_chksum:
+                    raise ParseError(msg("""
+                           MD5 mismatch.
+                           expected: %s,
+                           computed: %s.
+                           """ % (expected_chksum, computed_chksum)))
+                text.computed_md5 = computed_chksum
+        if self.check_sha1:
+            expected_chksum = dump_props.get("Text-content-sha1")
+            if expected_chksum:
+                computed_chksum = sha(text).hexdigest()
+                if expected_chksum != computed_chksum:
+                    raise ParseError(msg("""
+                           SHA1 mismatch.
+                           expected: %s,
+                           computed: %s.
+                           """ % (expected_chksum, computed_chksum)))
 
 
 class Reader(object):
@@ -649,8 +1016,14 @@ class Reader(object):
 
     linenr
         The number (1-based) of the line of text in cur.
+
+    follow
+        None, or a function to call when fileLike has run out of input,
+        with the number of times it has been called since input last
+        arrived.  It waits for more input and returns True, or returns
+        False if the input has ended after all.  See Follow.
     """
-    def __init__(self, fileLike):
+    def __init__(self, fileLike, follow=None):
         """
         Initialize a new LineReader.
 
@@ -659,6 +1032,7 @@ class Reader(object):
           been consumed.
         """
         self.fileLike = fileLike
+        self.follow = follow
         self.cur = None
         self.start = 0
         self.stop = 0
@@ -671,17 +1045,133 @@ class Reader(object):
         cur.  Other properties are updated accordingly.  The first
         call to next(), following the last line will set eof to True.
         """
-        try:
-            self.cur = self.fileLike.next()
+        # readline() rather than iteration: iteration reads ahead,
+        # which would make it impossible to mix lines with the raw
+        # reads done by iterBytes().
+        line = self.fileLike.readline()
+        if self.follow != None and not line.endswith("\n"):
+            line = self.followLine(line)
+        if line:
+            self.cur = line
             self.linenr += 1
             self.start, self.stop = self.stop, self.stop+len(self.cur)
-        except StopIteration:
+        else:
             self.cur = ""
             self.eof = True
             self.start, self.stop = self.stop, self.stop
             self.fileLike.close()
         return self.cur
 
+    def iterBytes(self, n, chunk_size=65536):
+        """
+        Generate the next n bytes of input as a series of chunks,
+        starting with and including cur.  The bytes are read from
+        fileLike directly, without splitting them into lines.
+
+        Once the generator has been exhausted, cur holds what remains
+        of the line in which the n bytes ended, or the line following
+        them if they ended with a line feed.  Fewer than n bytes are
+        generated if the input ends prematurely.
+        """
+        start = self.start
+        if n < len(self.cur):
+            chunk, self.cur = self.cur[:n], self.cur[n:]
+            self.start = start + n
+            yield chunk
+            return
+        remaining = n - len(self.cur)
+        if self.cur:
+            yield self.cur
+        waits = 0
+        while remaining > 0:
+            chunk = self.fileLike.read(min(remaining, chunk_size))
+            if not chunk:
+                if self.follow != None and self.waitForInput(waits):
+                    waits += 1
+                    continue
+                break
+            waits = 0
+            remaining -= len(chunk)
+            self.linenr += chunk.count("\n")
+            yield chunk
+        self.stop = start + n - remaining
+        self.next()
+
+    def readBytes(self, n):
+        """
+        Returns the next n bytes of input as a single string.  See
+        iterBytes().
+        """
+        return "".join(self.iterBytes(n))
+
+    def copyBytes(self, n, dstFile):
+        """
+        Copy the next n bytes of input to dstFile, without ever
+        holding more than one chunk of them in memory.  Returns the
+        number of bytes actually copied.  See iterBytes().
+        """
+        copied = 0
+        for chunk in self.iterBytes(n):
+            dstFile.write(chunk)
+            copied += len(chunk)
+        return copied
+
+    def skipBytes(self, n):
+        """
+        Skip the next n bytes of input, returning the number of bytes
+        actually skipped.  See iterBytes().
+
+        When fileLike can seek, the bytes following cur are skipped
+        without reading them.  linenr then no longer counts the lines
+        among them.
+        """
+        remaining = n - len(self.cur)
+        try:
+            here = self.fileLike.tell()
+        except (AttributeError, IOError):
+            here = None
+        if remaining <= 0 or here == None or self.follow != None:
+            skipped = 0
+            for chunk in self.iterBytes(n):
+                skipped += len(chunk)
+            return skipped
+        self.fileLike.seek(0, 2)
+        end = min(here + remaining, self.fileLike.tell())
+        self.fileLike.seek(end)
+        skipped = n - (here + remaining - end)
+        self.stop = self.start + skipped
+        self.next()
+        return skipped
+
+    def followLine(self, line):
+        """
+        Returns line, which lacks its line feed, completed by the input
+        which follow() waited for.
+        """
+        waits = 0
+        while not line.endswith("\n") and self.waitForInput(waits):
+            more = self.fileLike.readline()
+            if more:
+                line += more
+                waits = 0
+            else:
+                waits += 1
+        return line
+
+    def waitForInput(self, waits):
+        """
+        Wait for fileLike to grow, using follow.  Returns False if it
+        won't.
+        """
+        if not self.follow(waits):
+            return False
+        try:
+            # Some platforms won't read past an end of file once seen.
+            self.fileLike.seek(0, 1)
+        except (AttributeError, IOError):
+            pass
+        return True
+
     def close(self):
         """
         Close the underlying fileLike
@@ -703,3 +1193,31 @@ class Reader(object):
                    self.start, self.stop, self.linenr, self.eof))
 
 
+class Follow(object):
+    """
+    A follow function for pull() and Reader, which waits for more
+    input by sleeping, as tail -f does.
+
+    poll
+        Seconds to sleep before looking for more input again.
+
+    timeout
+        Seconds without new input after which the input is taken to
+        have ended, or None to wait for ever.
+
+    on_wait
+        None, or a function to call before each wait, e.g. to flush
+        the output written so far.
+    """
+    def __init__(self, poll=1.0, timeout=None, on_wait=None):
+        self.poll = poll
+        self.timeout = timeout
+        self.on_wait = on_wait
+
+    def __call__(self, waits):
+        if self.timeout != None and waits * self.poll >= self.timeout:
+            return False
+        if self.on_wait != None:
+            self.on_wait()
+        time.sleep(self.poll)
+        return True
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.paths: move the paths of a dumpfile to new places
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+"""
+
+from util import crop_text_block as msg
+from validation import DumpfileError
+from parser import BeginNode, EndNode, UserProperties
+from dispatch import EventHandler, handle_events
+from editors import edit_properties
+
+# The length of an empty property block: "PROPS-END\n".
+EMPTY_PROPS_LENGTH = 10
+
+# Key under which a PathTrie node stores its value.  Path components
+# are strings, so they can't collide with it.
+VALUE = None
+
+
+def remap_paths(events, mapping, mergeinfo=False, memo_size=0,
+                memo=None):
+    """
+    Move paths as parse events pass through.  mapping maps old path
+    prefixes to new ones, either as a dictionary or as a sequence of
+    (old, new) pairs.  Node-path and Node-copyfrom-path are rewritten
+    according to the longest old prefix they start with.  Prefixes
+    match whole path components: trunk/foo matches trunk/foo/bar, but
+    not trunk/foobar.
+
+    If mergeinfo is True, the paths in svn:mergeinfo properties are
+    remapped too, and property lengths recomputed as needed.  See
+    edit_properties() for memo_size and memo.
+
+    A prefix may be moved to the root, given as "" or "/".  The add of
+    the directory which was the prefix is then dropped, as the root
+    exists already.  Raises DumpfileError if that add has properties
+    or a copy source, or the prefix is deleted or replaced, as none of
+    these can be done to the root.
+    """
+    remapper = PathRemapper(mapping)
+    if mergeinfo:
+        events = edit_properties(events, remapper.edit, memo_size, memo)
+    else:
+        handler = EventHandler()
+        handler.register(BeginNode, remapper.editNode)
+        events = handle_events(events, handler)
+    return drop_root_adds(events)
+
+
+def drop_root_adds(events):
+    """
+    Drop the nodes which add the root directory, as remapped adds of
+    a prefix moved to the root do.
+    """
+    dropping = False
+    for evt in events:
+        if type(evt) == BeginNode:
+            dropping = (evt["Node-path"] == ""
+                        and evt["Node-action"] == "add")
+        if not dropping:
+            yield evt
+        elif type(evt) == EndNode:
+            dropping = False
+
+
+class PathTrie(object):
+    """
+    Maps path prefixes to values.  Each node of the trie is a
+    dictionary mapping path components to child nodes.  A node for
+    which a value has been added holds it under the key VALUE.
+    """
+
+    def __init__(self, mapping=()):
+        self.root = {}
+        if hasattr(mapping, "items"):
+            mapping = mapping.items()
+        for prefix, value in mapping:
+            self.add(prefix, value)
+
+    def add(self, prefix, value):
+        node = self.root
+        prefix = prefix.strip("/")
+        if prefix:
+            for name in prefix.split("/"):
+                node = node.setdefault(name, {})
+        node[VALUE] = value
+
+    def longestPrefix(self, path):
+        """
+        Returns a tuple (end, value) where path[:end] is the longest
+        prefix of path which has a value.  end is None if there is no
+        such prefix.
+        """
+        node = self.root
+        end = None
+        if VALUE in node:
+            end, value = 0, node[VALUE]
+        pos = 0
+        while True:
+            stop = path.find("/", pos)
+            if stop < 0:
+                stop = len(path)
+            node = node.get(path[pos:stop])
+            if node == None:
+                break
+            if VALUE in node:
+                end, value = stop, node[VALUE]
+            if stop == len(path):
+                break
+            pos = stop + 1
+        if end == None:
+            return None, None
+        return end, value
+
+
+class PathRemapper(object):
+    """
+    Rewrites paths according to a PathTrie of old prefixes to new
+    prefixes.  edit() is suitable for edit_properties() and
+    edit_record_properties().  A plain add of a prefix moved to the
+    root becomes an add of the root, which is left for the caller to
+    drop (see drop_root_adds).
+    """
+
+    def __init__(self, mapping):
+        trie = PathTrie()
+        if hasattr(mapping, "items"):
+            mapping = mapping.items()
+        for old, new in mapping:
+            trie.add(old, new.strip("/"))
+        self.trie = trie
+
+    def remap(self, path):
+        """
+        Returns path, given without leading slash, moved to its new
+        place.
+        """
+        end, new = self.trie.longestPrefix(path)
+        if end == None:
+            return path
+        rest = path[end:]
+        if end == 0 and rest:
+            rest = "/" + rest
+        if not new:
+            return rest[1:]
+        return new + rest
+
+    def edit(self, props):
+        if type(props) == BeginNode:
+            self.editNode(props)
+        elif type(props) == UserProperties:
+            self.editMergeinfo(props)
+
+    def editNode(self, node):
+        path = node["Node-path"]
+        node["Node-path"] = self.remap(path)
+        if node["Node-path"] == "" and path != "":
+            self.checkRootNode(node, path)
+        copyfrom_path = node.get("Node-copyfrom-path")
+        if copyfrom_path != None:
+            node["Node-copyfrom-path"] = self.remap(copyfrom_path)
+
+    def checkRootNode(self, node, path):
+        """
+        Raise DumpfileError unless node, which acts on path, moved to
+        the root, is a change, or an add which can be dropped.
+        """
+        action = node["Node-action"]
+        if action == "change":
+            return
+        if (action == "add" and node.get("Node-kind") == "dir"
+            and "Node-copyfrom-path" not in node
+            and int(node.get("Prop-content-length", 0))
+                <= EMPTY_PROPS_LENGTH):
+            return
+        raise DumpfileError(msg("""
+            %s is moved to the root, but its node (Node-action: %s)
+            can't act on the root: only plain adds of a directory
+            without properties are dropped, and changes kept.
+            """ % (path, action)))
+
+    def editMergeinfo(self, props):
+        """
+        Remap the paths in svn:mergeinfo, which has a line of the form
+        /path:revision-ranges per merge source.
+        """
+        mergeinfo = props.get("svn:mergeinfo")
+        if not mergeinfo:
+            return
+        lines = mergeinfo.split("\n")
+        for i, line in enumerate(lines):
+            colon = line.rfind(":")
+            if colon > 0:
+                path = line[:colon].lstrip("/")
+                lines[i] = "/" + self.remap(path) + line[colon:]
+        props["svn:mergeinfo"] = "\n".join(lines)
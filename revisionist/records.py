@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.records: whole revisions and nodes instead of parse events
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+A node is reported by the parser as about six parse events, each of
+which passes through every stage of a pipeline.  The records of this
+module bundle these up: one DumpfileRecord for the dumpfile header,
+one RevisionRecord per revision header and one NodeRecord per node.
+edit_revisions bundles these up further, into one Revision per
+revision.
+"""
+
+import tempfile
+from util import crop_text_block as msg
+from validation import DumpfileError, STANDARD
+from parser import Parser, BeginDumpfile, EndDumpfile, \
+     BeginRevision, EndRevisionHeader, EndRevisionNodes, \
+     BeginNode, EndNode, UserProperties, TextContent, BlankLine
+from writer import DumpfileWriter
+
+
+def pull_records(fileLike, validation=STANDARD):
+    """
+    Parse the SVN Dumpfile in the open file fileLike.
+
+    This is a generator.  It yields a DumpfileRecord followed by a
+    RevisionRecord for each revision, which is in turn followed by a
+    NodeRecord for each of its nodes.  See pull() for validation.
+    """
+    return RecordParser(validation).parse(fileLike)
+
+
+class DumpfileRecord(object):
+    """
+    The header of a dumpfile.
+
+    header
+        The BeginDumpfile giving version and uuid.
+
+    blank_lines
+        The number of blank lines following the header.
+    """
+    __slots__ = ("header", "blank_lines")
+
+    def __init__(self, header, blank_lines=0):
+        self.header = header
+        self.blank_lines = blank_lines
+
+    def __str__(self):
+        return str(self.header) + "\n" * self.blank_lines
+
+    def __repr__(self):
+        return "DumpfileRecord(%r, %d)" % (self.header, self.blank_lines)
+
+    def events(self):
+        """
+        Generate the parse events this record stands for.
+        """
+        yield self.header
+        for i in xrange(self.blank_lines):
+            yield BlankLine()
+
+
+class RevisionRecord(object):
+    """
+    The header of a revision: everything up to its first node.
+
+    dump_props
+        The BeginRevision.
+
+    props
+        The UserProperties, or None.
+
+    blank_lines
+        A list [before, after] of the numbers of blank lines before
+        and after the user properties.  Without user properties, all
+        blank lines count as before.
+
+    offset
+        The byte offset of the record in the dumpfile it was parsed
+        from, or None.
+    """
+    __slots__ = ("dump_props", "props", "blank_lines", "offset")
+
+    end_event = EndRevisionHeader
+    text = None
+
+    def __init__(self, dump_props, props=None, blank_lines=None):
+        self.dump_props = dump_props
+        self.props = props
+        self.blank_lines = blank_lines or [0, 0]
+        self.offset = None
+
+    def __str__(self):
+        before, after = self.blank_lines
+        parts = [str(self.dump_props), "\n" * before]
+        if self.props != None:
+            parts.append(str(self.props))
+        if self.text != None:
+            parts.append(self.text)
+        parts.append("\n" * after)
+        return "".join(parts)
+
+    def __repr__(self):
+        return "RevisionRecord(%r, %r, %r)" % (
+            self.dump_props, self.props, self.blank_lines)
+
+    def textLength(self):
+        return 0
+
+    def propsOffset(self):
+        """
+        The byte offset of the user properties in the dumpfile the
+        record was parsed from.  Text content follows them.
+        """
+        return (self.offset + len(str(self.dump_props))
+                + self.blank_lines[0])
+
+    def updateLengths(self):
+        """
+        Recompute Prop-content-length and Content-length from the user
+        properties, which may have been changed.
+        """
+        if self.props == None:
+            return
+        plen = len(str(self.props))
+        self.dump_props["Prop-content-length"] = plen
+        self.dump_props["Content-length"] = plen + self.textLength()
+
+    def events(self):
+        """
+        Generate the parse events this record stands for.
+        """
+        before, after = self.blank_lines
+        yield self.dump_props
+        for i in xrange(before):
+            yield BlankLine()
+        if self.props != None:
+            yield self.props
+        if self.text != None:
+            yield self.text
+        for i in xrange(after):
+            yield BlankLine()
+        yield self.end_event()
+
+    def check(self, writer):
+        """
+        Have the DumpfileWriter writer check this record as it would
+        the events it stands for.
+        """
+        writer.onBeginRevision(self.dump_props)
+        if self.props != None:
+            writer.onUserProperties(self.props)
+        writer.onEndRevisionHeader(None)
+
+
+class NodeRecord(RevisionRecord):
+    """
+    A node.
+
+    dump_props
+        The BeginNode.
+
+    props
+        The UserProperties, or None.
+
+    text
+        The TextContent, or None.
+
+    blank_lines
+        A list [before, after] of the numbers of blank lines before
+        the user properties or text and after them.  after includes
+        the newline which always follows text.  Without user
+        properties or text, all blank lines count as before.
+    """
+    __slots__ = ("text",)
+
+    end_event = EndNode
+
+    def __init__(self, dump_props, props=None, text=None, blank_lines=None):
+        RevisionRecord.__init__(self, dump_props, props, blank_lines)
+        self.text = text
+
+    def __repr__(self):
+        return "NodeRecord(%r, %r, %r, %r)" % (
+            self.dump_props, self.props, self.text, self.blank_lines)
+
+    def textLength(self):
+        return int(self.dump_props.get("Text-content-length", 0))
+
+    def check(self, writer):
+        writer.onBeginNode(self.dump_props)
+        if self.props != None:
+            writer.onUserProperties(self.props)
+        if self.text != None:
+            writer.onTextContent(self.text)
+        writer.onEndNode(None)
+
+
+def write_records_to_dumpfile(records, dstFile, validation=STANDARD):
+    """
+    Consume a series of records while writing them to dstFile as a
+    SVN Dumpfile.  Each record is checked just as
+    write_events_to_dumpfile() checks the parse events it stands for,
+    and written with a single call to dstFile.write().
+    """
+    writer = DumpfileWriter(dstFile, validation)
+    try:
+        for record in records:
+            if type(record) == DumpfileRecord:
+                writer.onBeginDumpfile(record.header)
+            else:
+                record.check(writer)
+            dstFile.write(str(record))
+    finally:
+        dstFile.close()
+
+
+def edit_record_properties(records, edit):
+    """
+    The record equivalent of edit_properties().  Invokes the function
+    edit on the dump properties and the user properties of each
+    revision and node, then recomputes Prop-content-length and
+    Content-length.
+    """
+    for record in records:
+        if type(record) != DumpfileRecord:
+            edit(record.dump_props)
+            if record.props != None:
+                edit(record.props)
+                record.updateLengths()
+        yield record
+
+
+def records_to_events(records):
+    """
+    Generate the parse events the records stand for, as pull() would
+    have reported them.
+    """
+    in_revision = False
+    header = None
+    for record in records:
+        if type(record) == DumpfileRecord:
+            header = record
+        elif type(record) == RevisionRecord:
+            if in_revision:
+                yield EndRevisionNodes()
+            in_revision = True
+        for evt in record.events():
+            yield evt
+    if in_revision:
+        yield EndRevisionNodes()
+    if header != None:
+        yield EndDumpfile()
+
+
+def events_to_records(events):
+    """
+    Group a stream of parse events into records.
+
+    Blank lines following EndRevisionNodes, which pull() never
+    reports, are added to those after the preceding record.
+    """
+    record = None
+    for evt in events:
+        cls = type(evt)
+        if cls == BlankLine:
+            if type(record) == DumpfileRecord:
+                record.blank_lines += 1
+            elif record.props == None and record.text == None:
+                record.blank_lines[0] += 1
+            else:
+                record.blank_lines[1] += 1
+        elif cls == UserProperties:
+            record.props = evt
+        elif cls == TextContent:
+            record.text = evt
+        elif cls == BeginNode:
+            record = NodeRecord(evt)
+        elif cls == BeginRevision:
+            if type(record) == DumpfileRecord:
+                yield record
+            record = RevisionRecord(evt)
+        elif cls == BeginDumpfile:
+            record = DumpfileRecord(evt)
+        elif cls == EndNode or cls == EndRevisionHeader:
+            yield record
+        elif cls == EndRevisionNodes:
+            pass
+        elif cls == EndDumpfile:
+            if type(record) == DumpfileRecord:
+                yield record
+        else:
+            raise DumpfileError(msg("""
+                Expected a parse event, but found %r""" % (evt,)))
+
+
+def edit_revisions(events, edit, max_size=64*1024*1024):
+    """
+    Collect the parse events of each revision into a Revision, and
+    invoke the function edit on it, for edits which need the whole
+    revision at once: removing duplicate nodes, putting deletes before
+    adds, leaving out revisions for what they contain.
+
+    edit may change the records of the revision, and add, remove or
+    reorder its nodes.  Whoever changes user properties must call
+    updateLengths() on their record.  If edit returns False, the
+    revision is left out.  Generates the parse events of the
+    revisions as edited.
+
+    At most max_size bytes of the texts of a revision are kept in
+    memory.  Those beyond are spilled to a temporary file, so that a
+    revision importing thousands of files doesn't need all of them in
+    memory at once.  See Revision.
+    """
+    revision = None
+    header = None
+    for record in events_to_records(events):
+        cls = type(record)
+        if cls == NodeRecord:
+            revision.add(record)
+            continue
+        if revision != None:
+            for evt in revision.edited(edit):
+                yield evt
+        if cls == DumpfileRecord:
+            header = record
+            for evt in record.events():
+                yield evt
+        else:
+            revision = Revision(record, max_size)
+    if revision != None:
+        for evt in revision.edited(edit):
+            yield evt
+    if header != None:
+        yield EndDumpfile()
+
+
+class Revision(object):
+    """
+    A whole revision: its header and its nodes.
+
+    header
+        The RevisionRecord.
+
+    nodes
+        The list of NodeRecords.
+
+    max_size, size
+        The number of bytes of text which may be kept in memory, and
+        the number which are.  The text of a node which would make
+        size exceed max_size is spilled to a temporary file instead,
+        leaving a SpilledText in its place as the node's text.  Use
+        text() to get at it.
+
+    spilled
+        The number of texts spilled.
+    """
+
+    def __init__(self, header, max_size=64*1024*1024):
+        self.header = header
+        self.nodes = []
+        self.max_size = max_size
+        self.size = 0
+        self.spilled = 0
+        self.spill_file = None
+
+    def number(self):
+        return int(self.header.dump_props["Revision-number"])
+
+    def add(self, node):
+        """
+        Append the NodeRecord node, spilling its text if need be.
+        """
+        text = node.text
+        if text != None:
+            if self.size + len(text) <= self.max_size:
+                self.size += len(text)
+            else:
+                node.text = self.spill(text)
+        self.nodes.append(node)
+
+    def spill(self, text):
+        if self.spill_file == None:
+            self.spill_file = tempfile.TemporaryFile(prefix="revisionist-")
+        f = self.spill_file
+        f.seek(0, 2)
+        spilled = SpilledText(f, f.tell(), len(text), text.computed_md5)
+        f.write(text)
+        self.spilled += 1
+        return spilled
+
+    def text(self, node):
+        """
+        Returns the text of node as TextContent, reading it back if it
+        was spilled, or None if it has none.
+        """
+        if type(node.text) == SpilledText:
+            return node.text.read()
+        return node.text
+
+    def events(self):
+        """
+        Generate the parse events of the revision, reading back the
+        spilled texts one at a time.
+        """
+        for evt in self.header.events():
+            yield evt
+        for node in self.nodes:
+            for evt in node.events():
+                if type(evt) == SpilledText:
+                    evt = evt.read()
+                yield evt
+        yield EndRevisionNodes()
+
+    def edited(self, edit):
+        """
+        Invoke edit on the revision and generate its parse events, or
+        none if edit returns False.  Removes the spill file in the end.
+        """
+        try:
+            if edit(self) != False:
+                for evt in self.events():
+                    yield evt
+        finally:
+            self.close()
+
+    def close(self):
+        if self.spill_file != None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+class SpilledText(object):
+    """
+    Stands in for the text of a node spilled to the file spillFile,
+    where it is the length bytes at offset.
+    """
+    __slots__ = ("spillFile", "offset", "length", "computed_md5")
+
+    def __init__(self, spillFile, offset, length, computed_md5=None):
+        self.spillFile = spillFile
+        self.offset = offset
+        self.length = length
+        self.computed_md5 = computed_md5
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "SpilledText(%d, %d)" % (self.offset, self.length)
+
+    def read(self):
+        self.spillFile.seek(self.offset)
+        text = TextContent(self.spillFile.read(self.length))
+        if len(text) != self.length:
+            raise DumpfileError("A spilled text was cut short.")
+        text.computed_md5 = self.computed_md5
+        return text
+
+
+class RecordParser(Parser):
+    """
+    A Parser generating records rather than parse events.  Each
+    record is parsed in one go, without nested generators.
+    """
+
+    def parseDumpfile(self, fileLike):
+        try:
+            self.startParsing(fileLike)
+            header = self.parseDumpfileHeader()
+            yield DumpfileRecord(header, self.countBlankLines())
+            while self.matchRevision():
+                yield self.parseRevisionRecord()
+                while self.matchNode():
+                    yield self.parseNodeRecord()
+                # Blank lines between revisions are only possible
+                # after a node (or a revision without nodes), which
+                # has already counted them.
+        except DumpfileError, e :
+            self.reportError()
+            raise
+        self.finishParsing()
+
+    def parseRevisionRecord(self):
+        offset = self.reader.start
+        dump_props, plen = self.parseRevisionHeader()
+        record = RevisionRecord(dump_props)
+        record.offset = offset
+        if self.matchBlankLine():
+            self.parseBlankLine()
+            record.blank_lines[0] = 1
+        if self.matchUserProperties():
+            record.props = self.parseUserProperties(plen)
+            record.blank_lines[1] = self.countBlankLines()
+        else:
+            record.blank_lines[0] += self.countBlankLines()
+        return record
+
+    def parseNodeRecord(self):
+        offset = self.reader.start
+        dump_props, plen, tlen = self.parseNodeHeader()
+        record = NodeRecord(dump_props)
+        record.offset = offset
+        if plen > 0 or tlen > 0:
+            self.parseBlankLine()
+            record.blank_lines[0] = 1
+            if plen > 0:
+                record.props = self.parseUserProperties(
+                    plen, dump_props.get("Prop-delta") == "true")
+            if tlen > 0:
+                record.text = self.parseTextContent(dump_props, tlen)
+                record.blank_lines[1] = 1
+            record.blank_lines[1] += self.countBlankLines()
+        else:
+            record.blank_lines[0] = self.countBlankLines()
+        return record
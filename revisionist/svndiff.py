@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.svndiff: encode and decode Subversion's svndiff delta format
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+Versions 0, 1 (zlib) and 2 (lz4) of svndiff are understood.  Version 2
+requires the lz4 package, which is only imported when such a delta is
+actually encountered.  Versions 0 and 1 can be written.
+"""
+
+import zlib
+from util import crop_text_block as msg
+from validation import DumpfileError
+
+# Subversion refuses windows with larger source or target views.
+WINDOW_SIZE = 102400
+
+# Length of the blocks by which matches between source and target are
+# found. Shorter matches are not worth an instruction.
+BLOCK_SIZE = 16
+
+
+def apply_svndiff(delta, source):
+    """
+    Apply the svndiff delta (a string, starting with 'SVN') to the
+    string source, returning the resulting target string.
+    """
+    if delta[:3] != "SVN" or len(delta) < 4:
+        raise DumpfileError(msg("""
+            Expected an svndiff, which starts with 'SVN' followed by a
+            version byte. Found: %r""" % (delta[:4],)))
+    version = ord(delta[3])
+    if not 0 <= version <= 2:
+        raise DumpfileError(msg("""
+            Only svndiff versions 0, 1 and 2 are supported. Found
+            version %d.""" % (version,)))
+    target = []
+    pos = 4
+    while pos < len(delta):
+        sview_offset, pos = decode_int(delta, pos)
+        sview_len, pos = decode_int(delta, pos)
+        tview_len, pos = decode_int(delta, pos)
+        ins_len, pos = decode_int(delta, pos)
+        new_len, pos = decode_int(delta, pos)
+        if pos + ins_len + new_len > len(delta):
+            raise DumpfileError(msg("""
+                svndiff window extends past the end of the delta."""))
+        ins = delta[pos:pos+ins_len]
+        pos += ins_len
+        new = delta[pos:pos+new_len]
+        pos += new_len
+        if version > 0:
+            ins = decompress(ins, version)
+            new = decompress(new, version)
+        if sview_offset + sview_len > len(source):
+            raise DumpfileError(msg("""
+                svndiff source view [%d, %d) lies outside of the source,
+                which has only %d bytes.""" % (
+                    sview_offset, sview_offset + sview_len, len(source))))
+        sview = source[sview_offset:sview_offset+sview_len]
+        target.append(apply_window(sview, ins, new, tview_len))
+    return "".join(target)
+
+
+def apply_window(sview, ins, new, tview_len):
+    """
+    Execute the instructions ins of a single svndiff window, returning
+    the target view.
+
+    There are three kinds of instruction: copy from the source view,
+    copy from the target view produced so far (the two ranges may
+    overlap, which repeats a pattern) and copy from new data.
+    """
+    tview = bytearray()
+    npos = 0
+    pos = 0
+    while pos < len(ins):
+        c = ord(ins[pos])
+        pos += 1
+        action, length = c >> 6, c & 0x3f
+        if length == 0:
+            length, pos = decode_int(ins, pos)
+        if action == 0:
+            offset, pos = decode_int(ins, pos)
+            if offset + length > len(sview):
+                raise DumpfileError(
+                    "svndiff source copy extends past end of source view.")
+            tview += sview[offset:offset+length]
+        elif action == 1:
+            offset, pos = decode_int(ins, pos)
+            if offset >= len(tview):
+                raise DumpfileError(
+                    "svndiff target copy starts past end of target view.")
+            while length > 0:
+                piece = tview[offset:offset+length]
+                tview += piece
+                offset += len(piece)
+                length -= len(piece)
+        elif action == 2:
+            if npos + length > len(new):
+                raise DumpfileError(
+                    "svndiff new data copy extends past end of new data.")
+            tview += new[npos:npos+length]
+            npos += length
+        else:
+            raise DumpfileError("Invalid svndiff instruction %d." % (action,))
+    if len(tview) != tview_len:
+        raise DumpfileError(msg("""
+            svndiff window produced %d bytes, but should have produced
+            %d bytes.""" % (len(tview), tview_len)))
+    return str(tview)
+
+
+def decompress(data, version):
+    """
+    Decompress an instruction or new data section of an svndiff
+    version 1 or 2 window.  The section starts with its uncompressed
+    length.  If the remainder is just as long, it was stored as is.
+    """
+    length, pos = decode_int(data, 0)
+    data = data[pos:]
+    if len(data) == length:
+        return data
+    if version == 1:
+        result = zlib.decompress(data)
+    else:
+        import lz4.block
+        result = lz4.block.decompress(data, uncompressed_size=length)
+    if len(result) != length:
+        raise DumpfileError(msg("""
+            svndiff section decompressed to %d bytes, but should have
+            decompressed to %d bytes.""" % (len(result), length)))
+    return result
+
+
+def decode_int(data, pos):
+    """
+    Decode the variable length integer starting at data[pos].  Returns
+    a tuple (value, position following the integer).
+
+    Integers are stored big-endian, seven bits to the byte.  All but
+    the last byte have their high bit set.
+    """
+    value = 0
+    while True:
+        if pos >= len(data):
+            raise DumpfileError("svndiff integer runs past end of data.")
+        c = ord(data[pos])
+        pos += 1
+        value = (value << 7) | (c & 0x7f)
+        if c < 0x80:
+            return value, pos
+
+
+def make_svndiff(source, target, version=0):
+    """
+    Returns an svndiff delta which turns the string source into the
+    string target.
+
+    The target is cut into windows of WINDOW_SIZE bytes.  Each is
+    expressed in terms of the window of the source at the same offset
+    and of itself.  For version 1, the sections of each window are
+    compressed with zlib when that makes them smaller.
+    """
+    if not 0 <= version <= 1:
+        raise DumpfileError("Only svndiff versions 0 and 1 can be written.")
+    out = ["SVN", chr(version)]
+    for offset in xrange(0, len(target), WINDOW_SIZE):
+        sview = source[offset:offset+WINDOW_SIZE]
+        tview = target[offset:offset+WINDOW_SIZE]
+        ins, new = diff_window(sview, tview)
+        if version > 0:
+            ins = compress(ins)
+            new = compress(new)
+        out.append(encode_int(sview and offset or 0))
+        out.append(encode_int(len(sview)))
+        out.append(encode_int(len(tview)))
+        out.append(encode_int(len(ins)))
+        out.append(encode_int(len(new)))
+        out.append(ins)
+        out.append(new)
+    return "".join(out)
+
+
+def diff_window(sview, tview):
+    """
+    Returns the instructions and new data, both strings, of a window
+    turning sview into tview.
+
+    Blocks of BLOCK_SIZE bytes at every BLOCK_SIZE-th offset of sview
+    are indexed.  tview is scanned for occurrences of these blocks.
+    Each hit is extended backward and forward as far as source and
+    target agree and becomes a copy from the source view.  Whatever
+    lies between the copies becomes new data.
+    """
+    ins, new = [], []
+    if sview == tview:
+        if tview:
+            ins.append(encode_instruction(0, len(tview), 0))
+        return "".join(ins), ""
+    index = {}
+    for s in xrange(len(sview) - BLOCK_SIZE, -1, -BLOCK_SIZE):
+        index[sview[s:s+BLOCK_SIZE]] = s
+    pending = 0   # start of tview not yet covered by instructions
+    t = 0
+    limit = len(tview) - BLOCK_SIZE
+    while t <= limit:
+        s = index.get(tview[t:t+BLOCK_SIZE])
+        if s == None:
+            t += 1
+            continue
+        start, s_start = t, s
+        while (start > pending and s_start > 0
+               and tview[start-1] == sview[s_start-1]):
+            start -= 1
+            s_start -= 1
+        end, s_end = t + BLOCK_SIZE, s + BLOCK_SIZE
+        while (end + 256 <= len(tview) and s_end + 256 <= len(sview)
+               and tview[end:end+256] == sview[s_end:s_end+256]):
+            end += 256
+            s_end += 256
+        while (end < len(tview) and s_end < len(sview)
+               and tview[end] == sview[s_end]):
+            end += 1
+            s_end += 1
+        if start > pending:
+            ins.append(encode_instruction(2, start - pending))
+            new.append(tview[pending:start])
+        ins.append(encode_instruction(0, end - start, s_start))
+        pending = t = end
+    if pending < len(tview):
+        ins.append(encode_instruction(2, len(tview) - pending))
+        new.append(tview[pending:])
+    return "".join(ins), "".join(new)
+
+
+def encode_instruction(action, length, offset=None):
+    """
+    Encode an instruction: 0 (copy from source), 1 (copy from target)
+    or 2 (copy from new data).  Only the first two take an offset.
+    """
+    if length < 0x40:
+        out = chr((action << 6) | length)
+    else:
+        out = chr(action << 6) + encode_int(length)
+    if offset != None:
+        out += encode_int(offset)
+    return out
+
+
+def compress(data):
+    """
+    Compress an instruction or new data section for svndiff version
+    1.  See decompress().
+    """
+    compressed = zlib.compress(data, 5)
+    if len(compressed) < len(data):
+        return encode_int(len(data)) + compressed
+    return encode_int(len(data)) + data
+
+
+def encode_int(value):
+    """
+    Encode value as a variable length integer.  See decode_int().
+    """
+    out = [chr(value & 0x7f)]
+    value >>= 7
+    while value:
+        out.append(chr(0x80 | (value & 0x7f)))
+        value >>= 7
+    out.reverse()
+    return "".join(out)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.tee: feed one stream of parse events to several branches
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+A branch is a function which takes an iterator of parse events and
+returns an iterator, typically a pipeline of stages ending in
+write_events():
+
+    tee_events(pull(src), [
+        readonly(lambda evts: write_events(evts, file("copy", "wb"))),
+        lambda evts: write_events(remap_paths(evts, mapping),
+                                  file("moved", "wb")),
+    ])
+
+Whatever the branches generate is thrown away; they are run for their
+side effects.  A branch may also be a sink, returning None, such as
+write_events_to_dumpfile() -- but see tee_events() on memory use.
+"""
+
+import sys
+import itertools
+import threading
+import Queue
+from parser import BeginDumpfile, BeginRevision, BeginNode, UserProperties
+
+# Marks the end of the events put on a branch's queue.
+END = object()
+
+# The number of events put on a branch's queue at a time, as passing
+# each event on its own costs more than most stages do.
+BATCH_SIZE = 100
+
+
+def readonly(branch):
+    """
+    Marks branch as one which never changes the events it is given,
+    so that it can share them with the other branches instead of
+    getting copies.  Returns branch.
+    """
+    branch.readonly = True
+    return branch
+
+
+def copy_event(evt):
+    """
+    Returns a copy of evt if it's of a kind a branch could change in
+    place, else evt itself.  TextContent is a str and the other
+    events carry no data, so they are shared.  The raw block of
+    UserProperties is shared too, until the copy is changed.
+    """
+    cls = type(evt)
+    if cls == UserProperties:
+        return evt.copy()
+    if cls == BeginNode or cls == BeginRevision:
+        return cls(evt)
+    if cls == BeginDumpfile:
+        return BeginDumpfile(evt.version, evt.uuid)
+    return evt
+
+
+def tee_events(events, branches, threads=False, buffer_size=1000):
+    """
+    Feed events to each of branches, running them until the events
+    are exhausted (or the branch stops asking for more).
+
+    Branches marked readonly() share the events as parsed.  Every other
+    branch gets its own copy of the events it could change, so that
+    what one branch changes is never seen by another.  The events as
+    parsed are left alone, even when no branch is readonly, as the
+    copies of the others may be made after a branch has had them.
+
+    threads
+        If False, the branches are run by turns in this thread, the
+        one which has consumed the fewest events always going next.
+        Events are kept until the slowest branch has consumed them, so
+        a branch which consumes all its events before generating
+        anything (a report, or a sink) keeps all of them in memory.
+        If True, each branch runs in a thread of its own, which is fed
+        through a queue holding at most buffer_size events; events are
+        read only as fast as the slowest branch consumes them.
+
+    An exception raised by a branch is passed on to the caller; when
+    running threads, once all the other branches are done.
+    """
+    branches = list(branches)
+    copying = [not getattr(b, "readonly", False) for b in branches]
+    if threads:
+        run_threaded(events, branches, copying, buffer_size)
+    else:
+        run_lockstep(events, branches, copying)
+
+
+def run_lockstep(events, branches, copying):
+    consumed = [0] * len(branches)
+    outputs = []
+    for i, inputs in enumerate(itertools.tee(events, len(branches))):
+        if copying[i]:
+            inputs = itertools.imap(copy_event, inputs)
+        outputs.append(branches[i](counted(inputs, consumed, i)))
+    active = [i for i in range(len(branches)) if outputs[i] != None]
+    outputs = [output != None and iter(output) for output in outputs]
+    while active:
+        i = min(active, key=consumed.__getitem__)
+        try:
+            outputs[i].next()
+        except StopIteration:
+            # Drop the branch, so that its events aren't kept for it.
+            outputs[i] = None
+            active.remove(i)
+
+
+def counted(events, consumed, i):
+    for evt in events:
+        consumed[i] += 1
+        yield evt
+
+
+def run_threaded(events, branches, copying, buffer_size):
+    queues = [Queue.Queue(max(1, buffer_size // BATCH_SIZE))
+              for b in branches]
+    errors = []
+    workers = [threading.Thread(target=run_branch,
+                                args=(branch, queue, errors))
+               for branch, queue in zip(branches, queues)]
+    for worker in workers:
+        worker.setDaemon(True)
+        worker.start()
+    try:
+        batch = []
+        for evt in events:
+            batch.append(evt)
+            if len(batch) == BATCH_SIZE:
+                put_batch(batch, queues, copying)
+                batch = []
+        put_batch(batch, queues, copying)
+    finally:
+        for queue in queues:
+            queue.put(END)
+        for worker in workers:
+            worker.join()
+    if errors:
+        cls, value, traceback = errors[0]
+        raise cls, value, traceback
+
+
+def put_batch(batch, queues, copying):
+    for queue, copy in zip(queues, copying):
+        if copy:
+            queue.put([copy_event(evt) for evt in batch])
+        else:
+            queue.put(batch)
+
+
+def run_branch(branch, queue, errors):
+    """
+    Run branch on the batches of events put on queue, up to END.
+    Whether the branch finishes early or fails, the queue is drained,
+    so that tee_events is never left waiting on it.
+    """
+    state = {"ended": False}
+    def inputs():
+        while True:
+            batch = queue.get()
+            if batch is END:
+                state["ended"] = True
+                return
+            for evt in batch:
+                yield evt
+    try:
+        for x in branch(inputs()) or ():
+            pass
+    except:
+        errors.append(sys.exc_info())
+    while not state["ended"]:
+        state["ended"] = queue.get() is END
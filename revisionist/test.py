@@ -11,10 +11,37 @@ License
 """
 
 from util import crop_text_block as msg
+from util import odict
 import parser
 import writer
 import editors
+import merge
+import deltas
+import dispatch
+import records
+import catalog
+import paths
+import content
+import verify
+import tee
+import tree
+import binary
+import compare
+import blobs
+import export
+from md5 import md5
+from cache import ContentCache
+from validation import PARANOID, STANDARD, TRUST_INPUT, WriteError, \
+                       TreeError, BlobError, DumpfileError
 import os
+import sys
+import gc
+import copy
+import json
+import pickle
+from StringIO import StringIO
+import tempfile
+import shutil
 
 dumpfiles = ["short.dump2",  "short.dump3"]
 
@@ -41,9 +68,1054 @@ def round_trip_test(dumpFilePath):
 
     os.unlink(outFilePath)
 
+def read_file(filePath):
+    f = file(filePath, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def write_file(filePath, content):
+    f = file(filePath, "wb")
+    try:
+        f.write(content)
+    finally:
+        f.close()
+
+def merge_test(dumpFilePath):
+    original_bytes = read_file(dumpFilePath)
+    header_end = original_bytes.index("Revision-number: 0")
+    split = original_bytes.index("Revision-number: 6")
+    write_file(dumpFilePath + ".1", original_bytes[:split])
+    write_file(dumpFilePath + ".2",
+               original_bytes[:header_end] + original_bytes[split:])
+    merge.merge_dumpfiles([file(dumpFilePath + ".1", "rb"),
+                           file(dumpFilePath + ".2", "rb")],
+                          file(dumpFilePath + ".out", "wb"))
+    assert read_file(dumpFilePath + ".out") == original_bytes
+
+    merge.merge_dumpfiles([file(dumpFilePath, "rb"),
+                           file(dumpFilePath + ".2", "rb")],
+                          file(dumpFilePath + ".out", "wb"),
+                          renumber=True)
+    revs, copyfrom_revs = [], []
+    for evt in parser.pull(file(dumpFilePath + ".out", "rb")):
+        if type(evt) == parser.BeginRevision:
+            revs.append(int(evt["Revision-number"]))
+        elif type(evt) == parser.BeginNode and "Node-copyfrom-rev" in evt:
+            copyfrom_revs.append(int(evt["Node-copyfrom-rev"]))
+    assert revs == range(18), revs
+    assert copyfrom_revs == [3, 1, 3, 1], copyfrom_revs
+
+    for suffix in [".1", ".2", ".out"]:
+        os.unlink(dumpFilePath + suffix)
+
+def delta_test(dumpFilePath):
+    cache = ContentCache(max_size=16)
+    events = deltas.verify_text_deltas(parser.pull(file(dumpFilePath, "rb")),
+                                       cache)
+    editors.consume_events(events)
+    assert cache.spill_dir != None
+    cache.close()
+
+    corrupt = read_file(dumpFilePath).replace(
+        "Text-content-md5: 2d6481f67617bde1872cdeba7cc46864",
+        "Text-content-md5: 00000000000000000000000000000000")
+    write_file(dumpFilePath + ".bad", corrupt)
+    try:
+        events = deltas.verify_text_deltas(
+            parser.pull(file(dumpFilePath + ".bad", "rb")))
+        editors.consume_events(events)
+    except AssertionError, e:
+        assert "MD5 mismatch" in str(e)
+    else:
+        assert False, "corrupt text delta was not detected"
+    os.unlink(dumpFilePath + ".bad")
+
+def make_deltas_test(dumpFilePath):
+    outFilePath = dumpFilePath + ".out"
+    writer.write_events_to_dumpfile(parser.pull(file(dumpFilePath, "rb")),
+                                    file(outFilePath, "wb"), deltas=True)
+    events = deltas.verify_text_deltas(parser.pull(file(outFilePath, "rb")))
+    texts = []
+    for evt in events:
+        if type(evt) == parser.BeginDumpfile:
+            assert evt.version == 3
+        elif (type(evt) == parser.BeginNode
+              and int(evt.get("Text-content-length", 0)) > 0):
+            assert evt["Text-delta"] == "true"
+            texts.append(evt.get("Text-delta-base-md5"))
+    assert len(texts) == 4 and texts.count(None) == 3, texts
+    os.unlink(outFilePath)
+
+def expect_parse_error(text, message):
+    try:
+        editors.consume_events(parser.pull(StringIO(text)))
+    except AssertionError, e:
+        assert message in str(e), str(e)
+    else:
+        assert False, "expected parse error: " + message
+
+def property_block_test():
+    header = "SVN-fs-dump-format-version: 2\n\n"
+    revision = ("Revision-number: 0\n"
+                "Prop-content-length: %d\n"
+                "Content-length: %d\n\n"
+                "K 8\nsvn:date\nV 4\n2007\n%s"
+                "PROPS-END\n\n")
+    good = header + revision % (32, 32, "")
+    events = list(parser.pull(StringIO(good)))
+    assert events[3] == {"svn:date": "2007"}, events
+    expect_parse_error(header + revision % (40, 40, ""),
+                       "Expected 40 bytes, but found 32 bytes.")
+    expect_parse_error(header + revision % (30, 30, ""),
+                       "Expected 30 bytes, but found 32 bytes.")
+    expect_parse_error(header + revision % (41, 41, "D 4\nprop\n"),
+                       "Property deletion (operation 'D') is only allowed")
+    expect_parse_error(header + revision % (41, 41, "X 4\nprop\n"),
+                       "Expected a pair of property entry lines")
+    expect_parse_error(
+        header + (revision % (32, 32, "")).replace("V 4", "V 3"),
+        "Didn't find expected newline terminator.")
+
+def lazy_properties_test():
+    block = "K 1\na\nV 2\nxy\nK 1\nb\nV 0\n\nD 1\nc\nPROPS-END\n"
+    props, stop = parser.Parser().scanUserProperties(block, True)
+    assert stop == len(block)
+    assert props.offsets != None
+    assert props.keys() == ["a", "b", "c"] and "b" in props and len(props) == 3
+    assert props["a"] == "xy" and props["c"] == None and props.get("d") == None
+    assert props.hasDeletions()
+    assert props.offsets != None, "lookups should not decode everything"
+    props["a"] = "xy"
+    assert str(props) is block, "unchanged properties keep their raw block"
+    cp = props.copy()
+    cp["b"] = "new"
+    assert str(props) is block
+    assert str(cp) == block.replace("V 0\n\n", "V 3\nnew\n")
+    del props["c"]
+    assert str(props) == "K 1\na\nV 2\nxy\nK 1\nb\nV 0\n\nPROPS-END\n"
+
+    # whatever reads them as a mapping sees all of a block not yet decoded
+    expected = {"a": "xy", "b": "", "c": None}
+    def fresh():
+        return parser.Parser().scanUserProperties(block, True)[0]
+    assert dict(fresh()) == expected
+    d = {}
+    d.update(fresh())
+    assert d == expected
+    def f(**kwargs):
+        return kwargs
+    assert f(**fresh()) == expected
+    assert json.loads(json.dumps(dict(fresh()))) == expected
+    assert fresh() == expected and expected == fresh()
+    assert fresh() != None and not fresh() == None
+    props = fresh()
+    assert copy.copy(props).keys() == ["a", "b", "c"]
+    assert str(copy.copy(props)) is block
+    assert str(copy.deepcopy(props)) == block
+    assert str(pickle.loads(pickle.dumps(props))) == block
+    assert props.offsets != None, "copying should not decode everything"
+    props["b"] = "new"
+    for cp in (copy.copy(props), copy.deepcopy(props),
+               pickle.loads(pickle.dumps(props, 2))):
+        assert cp.keys() == ["a", "b", "c"] and cp == props
+        assert str(cp) == str(props)
+        cp["a"] = "other"
+        assert props["a"] == "xy", "copies are independent"
+
+def validation_test(dumpFilePath):
+    original_bytes = read_file(dumpFilePath)
+    corrupt = original_bytes.replace(
+        "Text-content-md5: 3513baa8fdb82426428eaa59e975445a",
+        "Text-content-md5: 00000000000000000000000000000000")
+    assert corrupt != original_bytes
+    expect_parse_error(corrupt, "MD5 mismatch.")
+
+    # trust-input skips checksums altogether, in parser and writer
+    outFilePath = dumpFilePath + ".out"
+    events = parser.pull(StringIO(corrupt), validation=TRUST_INPUT)
+    writer.write_events_to_dumpfile(events, file(outFilePath, "wb"),
+                                    validation=TRUST_INPUT)
+    assert read_file(outFilePath) == corrupt
+
+    # standard trusts the md5 computed by the parser, paranoid doesn't
+    def with_altered_text(events):
+        for evt in events:
+            if type(evt) == parser.TextContent:
+                altered = parser.TextContent(evt[::-1])
+                altered.computed_md5 = evt.computed_md5
+                evt = altered
+            yield evt
+    events = with_altered_text(parser.pull(file(dumpFilePath, "rb")))
+    writer.write_events_to_dumpfile(events, file(outFilePath, "wb"))
+    events = with_altered_text(parser.pull(file(dumpFilePath, "rb")))
+    try:
+        writer.write_events_to_dumpfile(events, file(outFilePath, "wb"),
+                                        validation=PARANOID)
+    except WriteError, e:
+        assert "MD5 mismatch" in str(e)
+    else:
+        assert False, "paranoid writer should recompute md5"
+    os.unlink(outFilePath)
+
+def dispatch_test(dumpFilePath):
+    class Counter(dispatch.EventHandler):
+        def __init__(self):
+            dispatch.EventHandler.__init__(self)
+            self.nodes = 0
+        def onBeginNode(self, evt):
+            self.nodes += 1
+    class Marker(parser.BlankLine):
+        pass
+    counter = Counter()
+    blanks = []
+    counter.register(parser.BlankLine, blanks.append)
+    events = list(parser.pull(file(dumpFilePath, "rb")))
+    out = list(dispatch.handle_events(iter(events + [Marker()]), counter))
+    assert out[:-1] == events and isinstance(out[-1], Marker)
+    assert counter.nodes == len([e for e in events
+                                 if type(e) == parser.BeginNode]) > 0
+    assert isinstance(blanks[-1], Marker), "subclasses use base handler"
+
+    dropper = dispatch.EventHandler()
+    dropper.register(parser.TextContent, lambda evt: ())
+    out = list(dispatch.handle_events(iter(events), dropper))
+    assert out == [e for e in events if type(e) != parser.TextContent]
+
+    # a handler of a base class reaches the built-in classes too
+    headers = []
+    counter = Counter()
+    counter.register(odict, headers.append)
+    list(dispatch.handle_events(iter(events), counter))
+    assert [type(e) for e in headers] == [
+        type(e) for e in events if type(e) == parser.BeginRevision]
+    assert counter.nodes > 0
+
+def records_test(dumpFilePath):
+    original_bytes = read_file(dumpFilePath)
+    outFilePath = dumpFilePath + ".out"
+    records.write_records_to_dumpfile(
+        records.pull_records(file(dumpFilePath, "rb")),
+        file(outFilePath, "wb"))
+    assert read_file(outFilePath) == original_bytes
+
+    events = list(parser.pull(file(dumpFilePath, "rb")))
+    rebuilt = list(records.records_to_events(
+        records.pull_records(file(dumpFilePath, "rb"))))
+    assert map(repr, rebuilt) == map(repr, events)
+    grouped = records.events_to_records(iter(events))
+    assert "".join(map(str, grouped)) == original_bytes
+
+    def edit(props):
+        if "svn:log" in props:
+            props["svn:log"] = props["svn:log"].upper()
+    writer.write_events_to_dumpfile(
+        editors.edit_properties(parser.pull(file(dumpFilePath, "rb")), edit),
+        file(outFilePath, "wb"))
+    expected = read_file(outFilePath)
+    assert expected != original_bytes
+    records.write_records_to_dumpfile(
+        records.edit_record_properties(
+            records.pull_records(file(dumpFilePath, "rb")), edit),
+        file(outFilePath, "wb"))
+    assert read_file(outFilePath) == expected
+    os.unlink(outFilePath)
+
+def revisions_test(dumpFilePath):
+    original_bytes = read_file(dumpFilePath)
+    events = list(parser.pull(StringIO(original_bytes)))
+    texts = [evt for evt in events if isinstance(evt, parser.TextContent)]
+    for max_size in (0, 10, 1 << 20):
+        seen = []
+        found = []
+        def edit(revision):
+            seen.append((revision.number(), revision.spilled))
+            found.extend(filter(None, map(revision.text, revision.nodes)))
+        edited = list(records.edit_revisions(iter(events), edit, max_size))
+        assert found == texts
+        assert [text.computed_md5 for text in found] == \
+               [text.computed_md5 for text in texts]
+        assert map(repr, edited) == map(repr, events)
+        assert [getattr(evt, "computed_md5", None) for evt in edited] == \
+               [getattr(evt, "computed_md5", None) for evt in events]
+        assert [rev for rev, spilled in seen] == range(len(seen))
+        spilled = sum([spilled for rev, spilled in seen])
+        if max_size == 0:
+            assert spilled == len(texts)
+        elif max_size == 1 << 20:
+            assert spilled == 0
+
+    def edit(revision):
+        if revision.number() == 3:
+            return False
+        # deletes first
+        revision.nodes.sort(key=lambda node:
+                            node.dump_props["Node-action"] != "delete")
+    out = StringIO()
+    out.close = lambda: None
+    writer.write_events_to_dumpfile(
+        records.edit_revisions(parser.pull(StringIO(original_bytes)),
+                               edit, 0), out)
+    actions = []
+    for record in records.pull_records(StringIO(out.getvalue())):
+        if type(record) == records.RevisionRecord:
+            rev = int(record.dump_props["Revision-number"])
+            assert rev != 3
+        elif type(record) == records.NodeRecord:
+            actions.append((rev, record.dump_props["Node-action"]))
+    for rev, action in actions:
+        if action != "delete":
+            assert (rev, "delete") not in actions[actions.index(
+                (rev, action)):]
+
+def catalog_test(dumpFilePath):
+    dbPath = dumpFilePath + ".db"
+    texts, props = {}, {}
+    for record in records.pull_records(file(dumpFilePath, "rb")):
+        if type(record) == records.RevisionRecord:
+            rev = int(record.dump_props["Revision-number"])
+        elif type(record) == records.NodeRecord:
+            key = (record.dump_props["Node-path"], rev)
+            texts[key] = record.text
+            props[key] = record.props
+    for validation in (TRUST_INPUT, STANDARD):
+        cat = catalog.build_catalog(dumpFilePath, dbPath, validation)
+        nodes = cat.nodes()
+        assert len(nodes) == len(texts) > 0
+        for node in nodes:
+            key = (node["path"], node["rev"])
+            if node["text_length"] == 0:
+                assert cat.text(node) == "" and texts[key] == None
+            else:
+                assert cat.text(node) == texts[key], key
+            assert cat.properties(node) == props[key], key
+        cat.close()
+    cat = catalog.Catalog(dbPath)
+    revs = cat.revisionsTouching("/unterminated-last-line.txt")
+    assert revs == [2, 4, 5, 6, 7], revs
+    copy = cat.copySources("terminated-last-line.copy")[0]
+    assert (copy["copyfrom_path"], copy["copyfrom_rev"]) == \
+           ("terminated-last-line.txt", 3)
+    assert cat.properties(cat.revision(1))["svn:log"] != None
+    revisions = map(tuple, cat.db.execute("SELECT * FROM revisions"))
+    cat.close()
+
+    cat = catalog.build_log_index(dumpFilePath, dbPath)
+    assert cat.nodes() == []
+    assert map(tuple, cat.db.execute("SELECT * FROM revisions")) == revisions
+    def search(*args, **kwargs):
+        return [row["rev"] for row in cat.searchLog(*args, **kwargs)]
+    assert search(["added", "property"]) == [4, 5]
+    assert search(["PROP1"]) == [4, 6]
+    assert search(["prop*"]) == [2, 4, 5, 6]
+    assert search(["prop1", "prop2"]) == []
+    assert search(author="bsmith", since="2007-03-17T20:16",
+                  until="2007-03-17T20:17") == [6, 7, 8, 9]
+    assert search(author="nobody") == []
+    row = cat.revision(4)
+    assert cat.properties(row)["svn:log"] == row["log"]
+    cat.close()
+    assert catalog.log_words("Fix PROJ-123, see r12:14") == set(
+        ["fix", "proj-123", "proj", "123", "see", "r12:14", "r12", "14"])
+    os.unlink(dbPath)
+
+def paths_test(dumpFilePath):
+    trie = paths.PathTrie({"trunk": 1, "trunk/foo": 2, "/": 0})
+    assert trie.longestPrefix("trunk/foo/bar") == (9, 2)
+    assert trie.longestPrefix("trunk/foobar") == (5, 1)
+    assert trie.longestPrefix("tags") == (0, 0)
+    assert paths.PathTrie().longestPrefix("trunk") == (None, None)
+
+    remapper = paths.PathRemapper([("trunk/foo", "projects/foo/trunk"),
+                                   ("/", "old"), ("tags", "")])
+    assert remapper.remap("trunk/foo/x.c") == "projects/foo/trunk/x.c"
+    assert remapper.remap("trunk/foobar") == "old/trunk/foobar"
+    assert remapper.remap("tags/1.0") == "1.0"
+    props = parser.UserProperties()
+    props["svn:mergeinfo"] = "/trunk/foo:1-5\n/branches/b:7*"
+    remapper.edit(props)
+    assert props["svn:mergeinfo"] == \
+           "/projects/foo/trunk:1-5\n/old/branches/b:7*"
+
+    original_bytes = read_file(dumpFilePath)
+    outFilePath = dumpFilePath + ".out"
+    mapping = {"": "moved"}
+    events = paths.remap_paths(parser.pull(file(dumpFilePath, "rb")),
+                               mapping)
+    writer.write_events_to_dumpfile(events, file(outFilePath, "wb"))
+    moved = read_file(outFilePath)
+    assert "Node-path: moved/empty.txt\n" in moved
+    assert "Node-copyfrom-path: moved/terminated-last-line.txt\n" in moved
+    events = paths.remap_paths(parser.pull(file(outFilePath, "rb")),
+                               {"moved": ""}, mergeinfo=True)
+    writer.write_events_to_dumpfile(events, file(outFilePath + "2", "wb"))
+    assert read_file(outFilePath + "2") == original_bytes
+    os.unlink(outFilePath)
+    os.unlink(outFilePath + "2")
+
+    # a prefix moved to the root: the add of the prefix is dropped
+    def dir_node(path, action):
+        return ("Node-path: %s\nNode-kind: dir\nNode-action: %s\n"
+                "Content-length: 0\n\n\n\n" % (path, action))
+    dump = make_dump([[("old/a.txt", "add", None, "a\n", None)],
+                      [("old/a.txt", "change", None, "b\n", None)]])
+    first = "Node-path: old/a.txt"
+    dump = dump.replace(first, dir_node("old", "add") + first, 1)
+    expected = make_dump([[("a.txt", "add", None, "a\n", None)],
+                          [("a.txt", "change", None, "b\n", None)]])
+    for mapping in ({"old": "/"}, {"old": ""}):
+        for mergeinfo in (False, True):
+            out = "".join([str(evt) for evt in paths.remap_paths(
+                parser.pull(StringIO(dump)), mapping, mergeinfo)])
+            assert out == expected
+    try:
+        editors.consume_events(paths.remap_paths(
+            parser.pull(StringIO(dump + dir_node("old", "delete"))),
+            {"old": "/"}))
+    except DumpfileError, e:
+        assert "moved to the root" in str(e)
+    else:
+        assert False, "expected DumpfileError"
+
+def props_block(props):
+    block = ""
+    for k, v in props:
+        block += "K %d\n%s\nV %d\n%s\n" % (len(k), k, len(v), v)
+    return block + "PROPS-END\n"
+
+def make_dump(revisions):
+    """
+    Returns a version 2 dumpfile of revisions, a list of lists of
+    nodes (path, action, props, text, copyfrom), where props is a
+    list of (name, value) or None and text and copyfrom may be None.
+    """
+    out = ["SVN-fs-dump-format-version: 2\n\n"]
+    for rev, nodes in enumerate(revisions):
+        block = props_block([("svn:log", "r%d" % rev)])
+        out.append("Revision-number: %d\nProp-content-length: %d\n"
+                   "Content-length: %d\n\n%s\n"
+                   % (rev + 1, len(block), len(block), block))
+        for path, action, props, text, copyfrom in nodes:
+            out.append("Node-path: %s\nNode-kind: file\n"
+                       "Node-action: %s\n" % (path, action))
+            if copyfrom:
+                out.append("Node-copyfrom-rev: %d\nNode-copyfrom-path: %s\n"
+                           % copyfrom[::-1])
+            block = ""
+            if props != None:
+                block = props_block(props)
+                out.append("Prop-content-length: %d\n" % len(block))
+            if text != None:
+                out.append("Text-content-length: %d\n"
+                           "Text-content-md5: %s\n"
+                           % (len(text), md5(text).hexdigest()))
+            out.append("Content-length: %d\n\n%s%s\n\n"
+                       % (len(block) + len(text or ""), block, text or ""))
+    return "".join(out)
+
+def memo_test():
+    eol = [("svn:eol-style", "native")]
+    keywords = [("svn:keywords", "Id"), ("svn:eol-style", "native")]
+    dump = make_dump([
+        [("a.txt", "add", eol, "a\n", None),
+         ("b.txt", "add", keywords, "b\n", None)],
+        [("c.txt", "add", eol, "c\n", None),
+         ("d.txt", "add", keywords, "d\n", None),
+         ("e.txt", "add", eol, "e\n", None)]])
+    edited = []
+    def edit(props):
+        if type(props) == parser.UserProperties:
+            edited.append(dict(props))
+            if "svn:keywords" in props:
+                props["svn:keywords"] = "Id Revision"
+            props["svn:eol-style"] = "LF"
+    def run(memo_size, memo=None):
+        del edited[:]
+        out = StringIO()
+        out.close = lambda: None
+        writer.write_events_to_dumpfile(editors.edit_properties(
+            parser.pull(StringIO(dump)), edit, memo_size, memo), out)
+        return out.getvalue()
+    expected = run(0)
+    assert len(edited) == 7
+    assert "Id Revision" in expected and "native" not in expected
+    assert run(1024) == expected
+    # the two revisions have distinct logs, the five nodes two blocks
+    assert len(edited) == 4
+    # a memo too small to hold anything edits every block
+    assert run(10) == expected
+    assert len(edited) == 7
+    # a shared memo remembers from one dumpfile to the next
+    memo = editors.property_memo()
+    assert run(0, memo) == expected
+    assert len(edited) == 4
+    assert run(0, memo) == expected
+    assert len(edited) == 0
+
+def content_test():
+    crlf = "one\r\ntwo\rthree $Id: a.txt 1 $ $Rev:: 1  $\n" * 5000
+    lf = "one\ntwo\nthree $Id$ $Rev::    $\n" * 5000
+    native = [("svn:eol-style", "native"), ("svn:keywords", "Id Revision")]
+    dump = make_dump([
+        [("a.txt", "add", native, crlf, None),
+         ("b.txt", "add", [], crlf, None)],
+        [("c.txt", "add", None, crlf, ("a.txt", 1)),
+         ("a.txt", "change", [], crlf, None)],
+    ])
+    outFilePath = "content.dump.out"
+    events = content.normalize_text(parser.pull(StringIO(dump)),
+                                    keywords=True)
+    writer.write_events_to_dumpfile(events, file(outFilePath, "wb"))
+    texts = []
+    for evt in parser.pull(file(outFilePath, "rb")):
+        if type(evt) == parser.BeginNode:
+            path = evt["Node-path"]
+        elif type(evt) == parser.TextContent:
+            texts.append((path, evt == lf and "lf" or evt == crlf and "crlf"))
+    assert texts == [("a.txt", "lf"), ("b.txt", "crlf"), ("c.txt", "lf"),
+                     ("a.txt", "crlf")], texts
+
+    # copies of changed texts, and text deltas against them
+    dump = make_dump([
+        [("a.txt", "add", native, crlf, None),
+         ("b.txt", "add", [], crlf, None)],
+        [("c.txt", "add", None, crlf, ("a.txt", 1)),
+         ("a.txt", "change", [], crlf, None)],
+        [("d.txt", "add", None, None, ("a.txt", 1))],
+        [("d.txt", "change", None, crlf + "four\r\n", None)],
+    ])
+    copy = "Node-copyfrom-path: a.txt\nContent-length: 0\n"
+    assert copy in dump
+    dump = dump.replace(copy, "Node-copyfrom-path: a.txt\n"
+                        "Text-copy-source-md5: %s\n"
+                        "Content-length: 0\n" % md5(crlf).hexdigest())
+    expected = [("a.txt", lf), ("b.txt", crlf), ("c.txt", lf),
+                ("a.txt", crlf), ("d.txt", lf + "four\n")]
+    for version in (2, 3):
+        events = parser.pull(StringIO(dump))
+        if version == 3:
+            events = deltas.make_text_deltas(events)
+        events = content.normalize_text(events, keywords=True)
+        writer.write_events_to_dumpfile(events, file(outFilePath, "wb"))
+        tracker = deltas.ContentTracker()
+        texts = []
+        for evt in parser.pull(file(outFilePath, "rb")):
+            tracker.track(evt)
+            if type(evt) == parser.BeginNode:
+                node = evt
+                if "Text-copy-source-md5" in node:
+                    assert node["Text-copy-source-md5"] == md5(lf).hexdigest()
+            elif type(evt) == parser.TextContent:
+                if version == 3:
+                    evt = tracker.cache.get(tracker.text_md5)
+                texts.append((node["Node-path"], evt))
+        tracker.close()
+        assert texts == expected, [path for path, text in texts]
+        # only nodes whose text, or base, changed lose their delta:
+        # all but b.txt
+        if version == 3:
+            assert read_file(outFilePath).count("Text-delta: true") == 1
+    os.unlink(outFilePath)
+
+def verify_test(dumpFilePath):
+    badFilePath = dumpFilePath + ".bad"
+    write_file(badFilePath, read_file(dumpFilePath).replace(
+        "Text-content-md5: 3513baa8fdb82426428eaa59e975445a",
+        "Text-content-md5: 00000000000000000000000000000000"))
+    for processes in (1, 2):
+        results = list(verify.verify_dumpfiles(
+            [dumpFilePath, badFilePath, "short.dump3"], processes=processes))
+        results.sort(key=lambda result: result.path)
+        good, bad, good3 = results
+        assert good.error == None and good3.error == None, good.error
+        assert good.revisions == 12 and good.nodes > 0
+        assert "MD5 mismatch" in bad.error
+        assert bad.where().startswith("r3 terminated-last-line.txt at byte")
+    os.unlink(badFilePath)
+
+def tee_test(dumpFilePath):
+    original_bytes = read_file(dumpFilePath)
+    expected = StringIO()
+    events = paths.remap_paths(parser.pull(file(dumpFilePath, "rb")),
+                               {"": "moved"})
+    for evt in events:
+        expected.write(str(evt))
+    def count_nodes(events):
+        counts.append(len([evt for evt in events
+                           if type(evt) == parser.BeginNode]))
+        yield None
+    for threads in (False, True):
+        counts = []
+        tee.tee_events(parser.pull(file(dumpFilePath, "rb")), [
+            lambda events: writer.write_events(
+                paths.remap_paths(events, {"": "moved"}),
+                file(dumpFilePath + ".moved", "wb")),
+            tee.readonly(lambda events: writer.write_events(
+                events, file(dumpFilePath + ".copy", "wb"))),
+            lambda events: writer.write_events(
+                paths.remap_paths(events, {"": "other"}),
+                file(dumpFilePath + ".other", "wb")),
+            tee.readonly(count_nodes),
+        ], threads=threads, buffer_size=10)
+        assert read_file(dumpFilePath + ".copy") == original_bytes
+        assert read_file(dumpFilePath + ".moved") == expected.getvalue()
+        assert "Node-path: other/" in read_file(dumpFilePath + ".other")
+        assert counts == [original_bytes.count("\nNode-path: ")], counts
+    # without readonly branches, no branch may see another's changes
+    for threads in (False, True):
+        tee.tee_events(parser.pull(file(dumpFilePath, "rb")), [
+            lambda events: writer.write_events(
+                paths.remap_paths(events, {"": "moved"}),
+                file(dumpFilePath + ".moved", "wb")),
+            lambda events: writer.write_events(
+                events, file(dumpFilePath + ".copy", "wb")),
+        ], threads=threads, buffer_size=10)
+        assert read_file(dumpFilePath + ".copy") == original_bytes
+        assert read_file(dumpFilePath + ".moved") == expected.getvalue()
+    def fail(events):
+        for evt in events:
+            if type(evt) == parser.TextContent:
+                raise ValueError("fail")
+            yield evt
+    for threads in (False, True):
+        try:
+            tee.tee_events(parser.pull(file(dumpFilePath, "rb")),
+                           [fail, tee.readonly(editors.consume_events)],
+                           threads=threads, buffer_size=1)
+        except ValueError:
+            pass
+        else:
+            assert False, "expected ValueError"
+    for suffix in (".moved", ".copy", ".other"):
+        os.unlink(dumpFilePath + suffix)
+
+def reachable_size(objects):
+    """
+    Returns the bytes taken by the dictionaries, lists and Directories
+    reachable from objects, each counted once.
+    """
+    seen = set()
+    size = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or type(obj) not in (dict, list, tree.Directory):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+def expect_tree_error(dump, message):
+    try:
+        editors.consume_events(tree.check_tree(parser.pull(StringIO(dump))))
+    except TreeError, e:
+        assert message in str(e), str(e)
+    else:
+        assert False, "expected tree error: " + message
+
+def tree_test():
+    paths = tree.PathTree()
+    paths.beginRevision(1)
+    assert paths.add("a", tree.Directory()) and paths.add("a/b", tree.FILE)
+    assert not paths.add("x/y", tree.FILE)
+    paths.endRevision()
+    paths.beginRevision(2)
+    assert paths.add("c", paths.lookup("a", 1))
+    assert paths.add("c/d", tree.FILE) and paths.delete("a/b")
+    assert not paths.delete("a/b")
+    paths.endRevision()
+    assert paths.lookup("a/b", 1) is tree.FILE
+    assert paths.lookup("a/b", 2) == None
+    assert sorted(paths.lookup("c")) == ["b", "d"]
+    assert dict(paths.lookup("a", 1)) == {"b": tree.FILE}
+    assert dict(paths.lookup("a", 7)) == {}
+
+    # only the trees of revisions to keep are kept
+    paths = tree.PathTree(keep=set([2]))
+    for rev in (1, 2, 3):
+        paths.beginRevision(rev)
+        root = paths.root
+        assert paths.add("f%d" % (rev,), tree.FILE)
+        assert (paths.root is root) == (rev == 2)
+        paths.endRevision()
+    assert paths.revs == [2]
+    assert sorted(paths.lookup("", 2)) == ["f1", "f2"]
+    assert sorted(paths.lookup("")) == ["f1", "f2", "f3"]
+
+    # a large directory changes by copying a few nodes of its trie, not
+    # all of its entries, and earlier revisions don't see the changes
+    paths = tree.PathTree()
+    paths.beginRevision(1)
+    for i in xrange(10000):
+        assert paths.add("big/f%d" % (i,), tree.FILE, create=True)
+    paths.endRevision()
+    before = reachable_size(paths.roots)
+    for rev in xrange(2, 202):
+        paths.beginRevision(rev)
+        assert paths.add("big/g%d" % (rev,), "r%d" % (rev,))
+        assert paths.delete("big/f%d" % (rev,))
+        paths.endRevision()
+    growth = (reachable_size(paths.roots) - before) // 200
+    assert growth < 8192, "each revision takes %d bytes" % (growth,)
+    big = paths.lookup("big", 1)
+    assert len(big) == 10000 and "g2" not in big and big["f2"] is tree.FILE
+    big = paths.lookup("big", 100)
+    assert len(big) == 10000 and len(big.items()) == 10000
+    assert big["g100"] == "r100" and "g101" not in big and "f99" not in big
+    assert sorted(paths.lookup("big")) == sorted(
+        ["f%d" % (i,) for i in range(10000) if not 2 <= i < 202] +
+        ["g%d" % (i,) for i in range(2, 202)])
+
+    for dumpFilePath in ("short.dump2", "short.dump3"):
+        editors.consume_events(tree.check_tree(
+            parser.pull(file(dumpFilePath, "rb"))))
+    add = ("a.txt", "add", None, "a", None)
+    delete = ("a.txt", "delete", None, None, None)
+    editors.consume_events(tree.check_tree(parser.pull(StringIO(make_dump(
+        [[add], [delete], [("b.txt", "add", None, None, ("a.txt", 1))]])))))
+    expect_tree_error(make_dump([[add], [add]]),
+                      "r2 a.txt: add of a path which exists already.")
+    expect_tree_error(make_dump([[add], [delete], [delete]]),
+                      "r3 a.txt: delete of a path which does not exist.")
+    expect_tree_error(make_dump(
+        [[add], [delete], [("b.txt", "add", None, None, ("a.txt", 2))]]),
+        "r3 b.txt: copy from a.txt@2, which does not exist.")
+    expect_tree_error(make_dump([[("a/b.txt", "add", None, "b", None)]]),
+                      "r1 a/b.txt: add to a parent which is not a directory")
+
+def binary_test(dumpFilePath):
+    original_bytes = read_file(dumpFilePath)
+    encoded = "".join(binary.encode_events(
+        parser.pull(StringIO(original_bytes))))
+    decoded = list(binary.pull_binary(StringIO(encoded)))
+    parsed = list(parser.pull(StringIO(original_bytes)))
+    assert [repr(evt) for evt in decoded] == [repr(evt) for evt in parsed]
+    assert [getattr(evt, "computed_md5", None) for evt in decoded] == \
+           [getattr(evt, "computed_md5", None) for evt in parsed]
+    out = StringIO()
+    out.close = lambda: None
+    writer.write_events_to_dumpfile(iter(decoded), out)
+    assert out.getvalue() == original_bytes
+
+    def edit(props):
+        if "svn:log" in props:
+            props["svn:log"] = "edited"
+            props["new"] = "x"
+        if "svn:eol-style" in props:
+            del props["svn:eol-style"]
+    edited = StringIO()
+    edited.close = lambda: None
+    binary.write_binary(editors.edit_properties(
+        parser.pull(StringIO(original_bytes)), edit), edited)
+    decoded = [str(evt) for evt in binary.pull_binary(
+        StringIO(edited.getvalue()))]
+    assert decoded == [str(evt) for evt in editors.edit_properties(
+        parser.pull(StringIO(original_bytes)), edit)]
+
+    props = parser.UserProperties()
+    props["big"] = "x" * 40000
+    props["gone"] = None
+    text = parser.TextContent("text")
+    text.computed_md5 = md5("text").hexdigest()
+    events = [parser.BeginDumpfile(3, "uuid"), props, text,
+              parser.EndDumpfile()]
+    decoded = list(binary.pull_binary(StringIO("".join(
+        binary.encode_events(events)))))
+    assert map(str, decoded) == map(str, events)
+    assert decoded[1].items() == props.items()
+    assert decoded[2].computed_md5 == text.computed_md5
+
+    for bad, message in [(encoded[:-3], "in the middle"),
+                         (encoded[:-5], "EndDumpfile"),
+                         (original_bytes, "Not a stream")]:
+        try:
+            editors.consume_events(binary.pull_binary(StringIO(bad)))
+        except parser.ParseError, e:
+            assert message in str(e), str(e)
+        else:
+            assert False, "expected ParseError: " + message
+
+def compare_test(dumpFilePath):
+    editedFilePath = dumpFilePath + ".edited"
+    def edit(props):
+        if props.get("svn:log") == "":
+            props["svn:log"] = "edited"
+    writer.write_events_to_dumpfile(paths.remap_paths(
+        editors.edit_properties(parser.pull(file(dumpFilePath, "rb")), edit),
+        {"empty.txt": "moved.txt"}), file(editedFilePath, "wb"))
+    expected = ["r1 empty.txt: node (add) only in left",
+                "r1 moved.txt: node (add) only in right",
+                "r3: header Prop-content-length: '100' != '106'",
+                "r3: header Content-length: '100' != '106'",
+                "r3: property svn:log: '' != 'edited'",
+                "r11 nothing.txt: header Node-copyfrom-path: "
+                "'empty.txt' != 'moved.txt'",
+                "r11 empty.txt: node (delete) only in left",
+                "r11 moved.txt: node (delete) only in right"]
+    for processes in (1, 2):
+        differences = [str(d) for d in compare.compare_dumpfiles(
+            dumpFilePath, editedFilePath, processes=processes)]
+        assert differences == expected, differences
+    differences = [str(d) for d in compare.compare_dumpfiles(
+        dumpFilePath, editedFilePath, revisions=(2, None))]
+    assert differences == expected[2:], differences
+    assert not list(compare.compare_dumpfiles(dumpFilePath, dumpFilePath,
+                                              TRUST_INPUT))
+    differences = list(compare.compare_dumpfiles(dumpFilePath, "short.dump3"))
+    assert str(differences[0]) == "dumpfile: version: 2 != 3"
+    assert "text" in [d.kind for d in differences]
+    os.unlink(editedFilePath)
+
+    head = StringIO("0123\n4567\n89ab\n")
+    fileSlice = compare.FileSlice("HEAD\n", head, 5, 12)
+    assert fileSlice.readline() == "HEAD\n"
+    assert fileSlice.readline() == "4567\n"
+    assert fileSlice.readline() == "89"
+    assert fileSlice.readline() == ""
+    fileSlice.seek(3)
+    assert fileSlice.read() == "D\n4567\n89"
+
+def follow_test(dumpFilePath):
+    original_bytes = read_file(dumpFilePath)
+    growingFilePath = dumpFilePath + ".growing"
+    # the file grows by a line, a part of a line, text and revisions
+    cuts = [0, 35, 90, 100, 480, 1000, 1001, 2500, len(original_bytes)]
+    growing = file(growingFilePath, "wb")
+    appended = []
+    def follow(waits):
+        if len(appended) + 1 == len(cuts):
+            return False
+        i = len(appended)
+        growing.write(original_bytes[cuts[i]:cuts[i+1]])
+        growing.flush()
+        appended.append(waits)
+        return True
+    out = StringIO()
+    out.close = lambda: None
+    writer.write_events_to_dumpfile(
+        parser.pull(file(growingFilePath, "rb"), follow=follow), out,
+        flush=True)
+    assert out.getvalue() == original_bytes
+    assert len(appended) == len(cuts) - 1
+    growing.close()
+
+    waited = []
+    follow = parser.Follow(poll=0.001, timeout=0.005,
+                           on_wait=lambda: waited.append(1))
+    editors.consume_events(parser.pull(file(growingFilePath, "rb"),
+                                       follow=follow))
+    assert len(waited) == 5, waited
+    write_file(growingFilePath, original_bytes[:1000])
+    try:
+        editors.consume_events(parser.pull(file(growingFilePath, "rb"),
+                                           follow=follow))
+    except parser.ParseError:
+        pass
+    else:
+        assert False, "expected ParseError"
+    os.unlink(growingFilePath)
+
+def blobs_test(dumpFilePath):
+    original_bytes = read_file(dumpFilePath)
+    storePath = tempfile.mkdtemp()
+    try:
+        def thin(events):
+            out = StringIO()
+            out.close = lambda: None
+            writer.write_events_to_dumpfile(
+                blobs.thin_events(events, store, 1), out)
+            return out.getvalue()
+        def rehydrate(thin_bytes):
+            out = StringIO()
+            out.close = lambda: None
+            writer.write_events_to_dumpfile(blobs.rehydrate_events(
+                parser.pull(StringIO(thin_bytes)), store), out)
+            return out.getvalue()
+        store = blobs.BlobStore(storePath)
+        thin_bytes = thin(parser.pull(StringIO(original_bytes)))
+        assert store.added > 0 and len(thin_bytes) < len(original_bytes)
+        assert parser.TextContent not in [
+            type(evt) for evt in parser.pull(StringIO(thin_bytes))]
+        assert rehydrate(thin_bytes) == original_bytes
+
+        # a second dump of the same texts adds nothing to the store
+        store = blobs.BlobStore(storePath)
+        assert thin(parser.pull(StringIO(original_bytes))) == thin_bytes
+        assert store.added == 0 and store.found > 0
+        # nor does thinning a thin dump
+        assert thin(parser.pull(StringIO(thin_bytes))) == thin_bytes
+
+        # small texts stay where they are
+        store = blobs.BlobStore(storePath)
+        out = StringIO()
+        out.close = lambda: None
+        writer.write_events_to_dumpfile(blobs.thin_events(
+            parser.pull(StringIO(original_bytes)), store), out)
+        assert out.getvalue() == original_bytes
+        assert store.added == store.found == 0
+
+        # a thin dump can be edited like any other
+        def edit(props):
+            if "svn:log" in props:
+                props["svn:log"] = "edited"
+        out = StringIO()
+        out.close = lambda: None
+        writer.write_events_to_dumpfile(editors.edit_properties(
+            parser.pull(StringIO(original_bytes)), edit), out)
+        assert rehydrate(thin(editors.edit_properties(
+            parser.pull(StringIO(thin_bytes)), edit))) == out.getvalue()
+
+        key = [evt["Text-content-blob"].split()[1]
+               for evt in parser.pull(StringIO(thin_bytes))
+               if isinstance(evt, parser.BeginNode)
+               and "Text-content-blob" in evt][0]
+        blob = read_file(store.path(key))
+        for damaged, message in [(blob[:-1] + "X", "corrupt"),
+                                 (blob + "X", "bytes"),
+                                 (None, "not in the store")]:
+            if damaged == None:
+                os.unlink(store.path(key))
+            else:
+                write_file(store.path(key), damaged)
+            try:
+                rehydrate(thin_bytes)
+            except BlobError, e:
+                assert message in str(e), str(e)
+            else:
+                assert False, "expected BlobError: " + message
+    finally:
+        shutil.rmtree(storePath)
+
+def read_tree(path):
+    """
+    Returns a dictionary of the files below path, by path relative to
+    it, and of the directories, whose value is None.
+    """
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        relpath = os.path.relpath(dirpath, path)
+        for name in dirnames:
+            tree[os.path.join(relpath, name)] = None
+        for name in filenames:
+            tree[os.path.join(relpath, name)] = read_file(
+                os.path.join(dirpath, name))
+    return tree
+
+def export_test():
+    # what each revision of short.dump2 should export, from its texts
+    expected = []
+    files = {}
+    for record in records.pull_records(file("short.dump2", "rb")):
+        if type(record) == records.RevisionRecord:
+            if expected:
+                expected[-1] = dict(files)
+            expected.append(None)
+        elif type(record) == records.NodeRecord:
+            node = record.dump_props
+            name = os.path.join(".", node["Node-path"])
+            if node["Node-action"] == "delete":
+                del files[name]
+            elif record.text != None:
+                files[name] = record.text
+            elif "Node-copyfrom-path" in node:
+                files[name] = expected[int(node["Node-copyfrom-rev"])][
+                    os.path.join(".", node["Node-copyfrom-path"])]
+            elif name not in files:
+                files[name] = ""
+    expected[-1] = dict(files)
+
+    dstPath = tempfile.mkdtemp()
+    dbPath = dstPath + ".db"
+    cat = catalog.build_catalog("short.dump3", dbPath)
+    try:
+        for rev in range(len(expected)):
+            for dumpFilePath, processes, cat_ in [("short.dump2", 1, None),
+                                                  ("short.dump3", 2, None),
+                                                  ("short.dump3", 1, cat)]:
+                shutil.rmtree(dstPath)
+                result = export.export_tree(dumpFilePath, rev, dstPath,
+                                            processes, cat_)
+                assert read_tree(dstPath) == expected[rev], rev
+                assert result.files == len(expected[rev])
+        try:
+            export.export_tree("short.dump2", len(expected), dstPath)
+        except DumpfileError, e:
+            assert "no revision" in str(e)
+        else:
+            assert False, "expected DumpfileError"
+    finally:
+        cat.close()
+        os.unlink(dbPath)
+        shutil.rmtree(dstPath)
+
+    # a copy from a revision without nodes copies the tree it has
+    dumpPath = tempfile.mktemp(".dump")
+    write_file(dumpPath, make_dump([[("a.txt", "add", None, "a\n", None)],
+                                    [],
+                                    [("b.txt", "add", None, None,
+                                      ("a.txt", 2))]]))
+    dstPath = tempfile.mkdtemp()
+    cat = catalog.build_catalog(dumpPath, dumpPath + ".db")
+    try:
+        for cat_ in (None, cat):
+            shutil.rmtree(dstPath)
+            export.export_tree(dumpPath, 3, dstPath, 1, cat_)
+            assert read_tree(dstPath) == {os.path.join(".", "a.txt"): "a\n",
+                                          os.path.join(".", "b.txt"): "a\n"}
+    finally:
+        cat.close()
+        os.unlink(dumpPath + ".db")
+        os.unlink(dumpPath)
+        shutil.rmtree(dstPath)
+
+    # the texts which don't survive are never read
+    read = []
+    real_read_text = export.read_text
+    def read_text(dumpFile, text):
+        read.append(text[0])
+        return real_read_text(dumpFile, text)
+    export.read_text = read_text
+    try:
+        dstPath = tempfile.mkdtemp()
+        result = export.export_tree("short.dump2", 11, dstPath, 1)
+        shutil.rmtree(dstPath)
+    finally:
+        export.read_text = real_read_text
+    texts = dict([(node["path"], node["text_offset"]) for node in
+                  export.NodeScanner("short.dump2", 11)
+                  if node["text_length"] != None])
+    assert len(read) == result.files
+    assert texts["unterminated-last-line.txt"] not in read
+    assert set(read) < set(texts.values())
+
 def run_tests():
     for filePath in dumpfiles:
         round_trip_test(filePath)
+        merge_test(filePath)
+        records_test(filePath)
+        revisions_test(filePath)
+    property_block_test()
+    validation_test("short.dump2")
+    lazy_properties_test()
+    delta_test("short.dump3")
+    make_deltas_test("short.dump2")
+    dispatch_test("short.dump2")
+    catalog_test("short.dump2")
+    paths_test("short.dump2")
+    memo_test()
+    content_test()
+    verify_test("short.dump2")
+    tee_test("short.dump2")
+    tree_test()
+    binary_test("short.dump2")
+    binary_test("short.dump3")
+    compare_test("short.dump2")
+    follow_test("short.dump2")
+    blobs_test("short.dump2")
+    blobs_test("short.dump3")
+    export_test()
     print "ok"
 
 def main():
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.tree: the tree of paths of each revision, as a dumpfile passes
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+svnadmin load refuses a dumpfile which copies from a path that didn't
+exist, adds a path that already does or deletes one that doesn't --
+often hours into the load.  check_tree finds these in one pass over
+the dumpfile.
+"""
+
+from bisect import bisect_right
+from util import crop_text_block as msg
+from dispatch import EventHandler, handle_events
+from validation import TreeError
+
+# The tree's entry for a file.  Files are all alike, as far as
+# check_tree is concerned, so they all share it.
+FILE = "file"
+
+# A Directory of up to BUCKET_SIZE entries is a plain dictionary.  A
+# larger one is a trie of nodes of WIDTH slots, indexed by SHIFT bits
+# of the hashes of the names at a time, up to HASH_BITS.
+BUCKET_SIZE = 8
+SHIFT = 5
+WIDTH = 1 << SHIFT
+MASK = WIDTH - 1
+HASH_BITS = 64
+
+
+def check_tree(events):
+    """
+    Check each node against the tree of paths as it was before the
+    node, as parse events pass through.  Raises TreeError if
+
+    - the source of a copy did not exist, or was not of Node-kind,
+    - an add adds a path which exists, or to a parent which doesn't,
+    - a delete, change or replace acts on a path which doesn't exist,
+    - a change gives a Node-kind other than that of its path.
+
+    Dumpfiles which start after revision 1 (made with --incremental,
+    or with -r) don't say what was there before.  Of these, only the
+    paths they add themselves are checked.
+    """
+    return handle_events(events, TreeValidator())
+
+
+def split_path(path):
+    """
+    Returns the components of path, interned, so that each name is
+    kept only once however many paths and revisions it appears in.
+    """
+    return [intern(name) for name in path.split("/") if name]
+
+
+def kind_of(entry):
+    if entry == None:
+        return None
+    if type(entry) is Directory:
+        return "dir"
+    return "file"
+
+
+class Directory(object):
+    """
+    A directory of a PathTree: a mapping of names to entries, which
+    a revision changes without copying more than a few of them.
+
+    Small directories keep their entries in a dictionary.  Once there
+    are more than BUCKET_SIZE, they are spread over a trie: the slots
+    of each of its nodes (lists of WIDTH slots) are None, a single
+    (name, entry), or the node one level further down, for the names
+    whose hashes agree so far.  Only names whose hashes agree in full
+    share a dictionary again.
+
+    put() and remove() change nothing in place which they don't get
+    from own(), a function which returns either its argument or a
+    copy which may be changed (see PathTree.own).  A change of a large
+    directory thus copies a node for each level of the trie, and one
+    bucket, rather than all of its entries.
+
+    root
+        The dictionary, or the top node of the trie.
+
+    size
+        The number of entries.
+    """
+
+    __slots__ = ("root", "size")
+
+    def __init__(self, directory=None):
+        if directory == None:
+            self.root = {}
+            self.size = 0
+        else:
+            self.root = directory.root
+            self.size = directory.size
+
+    def get(self, name, default=None):
+        hashed = hash(name)
+        slot = self.root
+        shift = 0
+        while type(slot) is list:
+            slot = slot[(hashed >> shift) & MASK]
+            shift += SHIFT
+        if slot == None:
+            return default
+        if type(slot) is tuple:
+            if slot[0] == name:
+                return slot[1]
+            return default
+        return slot.get(name, default)
+
+    def __getitem__(self, name):
+        entry = self.get(name)
+        if entry == None:
+            raise KeyError(name)
+        return entry
+
+    def __contains__(self, name):
+        return self.get(name) != None
+
+    def __len__(self):
+        return self.size
+
+    def iteritems(self):
+        stack = [self.root]
+        while stack:
+            slot = stack.pop()
+            if type(slot) is list:
+                stack.extend(slot)
+            elif type(slot) is tuple:
+                yield slot
+            elif slot != None:
+                for item in slot.iteritems():
+                    yield item
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iterkeys(self):
+        for name, entry in self.iteritems():
+            yield name
+
+    __iter__ = iterkeys
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def put(self, name, entry, own):
+        """
+        Set name to entry.  self must be owned.
+        """
+        self.root, added = put_entry(self.root, name, entry, hash(name),
+                                     0, own)
+        if added:
+            self.size += 1
+
+    def remove(self, name, own):
+        """
+        Remove name, returning False if there was no such name.  self
+        must be owned.
+        """
+        if name not in self:
+            return False
+        self.root = remove_entry(self.root, name, hash(name), 0, own)
+        self.size -= 1
+        return True
+
+    def __repr__(self):
+        return "Directory(%r)" % (dict(self.iteritems()),)
+
+
+def put_entry(slot, name, entry, hashed, shift, own):
+    """
+    Returns slot (see Directory), owned, with name set to entry, and
+    whether name is new to it.  hashed is the hash of name, of which
+    the bits from shift on index the nodes at and below slot.
+    """
+    if type(slot) is list:
+        node = own(slot)
+        i = (hashed >> shift) & MASK
+        node[i], added = put_entry(node[i], name, entry, hashed,
+                                   shift + SHIFT, own)
+        return node, added
+    if slot == None:
+        return (name, entry), True
+    if type(slot) is tuple:
+        if slot[0] == name:
+            return (name, entry), False
+        bucket = dict([slot, (name, entry)])
+        added = True
+    else:
+        bucket = own(slot)
+        added = name not in bucket
+        bucket[name] = entry
+    if shift == 0:
+        limit = BUCKET_SIZE
+    else:
+        limit = 1
+    if len(bucket) <= limit or shift >= HASH_BITS:
+        return bucket, added
+    # The node and everything below it are new: none need copying.
+    node = [None] * WIDTH
+    for k, v in bucket.iteritems():
+        i = (hash(k) >> shift) & MASK
+        node[i] = put_entry(node[i], k, v, hash(k), shift + SHIFT,
+                            lambda new: new)[0]
+    return node, added
+
+
+def remove_entry(slot, name, hashed, shift, own):
+    """
+    Returns slot (see Directory), owned, without name, which must be
+    in it.  See put_entry.
+    """
+    if type(slot) is list:
+        node = own(slot)
+        i = (hashed >> shift) & MASK
+        node[i] = remove_entry(node[i], name, hashed, shift + SHIFT, own)
+        return node
+    if type(slot) is tuple:
+        return None
+    bucket = own(slot)
+    del bucket[name]
+    return bucket
+
+
+class PathTree(object):
+    """
+    The tree of paths of a repository, revision by revision.
+
+    A directory is a Directory mapping names to entries: another
+    directory, or a file.  Any entry which is not a Directory is a
+    file: FILE, or something standing for what the file contains.
+    The tree of a revision is never changed once the revision has
+    ended.  Instead, the next revision changes copies of the
+    directories on the way to the paths it touches, sharing all the
+    others with the revisions before it.  A copy thus costs no
+    more than a change, and each revision costs only the parts of
+    the directories it touches which lead to what it changes.
+
+    revs, roots
+        The ascending list of revisions ended so far, and the parallel
+        list of the root directories of their trees.
+
+    keep
+        None, or the set of the only revisions whose trees are kept,
+        e.g. those which are copied from.  The tree of any other
+        revision is changed in place by the revisions after it, which
+        saves copying directories that have many entries and change
+        often.  This matters less since the copy of a large
+        directory is a copy of a few nodes of its trie.
+
+    root
+        The root directory of the current revision.
+
+    owned
+        The directories, and the nodes and buckets of their tries,
+        made for the current revision, which it may change in place,
+        by id.
+    """
+
+    def __init__(self, keep=None):
+        self.revs = []
+        self.roots = []
+        self.root = Directory()
+        self.owned = {}
+        self.keep = keep
+
+    def beginRevision(self, rev):
+        self.rev = rev
+
+    def endRevision(self):
+        if self.keep != None and self.rev not in self.keep:
+            return
+        self.revs.append(self.rev)
+        self.roots.append(self.root)
+        self.owned = {}
+
+    def lookup(self, path, rev=None):
+        """
+        Returns the entry of path@rev (a file or a directory), or None if
+        there was no such path.  rev None means the current revision.
+        A revision which is not in the dumpfile has the tree of the
+        revision before it.  rev must be one of keep, if given.
+        """
+        if rev == None:
+            entry = self.root
+        else:
+            i = bisect_right(self.revs, rev)
+            if i == 0:
+                return None
+            entry = self.roots[i-1]
+        for name in split_path(path):
+            if type(entry) is not Directory:
+                return None
+            entry = entry.get(name)
+            if entry == None:
+                return None
+        return entry
+
+    def own(self, obj):
+        """
+        Returns obj, a Directory or a node or bucket of one, or a copy
+        of it which the current revision may change.
+        """
+        if id(obj) not in self.owned:
+            obj = type(obj)(obj)
+            self.owned[id(obj)] = obj
+        return obj
+
+    def parent(self, names, create=False):
+        """
+        Returns the directory names[:-1] of the current revision, made
+        changeable, or None if it doesn't exist.  If create is True,
+        missing directories are created.
+        """
+        self.root = directory = self.own(self.root)
+        for name in names[:-1]:
+            entry = directory.get(name)
+            if entry == None and create:
+                entry = Directory()
+            elif entry == None or type(entry) is not Directory:
+                return None
+            owned = self.own(entry)
+            if owned is not entry:
+                directory.put(name, owned, self.own)
+            directory = owned
+        return directory
+
+    def add(self, path, entry, create=False):
+        """
+        Put entry at path, replacing whatever was there.  entry may be
+        the entry of another path, or revision: it is shared, not
+        copied.  Returns False if the parent of path is not a directory
+        (and not created).
+        """
+        names = split_path(path)
+        if not names:
+            return False
+        directory = self.parent(names, create)
+        if directory == None:
+            return False
+        directory.put(names[-1], entry, self.own)
+        return True
+
+    def delete(self, path):
+        """
+        Remove path, and everything below it.  Returns False if there
+        was no such path.
+        """
+        names = split_path(path)
+        directory = self.parent(names)
+        if directory == None:
+            return False
+        return directory.remove(names[-1], self.own)
+
+
+class TreeValidator(EventHandler):
+    """
+    The EventHandler behind check_tree().  See PathTree for keep.
+
+    strict
+        False for dumpfiles which don't start at revision 0 or 1, for
+        which missing paths and copy sources are not errors.
+    """
+
+    def __init__(self, keep=None):
+        EventHandler.__init__(self)
+        self.tree = PathTree(keep)
+        self.rev = None
+        self.strict = None
+
+    def onBeginRevision(self, evt):
+        self.rev = int(evt["Revision-number"])
+        if self.strict == None:
+            self.strict = self.rev <= 1
+        self.tree.beginRevision(self.rev)
+
+    def onEndRevisionNodes(self, evt):
+        self.tree.endRevision()
+
+    def onBeginNode(self, node):
+        path = node["Node-path"]
+        action = node["Node-action"]
+        kind = node.get("Node-kind")
+        tree = self.tree
+        current = tree.lookup(path)
+        if action in ("delete", "change", "replace"):
+            if current == None:
+                if self.strict:
+                    self.fail(node, "%s of a path which does not exist"
+                              % (action,))
+            elif (action == "change" and kind != None
+                  and kind != kind_of(current)):
+                self.fail(node, "change of a %s, as a %s"
+                          % (kind_of(current), kind))
+        if action == "change":
+            return
+        if action in ("delete", "replace"):
+            tree.delete(path)
+        if action not in ("add", "replace"):
+            return
+        if action == "add" and current != None:
+            self.fail(node, "add of a path which exists already")
+        entry = self.newEntry(node, kind)
+        if not tree.add(path, entry, create=not self.strict):
+            self.fail(node, "add to a parent which is not a directory")
+
+    def newEntry(self, node, kind):
+        """
+        Returns the entry which node puts at its path: its copy source,
+        a new directory, or FILE.
+        """
+        copyfrom_path = node.get("Node-copyfrom-path")
+        if copyfrom_path == None:
+            if kind == "dir":
+                return Directory()
+            return FILE
+        copyfrom_rev = int(node["Node-copyfrom-rev"])
+        if copyfrom_rev >= self.rev:
+            self.fail(node, "copy from r%d, which is not before r%d"
+                      % (copyfrom_rev, self.rev))
+        entry = self.tree.lookup(copyfrom_path, copyfrom_rev)
+        if entry == None:
+            if self.strict:
+                self.fail(node, "copy from %s@%d, which does not exist"
+                          % (copyfrom_path, copyfrom_rev))
+            if kind == "dir":
+                return Directory()
+            return FILE
+        if kind != None and kind != kind_of(entry):
+            self.fail(node, "copy of a %s as a %s" % (kind_of(entry), kind))
+        return entry
+
+    def fail(self, node, problem):
+        raise TreeError(msg("""
+            r%d %s: %s.
+            """ % (self.rev, node["Node-path"], problem)))
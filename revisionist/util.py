@@ -9,6 +9,7 @@ License
   http://www.gnu.org/licenses/lgpl.html
 """
 
+import os
 import re
 
 pat_blank = re.compile(r'^\s*$')
@@ -92,6 +93,17 @@ def curry(function, *curry_args, **curry_kwargs):
     return _curried
 
 
+def file_size(path):
+    """
+    Returns the size of the file at path in bytes, or 0 if there's no
+    such file.  Useful for scheduling the largest files first.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
 class odict(dict):
     """
     An extension of dict which remembers the insertion order of its
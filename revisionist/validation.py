@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.validation: validation levels and the errors they raise
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+
+The parser and the writer check their input as thoroughly as they are
+asked to.  There are three levels:
+
+PARANOID
+    Everything.  The parser verifies Text-content-sha1 as well as
+    Text-content-md5.  The writer recomputes every checksum on its
+    own, even if the parser has already verified it.
+
+STANDARD
+    Structure, lengths and one checksum.  The parser verifies
+    Text-content-md5.  The writer checks lengths and checks
+    Text-content-md5 against the checksum the parser computed, hashing
+    only text which did not come from the parser.
+
+TRUST_INPUT
+    Structure only: the checks without which the dumpfile can't be
+    parsed or written correctly at all.
+
+These checks are made by raising exceptions, not by assert, so they
+are not disabled by python -O.
+"""
+
+from util import crop_text_block as msg
+
+PARANOID = "paranoid"
+STANDARD = "standard"
+TRUST_INPUT = "trust-input"
+
+LEVELS = [TRUST_INPUT, STANDARD, PARANOID]
+
+
+class DumpfileError(AssertionError):
+    """
+    Raised when a dumpfile, or a stream of parse events, is found to
+    be invalid.
+
+    This derives from AssertionError because that is what revisionist
+    raised before validation was made explicit.
+    """
+
+
+class ParseError(DumpfileError):
+    """
+    Raised by the parser when its input is not a valid dumpfile.
+    """
+
+
+class WriteError(DumpfileError):
+    """
+    Raised by the writer when the parse events it is to write would
+    not make a valid dumpfile.
+    """
+
+
+class TreeError(DumpfileError):
+    """
+    Raised by revisionist.tree.check_tree when a node acts on a path
+    which is not as the node says it is, e.g. deletes a path which
+    doesn't exist.
+    """
+
+
+class BlobError(DumpfileError):
+    """
+    Raised by revisionist.blobs when the text a thin dumpfile refers
+    to is missing from the blob store, or is not what it should be.
+    """
+
+
+def check_level(level):
+    """
+    Returns level if it names a validation level.  Raises ValueError
+    otherwise.
+    """
+    if level not in LEVELS:
+        raise ValueError(msg("""
+            Unknown validation level %r. Expected one of: %s
+            """ % (level, ", ".join(LEVELS))))
+    return level
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+revisionist.verify: check many dumpfiles at once, in a process pool
+(c) 2007 Ben Smith-Mannschott <benpsm@gmail.com>
+
+License
+  GNU Lesser General Public License.
+  http://www.gnu.org/licenses/lgpl.html
+"""
+
+import os
+import time
+import multiprocessing
+from util import file_size
+from validation import STANDARD, check_level
+from parser import Parser, BeginDumpfile, BeginRevision, BeginNode
+from deltas import ContentTracker
+from tree import TreeValidator
+
+
+def verify_dumpfiles(paths, validation=STANDARD, processes=None,
+                     tree=False):
+    """
+    Verify the dumpfiles at paths, generating a VerifyResult for each
+    as soon as it is done.  (That's not necessarily in the order of
+    paths.)  If tree is True, node actions are checked as well.  See
+    verify_dumpfile().
+
+    processes
+        The number of worker processes, by default one per CPU.  With
+        1, the dumpfiles are verified one after the other in this
+        process.
+    """
+    check_level(validation)
+    if processes == None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(paths))
+    if processes <= 1:
+        for path in paths:
+            yield verify_dumpfile(path, validation, tree)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        # Largest first, so that no big dumpfile is left to run on
+        # its own at the end.
+        paths = sorted(paths, key=file_size, reverse=True)
+        for result in pool.imap_unordered(
+            verify_worker, [(path, validation, tree) for path in paths]):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def verify_worker(args):
+    return verify_dumpfile(*args)
+
+
+class VerifyResult(object):
+    """
+    The outcome of verifying one dumpfile.
+
+    path, size
+        The dumpfile and its size in bytes.
+
+    seconds
+        How long verifying it took.
+
+    revisions, nodes
+        How many revisions and nodes were verified.
+
+    error
+        None if the dumpfile is fine, else the message of the first
+        problem found.  rev, node_path and offset then tell where it
+        was found, as far as known.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = None
+        self.seconds = None
+        self.revisions = 0
+        self.nodes = 0
+        self.error = None
+        self.rev = None
+        self.node_path = None
+        self.offset = None
+
+    def throughput(self):
+        """
+        Bytes verified per second.
+        """
+        return self.size / max(self.seconds, 1e-6)
+
+    def where(self):
+        """
+        Describes where the error was found, e.g. "r42 trunk/foo.c at
+        byte 1234".
+        """
+        parts = []
+        if self.rev != None:
+            parts.append("r%d" % (self.rev,))
+        if self.node_path != None:
+            parts.append(self.node_path)
+        if self.offset != None:
+            parts.append("at byte %d" % (self.offset,))
+        return " ".join(parts)
+
+
+class QuietParser(Parser):
+    """
+    A Parser which leaves reporting errors to its caller.
+    """
+
+    def reportError(self):
+        pass
+
+
+def verify_dumpfile(path, validation=STANDARD, tree=False):
+    """
+    Parse the dumpfile at path, checking everything validation calls
+    for, and the text deltas of version 3 dumpfiles.  If tree is True,
+    copies and node actions are checked against the tree of paths too
+    (see revisionist.tree.check_tree).  Returns a VerifyResult.
+    Problems are reported in it, not raised.
+    """
+    result = VerifyResult(path)
+    start = time.time()
+    parser = QuietParser(validation)
+    tracker = None
+    validator = None
+    if tree:
+        validator = TreeValidator()
+    try:
+        result.size = os.path.getsize(path)
+        for evt in parser.parse(file(path, "rb")):
+            cls = type(evt)
+            if cls == BeginNode:
+                result.node_path = evt["Node-path"]
+                result.nodes += 1
+            elif cls == BeginRevision:
+                result.rev = int(evt["Revision-number"])
+                result.node_path = None
+                result.revisions += 1
+            elif cls == BeginDumpfile and evt.version >= 3:
+                tracker = ContentTracker()
+            if tracker != None:
+                tracker.track(evt)
+            if validator != None:
+                validator.handle(evt)
+    except Exception, e:
+        result.error = str(e).strip() or e.__class__.__name__
+        if getattr(parser, "reader", None) != None:
+            result.offset = parser.reader.start
+    if tracker != None:
+        tracker.close()
+    result.seconds = time.time() - start
+    return result
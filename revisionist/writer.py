@@ -11,13 +11,17 @@ License
 
 import sys
 from md5 import md5
+from sha import sha
 from util import crop_text_block as msg
-from parser import BeginDumpfile, EndDumpfile, \
-     BeginRevision, EndRevisionHeader, EndRevisionNodes, \
-     BeginNode, EndNode, UserProperties, TextContent, BlankLine
+from validation import WriteError, check_level, \
+     PARANOID, STANDARD, TRUST_INPUT
+from parser import EndRevisionNodes
+from deltas import make_text_deltas
+from dispatch import EventHandler
 
 
-def write_events_to_dumpfile(events, dstFile):
+def write_events_to_dumpfile(events, dstFile, deltas=False,
+                             validation=STANDARD, flush=False):
     """
     Consume a series of parse events while writing them dstFile as a
     SVN Dumpfile.
@@ -25,91 +29,183 @@ def write_events_to_dumpfile(events, dstFile):
     All events will return exactly the bytes that need to be written
     to the dumpfile when they are asked for their string
     representation.
-    """
-    version = None
-    text_content_md5 = None
-    text_content_length = None
 
+    If deltas is True, a version 3 dumpfile is written in which the
+    text of each node is replaced by a delta against its previous
+    version.  See revisionist.deltas.make_text_deltas.
+
+    validation
+        PARANOID, STANDARD or TRUST_INPUT.  With STANDARD, lengths are
+        checked and Text-content-md5 is compared to the md5 the parser
+        already computed, if any.  PARANOID recomputes checksums
+        (including Text-content-sha1) regardless.  TRUST_INPUT only
+        refuses what the dumpfile version can't express.  See
+        revisionist.validation.
+
+    flush
+        If True, dstFile is flushed at the end of each revision, so
+        that whoever reads it sees complete revisions as soon as they
+        have been written.
+    """
+    writer = DumpfileWriter(dstFile, validation, flush)
+    if deltas:
+        events = make_text_deltas(events)
     try:
         for evt in events:
+            writer.write(evt)
+    finally:
+        dstFile.close()
 
-            # This is all sanity checking, to make sure we don't
-            # silently produce an invalid dump file.
-
-            if type(evt) == BeginDumpfile:
-                # remember the version of the dump file
-                version = evt.version
-                assert 2 <= version <= 3, msg(
-                    """Only dumpfile format versions 2 and 3 are supported.""")
-
-            if version == 2:
-                # Version 2 doesn't support Text and Property deltas,
-                # so make sure we're not using any of those.
-                if type(evt) == UserProperties:
-                    assert None not in evt.values(), msg(
-                        """Property deleting requires Prop-deltas: true
-                           and dump file format version 3 or higher.""")
-                if type(evt) in (BeginRevision, BeginNode):
-                    assert evt.get("Prop-delta") != "true", msg(
-                        """Dump file format must be at least version 3 to
-                        support Prop-deltas.""")
-                if type(evt) == BeginNode:
-                    assert evt.get("Text-delta") != "true", msg(
-                        """Text deltas should not occur in this dumpfile.
-                           Its format is too old to support them.
-                           version = %s""" % (version,))
-
-            if type(evt) == BeginNode:
-                # remember checksum and lengths
-                if evt.get("Text-delta") == "true":
-                    # don't bother to remember the checksum.  we don't
-                    # know how to interpret text deltas.
-                    text_content_md5 = None
-                else:
-                    text_content_md5 = evt.get("Text-content-md5")
-                text_content_length = int(evt.get("Text-content-length", 0))
-                prop_content_length = int(evt.get("Prop-content-length", 0))
-
-            elif type(evt) == EndNode:
-                # forget checksum and size
-                text_content_md5 = None
-                text_content_length = None
-                prop_content_length = None
-
-            elif type(evt) == BeginRevision:
-                prop_content_length = int(evt.get("Prop-content-length", 0))
-
-            elif type(evt) == EndRevisionHeader:
-                prop_content_length = None
-
-            elif type(evt) == TextContent:
-                # validate against text_content_length
-                assert text_content_length == len(evt), msg(
-                    """Text length mismatched.
-                       Text-content-length: %d
-                       Actual length:       %d"""
-                    % ( text_content_length, len(evt) ))
-                # validate the text content against the checksum, if
-                # present.
-                if text_content_md5:
-                    h = md5(evt).hexdigest()
-                    assert h == text_content_md5, msg(
-                           """MD5 mismatch. The Text-content-md5 claimed by
-                              the parent node does not match the computed md5.
-                              expected: %s
-                              computed: %s"""
-                           % (text_content_md5, h))
-
-            elif type(evt) == UserProperties:
-                assert prop_content_length == len(str(evt)), msg(
-                    """Property length mismatched.
-                       Prop-content-length: %d
-                       Actual length:       %d"""
-                    % (prop_content_length, len(str(evt))))
-
-            # this is the actual write to the file. compact, isn't it?
-
-            dstFile.write(str(evt))
 
+def write_events(events, dstFile, validation=STANDARD):
+    """
+    Write parse events to dstFile as they pass through, like
+    write_events_to_dumpfile().  This makes a writer a stage which
+    can be followed by others, e.g. in a branch of tee_events().
+    dstFile is closed once all events have passed.
+    """
+    writer = DumpfileWriter(dstFile, validation)
+    try:
+        for evt in events:
+            writer.write(evt)
+            yield evt
     finally:
         dstFile.close()
+
+
+class DumpfileWriter(EventHandler):
+    """
+    Writes parse events, one at a time, to dstFile as a SVN Dumpfile,
+    checking as it goes that they make a valid one.
+
+    The checks are made by the handlers of the events concerned.  See
+    write_events_to_dumpfile() for the meaning of validation and
+    flush.
+    """
+
+    def __init__(self, dstFile, validation=STANDARD, flush=False):
+        EventHandler.__init__(self)
+        check_level(validation)
+        self.dstFile = dstFile
+        if flush:
+            # EndRevisionNodes writes nothing, so flushing before it
+            # is as good as after.
+            self.register(EndRevisionNodes, lambda evt: dstFile.flush())
+        self.check_lengths = validation != TRUST_INPUT
+        self.check_md5 = validation != TRUST_INPUT
+        self.check_sha1 = validation == PARANOID
+        self.reuse_md5 = validation == STANDARD
+        self.version = None
+        self.text_content_md5 = None
+        self.text_content_sha1 = None
+        self.text_content_length = None
+        self.prop_content_length = None
+
+    def write(self, evt):
+        """
+        Check evt and write it to dstFile.
+        """
+        try:
+            handler = self.handlers[evt.__class__]
+        except KeyError:
+            handler = self.resolve(evt.__class__)
+        if handler != None:
+            handler(evt)
+
+        # this is the actual write to the file. compact, isn't it?
+
+        self.dstFile.write(str(evt))
+
+    # This is all sanity checking, to make sure we don't silently
+    # produce an invalid dump file.
+
+    def onBeginDumpfile(self, evt):
+        # remember the version of the dump file
+        self.version = evt.version
+        if not 2 <= self.version <= 3:
+            raise WriteError(
+                "Only dumpfile format versions 2 and 3 are supported.")
+
+    def checkPropDelta(self, evt):
+        # Version 2 doesn't support Text and Property deltas, so make
+        # sure we're not using any of those.
+        if self.version == 2 and evt.get("Prop-delta") == "true":
+            raise WriteError(msg(
+            """Dump file format must be at least version 3 to
+            support Prop-deltas."""))
+
+    def onBeginRevision(self, evt):
+        self.checkPropDelta(evt)
+        self.prop_content_length = int(evt.get("Prop-content-length", 0))
+
+    def onEndRevisionHeader(self, evt):
+        self.prop_content_length = None
+
+    def onBeginNode(self, evt):
+        self.checkPropDelta(evt)
+        if evt.get("Text-delta") == "true":
+            if self.version == 2:
+                raise WriteError(msg(
+                """Text deltas should not occur in this dumpfile.
+                   Its format is too old to support them.
+                   version = %s""" % (self.version,)))
+            # don't bother to remember the checksum.  we don't know
+            # how to interpret text deltas.
+            self.text_content_md5 = None
+            self.text_content_sha1 = None
+        else:
+            # remember checksum and lengths
+            self.text_content_md5 = evt.get("Text-content-md5")
+            self.text_content_sha1 = evt.get("Text-content-sha1")
+        self.text_content_length = int(evt.get("Text-content-length", 0))
+        self.prop_content_length = int(evt.get("Prop-content-length", 0))
+
+    def onEndNode(self, evt):
+        # forget checksum and size
+        self.text_content_md5 = None
+        self.text_content_sha1 = None
+        self.text_content_length = None
+        self.prop_content_length = None
+
+    def onTextContent(self, evt):
+        # validate against text_content_length
+        if self.check_lengths and self.text_content_length != len(evt):
+            raise WriteError(msg(
+            """Text length mismatched.
+               Text-content-length: %d
+               Actual length:       %d"""
+            % ( self.text_content_length, len(evt) )))
+        # validate the text content against the checksum, if present.
+        expected = self.text_content_md5
+        if self.check_md5 and expected:
+            h = self.reuse_md5 and evt.computed_md5 or md5(evt).hexdigest()
+            if h != expected:
+                raise WriteError(msg(
+                   """MD5 mismatch. The Text-content-md5 claimed by
+                      the parent node does not match the computed md5.
+                      expected: %s
+                      computed: %s"""
+                   % (expected, h)))
+        expected = self.text_content_sha1
+        if self.check_sha1 and expected:
+            h = sha(evt).hexdigest()
+            if h != expected:
+                raise WriteError(msg(
+                   """SHA1 mismatch. The Text-content-sha1 claimed by
+                      the parent node does not match the computed sha1.
+                      expected: %s
+                      computed: %s"""
+                   % (expected, h)))
+
+    def onUserProperties(self, evt):
+        if self.version == 2 and evt.hasDeletions():
+            raise WriteError(msg(
+            """Property deleting requires Prop-deltas: true
+               and dump file format version 3 or higher."""))
+        if (self.check_lengths
+            and self.prop_content_length != len(str(evt))):
+            raise WriteError(msg(
+            """Property length mismatched.
+               Prop-content-length: %d
+               Actual length:       %d"""
+            % (self.prop_content_length, len(str(evt)))))
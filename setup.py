@@ -9,7 +9,10 @@ setup(
     author="Ben Smith-Mannschott",
     author_email="benpsm@gmail.com",
     packages=["revisionist"],
-    scripts=['revisionist-fixprops.py'],
+    scripts=['revisionist-fixprops.py', 'revisionist-merge.py',
+             'revisionist-catalog.py', 'revisionist-verify.py',
+             'revisionist-diff.py', 'revisionist-thin.py',
+             'revisionist-export.py'],
     package_data={'revisionist': ['*.dump2', '*.dump3']}
     )
 
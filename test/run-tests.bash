@@ -8,6 +8,88 @@ then
     STATUS=$(( STATUS + 1 ))
 fi
 
+if ! diff <(python ../revisionist-fixprops.py -p "svn:*" -n --write-binary \
+                < control-m.dump | python ../revisionist-fixprops.py \
+                --read-binary) control-m-corrected.dump
+then
+    echo "FAILED: test of binary events between processes"
+    STATUS=$(( STATUS + 1 ))
+fi
+
+batch=$(mktemp -d)
+cp control-m.dump "$batch/a.dump"
+cp control-m.dump "$batch/b.dump"
+if ! python ../revisionist-fixprops.py -p "svn:*" -n -j 2 "$batch" > /dev/null \
+    || ! diff "$batch/a.dump.fixed" control-m-corrected.dump \
+    || ! diff "$batch/b.dump.fixed" control-m-corrected.dump \
+    || ! test -f "$batch/a.dump.fixed.log"
+then
+    echo "FAILED: test of batch mode"
+    STATUS=$(( STATUS + 1 ))
+fi
+rm -rf "$batch"
+
+served=$(mktemp -d)
+cp control-m.dump "$served/a.dump"
+python ../revisionist-fixprops.py --serve "$served/socket" -j 2 2> /dev/null &
+server=$!
+for i in 1 2 3 4 5 6 7 8 9 10; do
+    test -S "$served/socket" && break
+    sleep 0.5
+done
+if ! python ../revisionist-fixprops.py --connect "$served/socket" \
+        -p "svn:*" -n "$served/a.dump" > /dev/null \
+    || ! diff "$served/a.dump.fixed" control-m-corrected.dump
+then
+    echo "FAILED: test of serving jobs over a socket"
+    STATUS=$(( STATUS + 1 ))
+fi
+kill $server
+wait $server
+rm -rf "$served"
+
+if ! python ../revisionist-diff.py -r :0 control-m.dump \
+        control-m-corrected.dump > /dev/null \
+    || python ../revisionist-diff.py -r 1:1 control-m.dump \
+        control-m-corrected.dump > /dev/null
+then
+    echo "FAILED: test of comparing a range of revisions"
+    STATUS=$(( STATUS + 1 ))
+fi
+
+growing=$(mktemp)
+head -c 300 control-m.dump > "$growing"
+python ../revisionist-fixprops.py -p "svn:*" -n -f --idle-timeout 2 \
+    < "$growing" > "$growing.fixed" &
+sleep 1
+tail -c +301 control-m.dump >> "$growing"
+wait
+if ! diff "$growing.fixed" control-m-corrected.dump
+then
+    echo "FAILED: test of following a growing dumpfile"
+    STATUS=$(( STATUS + 1 ))
+fi
+rm -f "$growing" "$growing.fixed"
+
+store=$(mktemp -d)
+if ! diff <(python ../revisionist-thin.py --min-size 1 "$store" \
+                < control-m.dump 2> /dev/null \
+                | python ../revisionist-thin.py -r "$store") control-m.dump
+then
+    echo "FAILED: test of thin dumpfiles"
+    STATUS=$(( STATUS + 1 ))
+fi
+rm -rf "$store"
+
+exported=$(mktemp -d)
+if ! python ../revisionist-export.py --jobs 2 control-m.dump 1 "$exported" \
+        > /dev/null
+then
+    echo "FAILED: test of exporting a revision"
+    STATUS=$(( STATUS + 1 ))
+fi
+rm -rf "$exported"
+
 cd ../revisionist
 if ! python test.py | grep -q ok
 then